@@ -0,0 +1,118 @@
+"""
+Run the backend benchmark suite fully offline.
+
+    cd backend
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks --output bench.json
+    python -m benchmarks --baseline bench.json --tolerance 0.15
+
+Exits with status 1 when a scenario regresses against the baseline report.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from benchmarks.harness import BenchEnvironment, compare_reports, format_report, load_report, report_metadata, \
+    run_requests
+from benchmarks.scenarios import SCENARIOS
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Backend benchmark suite')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'Comma separated scenarios to run ({", ".join(SCENARIOS)})')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=20, help='Requests in flight at once')
+    parser.add_argument('--portal-sizes', default='10,100,1000',
+                        help='Contact counts used by the load and similar scenarios')
+    parser.add_argument('--pending-states', default='10,1000',
+                        help='Concurrent OAuth flows in progress for the callback scenario')
+    parser.add_argument('--hubspot-latency-ms', type=float, default=0.0, help='Injected HubSpot latency')
+    parser.add_argument('--openai-latency-ms', type=float, default=0.0, help='Injected OpenAI latency')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Uniform jitter added to injected latency')
+    parser.add_argument('--stall-ratio', type=float, default=0.0, help='Fraction of HubSpot calls that stall')
+    parser.add_argument('--stall-ms', type=float, default=2000.0, help='How long a stalled HubSpot call takes')
+    parser.add_argument('--rate-limit-ratio', type=float, default=0.0,
+                        help='Fraction of HubSpot calls answered with 429')
+    parser.add_argument('--redis-url', default=None,
+                        help='Use a local redis-server (e.g. redis://localhost:6379/15) instead of fakeredis')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this path')
+    parser.add_argument('--baseline', help='Compare against a previous JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative regression in throughput / p95 before failing')
+    parser.add_argument('--legacy-credentials', action='store_true',
+                        help='Post the credentials blob in each request instead of a session handle')
+    parser.add_argument('--webhooks', action='store_true',
+                        help='Enable the webhook-maintained contact store, so loads are served from Redis')
+    parser.add_argument('--verbose', action='store_true', help='Keep application logging and prints')
+    return parser.parse_args(argv)
+
+
+def expand_runs(args):
+    """Yield (report name, scenario name, extra scenario kwargs)"""
+    for scenario in args.scenarios.split(','):
+        scenario = scenario.strip()
+        if scenario not in SCENARIOS:
+            raise SystemExit(f'Unknown scenario {scenario!r}')
+        if scenario in ('load', 'similar'):
+            for size in args.portal_sizes.split(','):
+                yield f'{scenario}[{int(size)}]', scenario, {'portal_size': int(size)}
+        elif scenario == 'callback':
+            for pending in args.pending_states.split(','):
+                yield f'callback[{int(pending)}]', scenario, {'pending_states': int(pending)}
+        else:
+            yield scenario, scenario, {}
+
+
+async def run(args) -> dict:
+    report = {'meta': report_metadata(vars(args)), 'scenarios': {}}
+    async with BenchEnvironment(
+            redis_url=args.redis_url,
+            hubspot_latency=args.hubspot_latency_ms / 1000.0,
+            openai_latency=args.openai_latency_ms / 1000.0,
+            jitter=args.jitter_ms / 1000.0,
+            stall_ratio=args.stall_ratio,
+            stall=args.stall_ms / 1000.0,
+            rate_limit_ratio=args.rate_limit_ratio,
+            seed=args.seed,
+            verbose=args.verbose,
+            legacy_credentials=args.legacy_credentials,
+            webhooks=args.webhooks,
+    ) as bench:
+        for name, scenario, kwargs in expand_runs(args):
+            await bench.reset()
+            make_request = await SCENARIOS[scenario](bench, requests=args.requests, **kwargs)
+            result = await run_requests(make_request, args.requests, args.concurrency)
+            result['upstream_calls'] = {
+                'hubspot': bench.hubspot.calls,
+                'hubspot_throttled': bench.hubspot.throttled,
+                'openai': bench.openai.calls,
+            }
+            report['scenarios'][name] = result
+    return report
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print(format_report(report))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        regressions = compare_reports(load_report(args.baseline), report, args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for regression in regressions:
+                print(f'  {regression}')
+            return 1
+        print('\nNo regressions against baseline.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Duplicate-detection benchmark.
+
+The engine run times each phase of the pass over synthetic contacts with planted duplicates and
+scores the candidates against them. The end-to-end run finds and merges duplicates through the
+API, the job queue and the HubSpot stand-in.
+
+    cd backend
+    python -m benchmarks.dedupe --contacts 500000
+    python -m benchmarks.dedupe --contacts 100000 --duplicate-rate 0.1 --output dedupe.json
+    python -m benchmarks.dedupe --end-to-end 5000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import string
+import sys
+import time
+from typing import Dict, List, Set, Tuple
+
+from benchmarks.harness import BENCH_ENV, BenchEnvironment, report_metadata
+from benchmarks.scenarios import open_session
+
+FREE_DOMAINS = ['gmail.com', 'yahoo.com', 'outlook.com', 'icloud.com']
+
+
+def _name_pool(rng: random.Random, size: int) -> List[str]:
+    syllables = [consonant + vowel for consonant in 'bcdfghjklmnprstvz' for vowel in 'aeiou']
+    names = set()
+    while len(names) < size:
+        names.add(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 3))).capitalize())
+    return sorted(names)
+
+
+def _typo(name: str, rng: random.Random) -> str:
+    if len(name) < 4:
+        return name
+    position = rng.randrange(1, len(name) - 1)
+    return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+
+
+def generate_contacts(count: int, duplicate_rate: float, seed: int) -> Tuple[List[Dict], Set[Tuple[str, str]]]:
+    """
+    `count` contacts in HubSpot API shape, a `duplicate_rate` share of them planted near-duplicates,
+    and the (original id, duplicate id) pairs planted
+    """
+    rng = random.Random(seed)
+    first_names = _name_pool(rng, 3000)
+    last_names = _name_pool(rng, 30000)
+    companies = max(count // 20, 10)
+
+    originals = int(count / (1 + duplicate_rate))
+    contacts = []
+    for index in range(originals):
+        first, last = rng.choice(first_names), rng.choice(last_names)
+        company = rng.randrange(companies)
+        if rng.random() < 0.3:
+            email = f'{first.lower()}.{last.lower()}{rng.randrange(1000)}@{rng.choice(FREE_DOMAINS)}'
+        else:
+            email = f'{first.lower()}.{last.lower()}@company{company}.example'
+        contacts.append({'id': str(index + 1), 'properties': {
+            'firstname': first,
+            'lastname': last,
+            'email': email,
+            'phone': f'+1{rng.randrange(2000000000, 9999999999)}' if rng.random() < 0.7 else None,
+            'company': f'Company{company} Inc',
+            'createdate': '2024-01-01T00:00:00.000Z',
+        }})
+
+    planted = set()
+    for number, original in enumerate(rng.sample(contacts, count - originals)):
+        properties = dict(original['properties'], createdate='2024-06-01T00:00:00.000Z')
+        kind = number % 3
+        if kind == 0:
+            properties['email'] = properties['email'].upper()
+            if rng.random() < 0.5:
+                properties['lastname'] = _typo(properties['lastname'], rng)
+        elif kind == 1 and properties['phone']:
+            digits = properties['phone'][-10:]
+            properties['phone'] = f'({digits[:3]}) {digits[3:6]}-{digits[6:]}'
+            properties['email'] = f"{properties['firstname'].lower()}{rng.randrange(100)}@{rng.choice(FREE_DOMAINS)}"
+        else:
+            local, _, domain = properties['email'].partition('@')
+            properties['email'] = f"{local}.{''.join(rng.choices(string.ascii_lowercase, k=3))}@{domain}"
+            properties['phone'] = None
+        duplicate_id = str(len(contacts) + 1)
+        contacts.append({'id': duplicate_id, 'properties': properties})
+        planted.add((original['id'], duplicate_id))
+    rng.shuffle(contacts)
+    return contacts, planted
+
+
+def score_groups(groups: List[Dict], planted: Set[Tuple[str, str]]) -> Dict:
+    proposed = set()
+    for group in groups:
+        ids = [group['primary']] + group['duplicates']
+        proposed.update(tuple(sorted(pair, key=int)) for pair in itertools.combinations(ids, 2))
+    found = len(proposed & planted)
+    return {
+        'planted_pairs': len(planted),
+        'proposed_pairs': len(proposed),
+        'precision': round(found / len(proposed), 4) if proposed else None,
+        'recall': round(found / len(planted), 4) if planted else None,
+    }
+
+
+def run_engine(args) -> Dict:
+    # The engine imports the app's HubSpot module, which reads its configuration at import
+    os.environ.update(BENCH_ENV)
+    from integrations.hubspot_dedupe import compare_blocks, group_matches, index_contacts
+
+    contacts, planted = generate_contacts(args.contacts, args.duplicate_rate, args.seed)
+    timings = {}
+    started = time.perf_counter()
+    records, blocks, oversized_blocks = index_contacts(contacts)
+    timings['index_s'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    matches = compare_blocks(records, blocks)
+    timings['compare_s'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    groups, oversized_groups = group_matches(contacts, matches)
+    timings['group_s'] = time.perf_counter() - started
+    total = sum(timings.values())
+
+    return {
+        'contacts': len(contacts),
+        'blocks': len(blocks),
+        'comparisons': sum(len(members) * (len(members) - 1) // 2 for members in blocks),
+        'naive_comparisons': len(contacts) * (len(contacts) - 1) // 2,
+        'skipped_blocks': oversized_blocks,
+        'skipped_groups': oversized_groups,
+        'groups': len(groups),
+        **{name: round(value, 3) for name, value in timings.items()},
+        'total_s': round(total, 3),
+        'contacts_per_s': round(len(contacts) / total) if total else None,
+        **score_groups(groups, planted),
+    }
+
+
+async def _wait_for_job(client, job_id: str) -> Dict:
+    while True:
+        record = (await client.get(f'/jobs/{job_id}')).json()
+        if record['status'] in ('succeeded', 'failed', 'cancelled'):
+            return record
+        await asyncio.sleep(0.05)
+
+
+async def run_end_to_end(args) -> Dict:
+    async with BenchEnvironment(hubspot_latency=args.hubspot_latency_ms / 1000.0, seed=args.seed) as bench:
+        originals = int(args.end_to_end / (1 + args.duplicate_rate))
+        bench.hubspot.seed_contacts(originals)
+        planted = set(bench.hubspot.seed_duplicates(args.end_to_end - originals))
+        session = await open_session(bench.client, 'bench-org', 'bench-user')
+
+        started = time.perf_counter()
+        job = (await bench.client.post('/integrations/hubspot/contacts/duplicates/jobs', **session.request())).json()
+        record = await _wait_for_job(bench.client, job['id'])
+        detect_s = time.perf_counter() - started
+        result = (await bench.client.get(f'/jobs/{job["id"]}/result')).json()
+        detect_calls = bench.hubspot.calls
+
+        started = time.perf_counter()
+        # Every candidate, not only email matches: the planted duplicates are the ground truth here
+        merge = (await bench.client.post('/integrations/hubspot/contacts/merge/jobs',
+                                         **session.request(job_id=job['id'], min_confidence='0'))).json()
+        merge_record = await _wait_for_job(bench.client, merge['id'])
+        merge_s = time.perf_counter() - started
+        merge_result = (await bench.client.get(f'/jobs/{merge["id"]}/result')).json()
+
+        return {
+            'contacts': args.end_to_end,
+            'detect_status': record['status'],
+            'detect_s': round(detect_s, 3),
+            'detect_upstream_calls': detect_calls,
+            **score_groups(result['groups'], planted),
+            'merge_status': merge_record['status'],
+            'merge_s': round(merge_s, 3),
+            'merge_upstream_calls': bench.hubspot.calls - detect_calls,
+            'merged': merge_result['merged'],
+            'merge_failures': len(merge_result['failed']),
+            'contacts_after_merge': len(bench.hubspot.contacts),
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.dedupe', description='Duplicate detection benchmark')
+    parser.add_argument('--contacts', type=int, default=500000, help='Synthetic contacts for the engine run')
+    parser.add_argument('--duplicate-rate', type=float, default=0.05, help='Planted duplicates per original')
+    parser.add_argument('--end-to-end', type=int, metavar='CONTACTS',
+                        help='Instead, find and merge duplicates among this many contacts through the API')
+    parser.add_argument('--hubspot-latency-ms', type=float, default=0.0, help='End-to-end run only')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this path')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    result = asyncio.run(run_end_to_end(args)) if args.end_to_end else run_engine(args)
+    report = {'meta': report_metadata(vars(args)), 'result': result}
+    for key, value in result.items():
+        print(f'{key:>22}: {value}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+In-process benchmark harness: runs the FastAPI app through httpx.ASGITransport against
+local HubSpot/OpenAI stand-ins and fakeredis (or a local redis-server).
+"""
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.stubs import FakeHubSpot, FakeOpenAI, HUBSPOT_BASE_URL, HUBSPOT_HOST, LatencyProfile, \
+    OPENAI_BASE_URL, OPENAI_HOST, UpstreamRouter
+
+BENCH_ENV = {
+    'HUBSPOT_CLIENT_ID': 'bench-client-id',
+    'HUBSPOT_CLIENT_SECRET': 'bench-client-secret',
+    'HUBSPOT_REDIRECT_URI': 'http://localhost:8000/integrations/hubspot/oauth2callback',
+    'HUBSPOT_AUTH_URL': f'{HUBSPOT_BASE_URL}/oauth/authorize',
+    'HUBSPOT_TOKEN_URL': f'{HUBSPOT_BASE_URL}/oauth/v1/token',
+    'HUBSPOT_API_BASE_URL': HUBSPOT_BASE_URL,
+    'HUBSPOT_SCOPES': 'crm.objects.contacts.read,crm.objects.contacts.write',
+    'OPENAI_API_KEY': 'bench-openai-key',
+    'HUBSPOT_EMBEDDINGS_DIR': os.path.join(tempfile.gettempdir(), 'bench-hubspot-embeddings'),
+    # Keep boto3 from probing the EC2 metadata service while the app imports
+    'AWS_EC2_METADATA_DISABLED': 'true',
+}
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    to_ms = 1000.0
+    return {
+        'mean': round(sum(ordered) / len(ordered) * to_ms, 3) if ordered else 0.0,
+        'p50': round(percentile(ordered, 50) * to_ms, 3),
+        'p90': round(percentile(ordered, 90) * to_ms, 3),
+        'p95': round(percentile(ordered, 95) * to_ms, 3),
+        'p99': round(percentile(ordered, 99) * to_ms, 3),
+        'p999': round(percentile(ordered, 99.9) * to_ms, 3),
+        'max': round(ordered[-1] * to_ms, 3) if ordered else 0.0,
+    }
+
+
+class BenchEnvironment:
+    """
+    Boots the app with its upstreams and Redis replaced by local stand-ins
+    """
+
+    def __init__(
+            self,
+            redis_url: Optional[str] = None,
+            hubspot_latency: float = 0.0,
+            openai_latency: float = 0.0,
+            jitter: float = 0.0,
+            stall_ratio: float = 0.0,
+            stall: float = 0.0,
+            rate_limit_ratio: float = 0.0,
+            seed: int = 0,
+            verbose: bool = False,
+            legacy_credentials: bool = False,
+            webhooks: bool = False,
+    ):
+        os.environ.update(BENCH_ENV)
+        if webhooks:
+            # Read at import: contact loads are served from the webhook-maintained store
+            os.environ['HUBSPOT_WEBHOOKS_ENABLED'] = 'true'
+        self.redis_url = redis_url
+        self.verbose = verbose
+        # Post the token blob in every request body instead of using a session handle
+        self.legacy_credentials = legacy_credentials
+        self.hubspot = FakeHubSpot(
+            portal_size=0,
+            latency=LatencyProfile(hubspot_latency, jitter, seed, stall_ratio, stall),
+            rate_limit_ratio=rate_limit_ratio,
+            seed=seed,
+        )
+        self.openai = FakeOpenAI(latency=LatencyProfile(openai_latency, jitter, seed + 1))
+        self.router = UpstreamRouter({
+            HUBSPOT_HOST: self.hubspot.handle,
+            OPENAI_HOST: self.openai.handle,
+        })
+        self.app = None
+        self.redis = None
+        self.client: Optional[httpx.AsyncClient] = None
+        self._stack = contextlib.AsyncExitStack()
+
+    def install(self):
+        """Point the app at the stand-ins and return it"""
+        # Imported lazily so the app picks up BENCH_ENV when reading its configuration
+        import http_client
+        import main
+        import openai_client
+        import redis_client
+        from openai import AsyncOpenAI
+        from utils.logger import logger
+
+        if not self.verbose:
+            logger.setLevel('CRITICAL')
+
+        if self.redis_url:
+            import redis.asyncio as redis
+            self.redis = redis.from_url(self.redis_url)
+        else:
+            import fakeredis
+            self.redis = fakeredis.FakeAsyncRedis()
+        redis_client.redis_client = self.redis
+
+        transport = self.router.transport()
+        http_client.set_transport(transport)
+        openai_client.client = AsyncOpenAI(
+            api_key=BENCH_ENV['OPENAI_API_KEY'],
+            base_url=OPENAI_BASE_URL,
+            http_client=httpx.AsyncClient(transport=transport),
+        )
+        self.app = main.app
+        return self.app
+
+    async def __aenter__(self) -> 'BenchEnvironment':
+        self.install()
+        if not self.verbose:
+            # The app prints every Redis write; keep that cost but not the noise
+            devnull = self._stack.enter_context(open(os.devnull, 'w'))
+            self._stack.enter_context(contextlib.redirect_stdout(devnull))
+        await self._stack.enter_async_context(self.app.router.lifespan_context(self.app))
+        self.client = await self._stack.enter_async_context(httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app),
+            base_url='http://backend.bench',
+            timeout=None,
+        ))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._stack.aclose()
+        import http_client
+        http_client.set_transport(None)
+
+    async def reset(self):
+        """Clear Redis and upstream call counters between scenarios"""
+        await self.redis.flushdb()
+        self.hubspot.calls = 0
+        self.hubspot.throttled = 0
+        self.openai.calls = 0
+        self.openai.prompts = []
+
+
+RequestFactory = Callable[[int], Awaitable[httpx.Response]]
+
+
+async def run_requests(make_request: RequestFactory, requests: int, concurrency: int) -> Dict:
+    """
+    Issue `requests` calls with at most `concurrency` in flight and measure each one
+    """
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                response = await make_request(index)
+                statuses[str(response.status_code)] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, requests)))))
+    duration = time.perf_counter() - started
+
+    errors = sum(count for status, count in statuses.items() if not status.startswith(('2', '3')))
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'duration_s': round(duration, 4),
+        'throughput_rps': round(requests / duration, 2) if duration else 0.0,
+        'errors': errors,
+        'status_codes': dict(statuses),
+        'latency_ms': summarize_latencies(latencies),
+    }
+
+
+def report_metadata(args: Dict) -> Dict:
+    try:
+        revision = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        revision = 'unknown'
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': args,
+    }
+
+
+def format_report(report: Dict) -> str:
+    header = f"{'scenario':<28}{'req':>7}{'conc':>6}{'rps':>10}{'p50ms':>10}{'p95ms':>10}{'p99ms':>10}{'err':>6}"
+    lines = [header, '-' * len(header)]
+    for name, result in report['scenarios'].items():
+        latency = result['latency_ms']
+        lines.append(
+            f"{name:<28}{result['requests']:>7}{result['concurrency']:>6}{result['throughput_rps']:>10.1f}"
+            f"{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}{result['errors']:>6}"
+        )
+    return '\n'.join(lines)
+
+
+def compare_reports(baseline: Dict, current: Dict, tolerance: float) -> List[str]:
+    """
+    List regressions where throughput dropped or p95 latency rose by more than `tolerance`
+    """
+    regressions = []
+    for name, result in current['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        if result['throughput_rps'] < previous['throughput_rps'] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']:.1f} -> {result['throughput_rps']:.1f} rps"
+            )
+        if result['latency_ms']['p95'] > previous['latency_ms']['p95'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p95 {previous['latency_ms']['p95']:.2f} -> {result['latency_ms']['p95']:.2f} ms"
+            )
+        if result['errors'] > previous['errors']:
+            regressions.append(f"{name}: errors {previous['errors']} -> {result['errors']}")
+    return regressions
+
+
+def load_report(path: str) -> Dict:
+    with open(path) as f:
+        return json.load(f)
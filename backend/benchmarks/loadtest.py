@@ -0,0 +1,352 @@
+"""
+Multi-tenant load-test driver.
+
+Replays a weighted mix of authorize / callback / load / CRUD / summarize traffic from many
+orgs and users, either in-process (one event loop == one uvicorn worker) or against uvicorn
+workers started with benchmarks/serve.py. Arrival rates are stepped up until the app
+saturates, and the report gives the saturation throughput per worker, tail latencies per
+operation and a worker/container estimate for a target peak rate.
+
+    cd backend
+    python -m benchmarks.loadtest --profile steady --rates 25,50,100,200,400
+    python -m benchmarks.loadtest --target http://localhost:8000 --workers 4 --rates 100,200,400,800
+    python -m benchmarks.loadtest --concurrency 50 --duration 20     # closed loop instead of arrival rates
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from benchmarks.harness import BenchEnvironment, report_metadata, summarize_latencies
+from benchmarks.scenarios import Session, form, open_session
+
+OPERATIONS = ['authorize', 'callback', 'load', 'create', 'update', 'delete', 'summarize']
+
+# Relative weights per operation
+PROFILES = {
+    # Day-to-day usage: mostly contact list refreshes and edits
+    'steady': {'authorize': 2, 'callback': 2, 'load': 40, 'create': 12, 'update': 20, 'delete': 6, 'summarize': 18},
+    # Tenant-wide onboarding push: OAuth flows dominate
+    'onboarding': {'authorize': 35, 'callback': 35, 'load': 25, 'create': 2, 'update': 2, 'delete': 1, 'summarize': 0},
+    # Sales teams summarizing their pipeline
+    'summarize-heavy': {'authorize': 1, 'callback': 1, 'load': 20, 'create': 3, 'update': 5, 'delete': 0, 'summarize': 70},
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse 'load=5,summarize=2' into operation weights"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f'Unknown operation {name!r}, expected one of {OPERATIONS}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class TenantTraffic:
+    """
+    Issues operations on behalf of `orgs * users_per_org` tenants and records their latency
+    """
+
+    def __init__(self, client: httpx.AsyncClient, mix: Dict[str, float], orgs: int, users_per_org: int,
+                 portal_size: int, seed: int = 0):
+        self.client = client
+        self.operations = [name for name, weight in mix.items() if weight > 0]
+        self.weights = [mix[name] for name in self.operations]
+        self.tenants = [(f'org{org}', f'user{user}') for org in range(orgs) for user in range(users_per_org)]
+        self.portal_size = portal_size
+        # Only the latest authorize per tenant is valid: the app keeps one state key per org/user
+        self.pending_states: Dict[Tuple[str, str], str] = {}
+        self.sessions: Dict[Tuple[str, str], Session] = {}
+        self.created: List[str] = []
+        self.random = random.Random(seed)
+        self.samples: List[Tuple[str, float, str]] = []
+
+    async def open_sessions(self, legacy: bool = False):
+        """Connect every tenant up front so the measured steps only contain steady-state traffic"""
+        for tenant in self.tenants:
+            self.sessions[tenant] = await open_session(self.client, tenant[0], tenant[1], legacy)
+
+    def _contact_id(self) -> str:
+        # Seeded contacts are never deleted by the driver, so updates and summaries always hit
+        return str(self.random.randint(1, max(self.portal_size, 1)))
+
+    async def _authorize(self, tenant) -> httpx.Response:
+        org_id, user_id = tenant
+        response = await self.client.post('/integrations/hubspot/authorize', files=form(user_id=user_id, org_id=org_id))
+        if response.status_code == 200:
+            self.pending_states[tenant] = parse_qs(urlparse(response.json()).query)['state'][0]
+        return response
+
+    async def _perform(self, operation: str, tenant) -> httpx.Response:
+        session = self.sessions[tenant]
+        if operation == 'authorize':
+            return await self._authorize(tenant)
+        if operation == 'callback':
+            state = self.pending_states.pop(tenant)
+            return await self.client.get(
+                '/integrations/hubspot/oauth2callback',
+                params={'code': f'code-{self.random.getrandbits(32)}', 'state': state},
+            )
+        if operation == 'load':
+            return await self.client.post('/integrations/hubspot/load', **session.request())
+        if operation == 'create':
+            contact = {
+                'firstname': 'Load',
+                'lastname': tenant[1],
+                'email': f'{tenant[0]}.{tenant[1]}.{self.random.getrandbits(48):x}@load.example',
+                'company': tenant[0],
+            }
+            response = await self.client.post(
+                '/integrations/hubspot/contacts',
+                **session.request(contact_data=json.dumps(contact)),
+            )
+            if response.status_code == 200:
+                self.created.append(response.json().get('id'))
+            return response
+        if operation == 'update':
+            return await self.client.patch(
+                f'/integrations/hubspot/contacts/{self._contact_id()}',
+                **session.request(contact_data=json.dumps({'company': tenant[0]})),
+            )
+        if operation == 'delete':
+            contact_id = self.created.pop() if self.created else f'missing-{self.random.getrandbits(32)}'
+            return await self.client.request(
+                'DELETE', f'/integrations/hubspot/contacts/{contact_id}', **session.request()
+            )
+        return await self.client.post(
+            f'/integrations/hubspot/contacts/{self._contact_id()}/summarize',
+            **session.request(),
+        )
+
+    async def issue(self, scheduled_at: Optional[float] = None):
+        """
+        Run one randomly chosen operation. Open-loop latency is measured from the scheduled
+        arrival time so queueing inside the driver is not hidden (coordinated omission)
+        """
+        tenant = self.random.choice(self.tenants)
+        operation = self.random.choices(self.operations, self.weights)[0]
+        if operation == 'callback' and tenant not in self.pending_states:
+            operation = 'authorize'
+
+        start = scheduled_at if scheduled_at is not None else time.perf_counter()
+        try:
+            response = await self._perform(operation, tenant)
+            status = str(response.status_code)
+        except Exception as e:
+            status = type(e).__name__
+        self.samples.append((operation, time.perf_counter() - start, status))
+
+
+async def run_open_loop(traffic: TenantTraffic, rate: float, duration: float, max_in_flight: int) -> Dict:
+    """Poisson arrivals at `rate` per second for `duration` seconds"""
+    traffic.samples = []
+    in_flight = set()
+    dropped = 0
+    arrivals = 0
+    started = time.perf_counter()
+    next_arrival = started
+    while True:
+        next_arrival += traffic.random.expovariate(rate)
+        if next_arrival - started >= duration:
+            break
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        arrivals += 1
+        if len(in_flight) >= max_in_flight:
+            dropped += 1
+            continue
+        task = asyncio.create_task(traffic.issue(next_arrival))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return summarize_step(traffic.samples, time.perf_counter() - started, offered_rps=rate,
+                          arrivals=arrivals, dropped=dropped)
+
+
+async def run_closed_loop(traffic: TenantTraffic, concurrency: int, duration: float, think_time: float) -> Dict:
+    """`concurrency` virtual users issuing requests back to back with optional think time"""
+    traffic.samples = []
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def virtual_user():
+        while time.perf_counter() < deadline:
+            await traffic.issue()
+            if think_time:
+                await asyncio.sleep(traffic.random.expovariate(1.0 / think_time))
+
+    await asyncio.gather(*(virtual_user() for _ in range(concurrency)))
+    return summarize_step(traffic.samples, time.perf_counter() - started, concurrency=concurrency)
+
+
+def summarize_step(samples: List[Tuple[str, float, str]], elapsed: float, **extra) -> Dict:
+    by_operation = defaultdict(list)
+    statuses = Counter()
+    errors = 0
+    for operation, latency, status in samples:
+        by_operation[operation].append(latency)
+        statuses[status] += 1
+        if not status.startswith(('2', '3')):
+            errors += 1
+    completed = len(samples)
+    return {
+        **extra,
+        'completed': completed,
+        'elapsed_s': round(elapsed, 3),
+        'achieved_rps': round((completed - errors) / elapsed, 2) if elapsed else 0.0,
+        'error_rate': round(errors / completed, 4) if completed else 0.0,
+        'status_codes': dict(statuses),
+        'latency_ms': summarize_latencies([latency for _, latency, _ in samples]),
+        'operations': {
+            operation: {'count': len(latencies), 'latency_ms': summarize_latencies(latencies)}
+            for operation, latencies in sorted(by_operation.items())
+        },
+    }
+
+
+def is_saturated(step: Dict, slo_p99_ms: float, max_error_rate: float) -> bool:
+    # Open-loop latency includes queueing, so an overloaded worker shows up as a blown p99
+    return (
+            step['dropped'] > 0
+            or step['latency_ms']['p99'] > slo_p99_ms
+            or step['error_rate'] > max_error_rate
+    )
+
+
+def capacity_plan(saturation_rps: float, workers: int, target_rps: Optional[float], headroom: float,
+                  workers_per_container: int) -> Dict:
+    per_worker = saturation_rps / workers if workers else 0.0
+    plan = {'saturation_rps': round(saturation_rps, 2), 'saturation_rps_per_worker': round(per_worker, 2)}
+    if target_rps and per_worker:
+        workers_needed = math.ceil(target_rps / (per_worker * headroom))
+        plan.update({
+            'target_rps': target_rps,
+            'headroom': headroom,
+            'workers_needed': workers_needed,
+            'workers_per_container': workers_per_container,
+            'containers_needed': math.ceil(workers_needed / workers_per_container),
+        })
+    return plan
+
+
+def format_steps(steps: List[Dict]) -> str:
+    header = f"{'offered':>9}{'achieved':>10}{'drop':>6}{'err%':>7}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'p999ms':>9}"
+    lines = [header, '-' * len(header)]
+    for step in steps:
+        latency = step['latency_ms']
+        offered = step.get('offered_rps', step.get('concurrency', 0))
+        lines.append(
+            f"{offered:>9}{step['achieved_rps']:>10.1f}{step.get('dropped', 0):>6}{step['error_rate'] * 100:>7.2f}"
+            f"{latency['p50']:>9.1f}{latency['p95']:>9.1f}{latency['p99']:>9.1f}{latency['p999']:>9.1f}"
+        )
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest', description='Multi-tenant load test')
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='steady')
+    parser.add_argument('--mix', type=parse_mix, help='Override weights, e.g. load=5,summarize=2')
+    parser.add_argument('--orgs', type=int, default=50)
+    parser.add_argument('--users-per-org', type=int, default=4)
+    parser.add_argument('--portal-size', type=int, default=100, help='Contacts in the stand-in portal')
+    parser.add_argument('--rates', default='25,50,100,200,400',
+                        help='Arrival rates (req/s) to step through in open-loop mode')
+    parser.add_argument('--concurrency', type=int,
+                        help='Closed-loop mode: number of virtual users instead of arrival rates')
+    parser.add_argument('--think-time-ms', type=float, default=0.0, help='Mean think time in closed-loop mode')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per step')
+    parser.add_argument('--max-in-flight', type=int, default=1000, help='Open-loop cap before arrivals are dropped')
+    parser.add_argument('--slo-p99-ms', type=float, default=1000.0, help='p99 latency above which a step saturates')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--keep-going', action='store_true', help='Run every rate even after saturation')
+    parser.add_argument('--target', help='Base URL of uvicorn workers started with benchmarks/serve.py')
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn workers behind --target')
+    parser.add_argument('--target-rps', type=float, help='Peak rate to size the deployment for')
+    parser.add_argument('--headroom', type=float, default=0.7, help='Fraction of saturation to plan up to')
+    parser.add_argument('--workers-per-container', type=int, default=1)
+    parser.add_argument('--hubspot-latency-ms', type=float, default=50.0, help='In-process mode only')
+    parser.add_argument('--openai-latency-ms', type=float, default=400.0, help='In-process mode only')
+    parser.add_argument('--jitter-ms', type=float, default=20.0, help='In-process mode only')
+    parser.add_argument('--redis-url', help='In-process mode: local redis-server instead of fakeredis')
+    parser.add_argument('--legacy-credentials', action='store_true',
+                        help='Post the credentials blob in each request instead of a session handle')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this path')
+    return parser.parse_args(argv)
+
+
+async def drive(args, client: httpx.AsyncClient) -> List[Dict]:
+    traffic = TenantTraffic(client, args.mix or PROFILES[args.profile], args.orgs, args.users_per_org,
+                            args.portal_size, args.seed)
+    await traffic.open_sessions(args.legacy_credentials)
+    if args.concurrency:
+        return [await run_closed_loop(traffic, args.concurrency, args.duration, args.think_time_ms / 1000.0)]
+
+    steps = []
+    for rate in (float(rate) for rate in args.rates.split(',')):
+        step = await run_open_loop(traffic, rate, args.duration, args.max_in_flight)
+        step['saturated'] = is_saturated(step, args.slo_p99_ms, args.max_error_rate)
+        steps.append(step)
+        if step['saturated'] and not args.keep_going:
+            break
+    return steps
+
+
+async def run(args) -> Dict:
+    if args.target:
+        limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+        async with httpx.AsyncClient(base_url=args.target, timeout=None, limits=limits) as client:
+            steps = await drive(args, client)
+        workers = args.workers
+    else:
+        async with BenchEnvironment(
+                redis_url=args.redis_url,
+                hubspot_latency=args.hubspot_latency_ms / 1000.0,
+                openai_latency=args.openai_latency_ms / 1000.0,
+                jitter=args.jitter_ms / 1000.0,
+                seed=args.seed,
+        ) as bench:
+            bench.hubspot.seed_contacts(args.portal_size)
+            steps = await drive(args, bench.client)
+        workers = 1
+
+    sustained = [step['achieved_rps'] for step in steps if not step.get('saturated')]
+    saturation = max(sustained) if sustained else 0.0
+    if args.concurrency:
+        saturation = steps[0]['achieved_rps']
+    return {
+        'meta': report_metadata(vars(args)),
+        'steps': steps,
+        'capacity': capacity_plan(saturation, workers, args.target_rps, args.headroom, args.workers_per_container),
+    }
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    print(format_steps(report['steps']))
+    print()
+    for key, value in report['capacity'].items():
+        print(f'{key:>28}: {value}')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Multi-worker scaling benchmark.
+
+Starts the backend (benchmarks/serve.py stand-ins) with 1, 2, 4... worker processes, drives the
+same closed-loop load against each, and reports throughput per worker count with the speedup
+and parallel efficiency over a single worker. Throughput only scales up to the number of cores,
+which the report records; the driver runs in its own processes (--drivers) so it does not
+become the bottleneck on the cores it shares with the server.
+
+    cd backend
+    python -m benchmarks.scaling --workers 1,2,4 --concurrency 64 --drivers 2
+    python -m benchmarks.scaling --server gunicorn --workers 1,2,4,8 --mix load=4,update=1
+    BENCH_REDIS_URL=redis://localhost:6379/15 python -m benchmarks.scaling --sessions
+
+Each worker has its own fakeredis unless BENCH_REDIS_URL points them at a shared Redis, so by
+default tenants post their credentials blob with every request instead of a session handle.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.harness import report_metadata
+from benchmarks.loadtest import TenantTraffic, parse_mix, run_closed_loop, summarize_step
+
+STARTUP_TIMEOUT = 60.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server: str, workers: int, port: int, args) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        BENCH_PORTAL_SIZE=str(args.portal_size),
+        BENCH_HUBSPOT_LATENCY_MS=str(args.hubspot_latency_ms),
+        BENCH_OPENAI_LATENCY_MS=str(args.openai_latency_ms),
+        WEB_CONCURRENCY=str(workers),
+        PORT=str(port),
+        # The stand-ins are wired in per worker by the app factory, so nothing is preloaded
+        GUNICORN_PRELOAD='false',
+        GUNICORN_LOG_LEVEL='warning',
+    )
+    if server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+                   'benchmarks.serve:create_app()']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'benchmarks.serve:create_app', '--factory',
+                   '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+                   '--no-access-log', '--log-level', 'warning']
+    return subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def wait_until_healthy(process: subprocess.Popen, base_url: str):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with status {process.returncode}')
+        try:
+            if httpx.get(f'{base_url}/health', timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server did not become healthy within {STARTUP_TIMEOUT:.0f}s')
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+async def _drive(base_url: str, mix: Dict[str, float], concurrency: int, args, seed: int) -> Dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        traffic = TenantTraffic(client, mix, args.orgs, args.users_per_org, args.portal_size, seed)
+        await traffic.open_sessions(legacy=not args.sessions)
+        if args.warmup:
+            await run_closed_loop(traffic, concurrency, args.warmup, 0.0)
+        step = await run_closed_loop(traffic, concurrency, args.duration, 0.0)
+    return {'samples': traffic.samples, 'elapsed': step['elapsed_s']}
+
+
+def drive_process(base_url: str, mix: Dict[str, float], concurrency: int, args, seed: int) -> Dict:
+    return asyncio.run(_drive(base_url, mix, concurrency, args, seed))
+
+
+def measure(base_url: str, mix: Dict[str, float], args) -> Dict:
+    """One closed-loop step split across `args.drivers` processes, merged into one summary"""
+    per_driver = [args.concurrency // args.drivers + (index < args.concurrency % args.drivers)
+                  for index in range(args.drivers)]
+    with ProcessPoolExecutor(max_workers=args.drivers) as pool:
+        futures = [pool.submit(drive_process, base_url, mix, concurrency, args, args.seed + index)
+                   for index, concurrency in enumerate(per_driver) if concurrency]
+        results = [future.result() for future in futures]
+    samples = [sample for result in results for sample in result['samples']]
+    return summarize_step(samples, max(result['elapsed'] for result in results), concurrency=args.concurrency)
+
+
+def run(args) -> Dict:
+    mix = args.mix or {'load': 1}
+    steps: List[Dict] = []
+    for workers in (int(count) for count in args.workers.split(',')):
+        port = _free_port()
+        base_url = f'http://127.0.0.1:{port}'
+        process = start_server(args.server, workers, port, args)
+        try:
+            wait_until_healthy(process, base_url)
+            step = measure(base_url, mix, args)
+        finally:
+            stop_server(process)
+        step['workers'] = workers
+        steps.append(step)
+        print(f"{workers} workers: {step['achieved_rps']:.1f} req/s", file=sys.stderr)
+
+    baseline = steps[0]['achieved_rps'] / steps[0]['workers'] if steps and steps[0]['achieved_rps'] else None
+    for step in steps:
+        speedup = step['achieved_rps'] / baseline if baseline else 0.0
+        step['speedup'] = round(speedup, 2)
+        step['efficiency'] = round(speedup / step['workers'], 2)
+    return {'meta': report_metadata(vars(args)), 'steps': steps}
+
+
+def format_steps(steps: List[Dict]) -> str:
+    header = f"{'workers':>8}{'req/s':>10}{'speedup':>9}{'effic.':>8}{'err%':>7}{'p50ms':>9}{'p99ms':>9}"
+    lines = [header, '-' * len(header)]
+    for step in steps:
+        latency = step['latency_ms']
+        lines.append(
+            f"{step['workers']:>8}{step['achieved_rps']:>10.1f}{step['speedup']:>9.2f}{step['efficiency']:>8.2f}"
+            f"{step['error_rate'] * 100:>7.2f}{latency['p50']:>9.1f}{latency['p99']:>9.1f}"
+        )
+    return '\n'.join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.scaling', description='Multi-worker scaling benchmark')
+    parser.add_argument('--server', choices=('uvicorn', 'gunicorn'), default='uvicorn')
+    parser.add_argument('--workers', default='1,2,4', help='Comma separated worker counts to measure')
+    parser.add_argument('--mix', type=parse_mix, help='Operation weights, e.g. load=4,update=1 (default: load)')
+    parser.add_argument('--concurrency', type=int, default=64, help='Virtual users across all drivers')
+    parser.add_argument('--drivers', type=int, default=max((os.cpu_count() or 1) // 2, 1),
+                        help='Load-generator processes')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds measured per worker count')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds of unmeasured load first')
+    parser.add_argument('--orgs', type=int, default=20)
+    parser.add_argument('--users-per-org', type=int, default=4)
+    parser.add_argument('--portal-size', type=int, default=200, help='Contacts in the stand-in portal')
+    parser.add_argument('--hubspot-latency-ms', type=float, default=0.0)
+    parser.add_argument('--openai-latency-ms', type=float, default=0.0)
+    parser.add_argument('--sessions', action='store_true',
+                        help='Use session handles; needs BENCH_REDIS_URL shared by all workers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this path')
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    print(format_steps(report['steps']))
+    print(f"\ncores: {report['meta']['cpu_count']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Benchmark scenarios. Each scenario prepares state on the BenchEnvironment and returns a
+request factory that the harness drives with the configured concurrency.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+from benchmarks.harness import BENCH_ENV, BenchEnvironment, RequestFactory
+
+BENCH_CREDENTIALS = json.dumps({
+    'access_token': 'bench-access-token',
+    'refresh_token': 'bench-refresh-token',
+    'expires_in': 1800,
+    'token_type': 'bearer',
+})
+
+
+def form(**fields) -> Optional[Dict]:
+    """Multipart form fields, matching the FormData bodies the frontend sends"""
+    return {name: (None, value) for name, value in fields.items()} or None
+
+
+class Session:
+    """
+    Authenticates benchmark requests the way the frontend does: a session handle in the
+    Authorization header, or the legacy credentials form field when there is no handle
+    """
+
+    def __init__(self, handle: Optional[str] = None):
+        self.handle = handle
+
+    def request(self, **fields) -> Dict:
+        """httpx request kwargs carrying the session plus the given form fields"""
+        if self.handle is None:
+            return {'files': form(credentials=BENCH_CREDENTIALS, **fields)}
+        return {'headers': {'Authorization': f'Bearer {self.handle}'}, 'files': form(**fields)}
+
+
+async def open_session(client: httpx.AsyncClient, org_id: str, user_id: str, legacy: bool = False) -> Session:
+    """Connect HubSpot through the real authorize / callback / credentials flow"""
+    if legacy:
+        return Session()
+    response = await client.post('/integrations/hubspot/authorize', files=form(user_id=user_id, org_id=org_id))
+    state = parse_qs(urlparse(response.json()).query)['state'][0]
+    await client.get('/integrations/hubspot/oauth2callback', params={'code': 'bench-code', 'state': state})
+    response = await client.post('/integrations/hubspot/credentials', files=form(user_id=user_id, org_id=org_id))
+    return Session(response.json()['session'])
+
+
+async def load_scenario(bench: BenchEnvironment, portal_size: int, **_) -> RequestFactory:
+    """POST /integrations/hubspot/load against a portal with `portal_size` contacts"""
+    bench.hubspot.seed_contacts(portal_size)
+    session = await open_session(bench.client, 'bench-org', 'bench-user', bench.legacy_credentials)
+
+    async def make_request(index: int):
+        return await bench.client.post('/integrations/hubspot/load', **session.request())
+
+    return make_request
+
+
+async def crud_scenario(bench: BenchEnvironment, requests: int, **_) -> RequestFactory:
+    """Interleaved create / update / delete bursts on the contacts endpoints"""
+    bench.hubspot.seed_contacts(requests)
+    contact_ids = list(bench.hubspot.contacts)
+    session = await open_session(bench.client, 'bench-org', 'bench-user', bench.legacy_credentials)
+
+    async def make_request(index: int):
+        operation = index % 3
+        contact_id = contact_ids[index]
+        if operation == 0:
+            contact = {
+                'firstname': 'Bench',
+                'lastname': f'Contact{index}',
+                'email': f'bench{index}@crud.example',
+                'phone': '+15550000000',
+                'company': 'Bench Inc',
+            }
+            return await bench.client.post(
+                '/integrations/hubspot/contacts',
+                **session.request(contact_data=json.dumps(contact)),
+            )
+        if operation == 1:
+            return await bench.client.patch(
+                f'/integrations/hubspot/contacts/{contact_id}',
+                **session.request(contact_data=json.dumps({'company': f'Updated {index}'})),
+            )
+        return await bench.client.request(
+            'DELETE',
+            f'/integrations/hubspot/contacts/{contact_id}',
+            **session.request(),
+        )
+
+    return make_request
+
+
+async def callback_scenario(bench: BenchEnvironment, requests: int, pending_states: int, **_) -> RequestFactory:
+    """
+    GET /integrations/hubspot/oauth2callback while `pending_states` other OAuth flows are in progress
+    """
+    states = []
+    for index in range(pending_states + requests):
+        response = await bench.client.post(
+            '/integrations/hubspot/authorize',
+            files=form(user_id=f'user{index}', org_id=f'org{index % 10}'),
+        )
+        auth_url = response.json()
+        states.append(parse_qs(urlparse(auth_url).query)['state'][0])
+
+    async def make_request(index: int):
+        return await bench.client.get(
+            '/integrations/hubspot/oauth2callback',
+            params={'code': f'bench-code-{index}', 'state': states[index]},
+        )
+
+    return make_request
+
+
+async def summarize_scenario(bench: BenchEnvironment, requests: int, **_) -> RequestFactory:
+    """POST /integrations/hubspot/contacts/{id}/summarize through the fake OpenAI server"""
+    bench.hubspot.seed_contacts(min(requests, 1000))
+    contact_ids = list(bench.hubspot.contacts)
+    session = await open_session(bench.client, 'bench-org', 'bench-user', bench.legacy_credentials)
+
+    async def make_request(index: int):
+        contact_id = contact_ids[index % len(contact_ids)]
+        return await bench.client.post(
+            f'/integrations/hubspot/contacts/{contact_id}/summarize',
+            **session.request(),
+        )
+
+    return make_request
+
+
+async def similar_scenario(bench: BenchEnvironment, portal_size: int, **_) -> RequestFactory:
+    """GET /integrations/hubspot/contacts/{id}/similar once the embeddings job has indexed the portal"""
+    bench.hubspot.seed_contacts(portal_size)
+    contact_ids = list(bench.hubspot.contacts)
+    session = await open_session(bench.client, 'bench-org', 'bench-user')
+    response = await bench.client.post('/integrations/hubspot/contacts/embeddings/jobs', **session.request())
+    job_id = response.json()['id']
+    while (await bench.client.get(f'/jobs/{job_id}')).json()['status'] not in ('succeeded', 'failed', 'cancelled'):
+        await asyncio.sleep(0.05)
+
+    async def make_request(index: int):
+        contact_id = contact_ids[index * 7919 % len(contact_ids)]
+        return await bench.client.get(
+            f'/integrations/hubspot/contacts/{contact_id}/similar',
+            headers={'Authorization': f'Bearer {session.handle}'},
+        )
+
+    return make_request
+
+
+async def files_scenario(bench: BenchEnvironment, requests: int, **_) -> RequestFactory:
+    """Alternating contact file uploads (streamed to the Files API) and file listings"""
+    bench.hubspot.seed_contacts(10)
+    contact_ids = list(bench.hubspot.contacts)
+    session = await open_session(bench.client, 'bench-org', 'bench-user')
+    document = b'%PDF-1.4 benchmark ' * (256 * 1024 // 19)
+
+    async def make_request(index: int):
+        contact_id = contact_ids[index % len(contact_ids)]
+        url = f'/integrations/hubspot/contacts/{contact_id}/files'
+        if index % 2 == 0:
+            return await bench.client.post(
+                url,
+                headers={'Authorization': f'Bearer {session.handle}'},
+                files={'file': (f'document-{index}.pdf', document, 'application/pdf')},
+            )
+        return await bench.client.get(url, headers={'Authorization': f'Bearer {session.handle}'})
+
+    return make_request
+
+
+def webhook_request(url: str, events: list) -> Dict:
+    """httpx request kwargs for a webhook delivery signed the way HubSpot signs v3 requests"""
+    body = json.dumps(events).encode()
+    timestamp = str(int(time.time() * 1000))
+    message = f'POST{url}'.encode() + body + timestamp.encode()
+    secret = BENCH_ENV['HUBSPOT_CLIENT_SECRET'].encode()
+    signature = base64.b64encode(hmac.new(secret, message, hashlib.sha256).digest()).decode()
+    return {
+        'content': body,
+        'headers': {
+            'Content-Type': 'application/json',
+            'X-HubSpot-Signature-v3': signature,
+            'X-HubSpot-Request-Timestamp': timestamp,
+        },
+    }
+
+
+async def webhooks_scenario(bench: BenchEnvironment, requests: int, **_) -> RequestFactory:
+    """POST /integrations/hubspot/webhooks with batches of contact property changes"""
+    bench.hubspot.seed_contacts(1000)
+    session = await open_session(bench.client, 'bench-org', 'bench-user')
+    # Connects the portal to its user and, when the store is enabled, queues the initial crawl
+    await bench.client.post('/integrations/hubspot/load', **session.request())
+    url = f"{str(bench.client.base_url).rstrip('/')}/integrations/hubspot/webhooks"
+
+    async def make_request(index: int):
+        events = bench.hubspot.change_events(10, int(time.time() * 1000))
+        return await bench.client.post('/integrations/hubspot/webhooks', **webhook_request(url, events))
+
+    return make_request
+
+
+SCENARIOS = {
+    'load': load_scenario,
+    'crud': crud_scenario,
+    'callback': callback_scenario,
+    'summarize': summarize_scenario,
+    'similar': similar_scenario,
+    'files': files_scenario,
+    'webhooks': webhooks_scenario,
+}
@@ -0,0 +1,33 @@
+"""
+uvicorn app factory that serves the backend wired to the local stand-ins, so the load-test
+driver can target real uvicorn workers fully offline:
+
+    cd backend
+    BENCH_REDIS_URL=redis://localhost:6379/15 BENCH_PORTAL_SIZE=1000 \
+        uvicorn benchmarks.serve:create_app --factory --workers 4 --port 8000 --no-access-log
+
+Stand-ins are per worker; Redis must be shared (BENCH_REDIS_URL) when running more than one
+worker, otherwise OAuth state written by one worker is invisible to the others.
+"""
+import os
+import sys
+
+from benchmarks.harness import BenchEnvironment
+
+
+def create_app():
+    verbose = bool(os.environ.get('BENCH_VERBOSE'))
+    bench = BenchEnvironment(
+        redis_url=os.environ.get('BENCH_REDIS_URL'),
+        hubspot_latency=float(os.environ.get('BENCH_HUBSPOT_LATENCY_MS', 0)) / 1000.0,
+        openai_latency=float(os.environ.get('BENCH_OPENAI_LATENCY_MS', 0)) / 1000.0,
+        jitter=float(os.environ.get('BENCH_JITTER_MS', 0)) / 1000.0,
+        rate_limit_ratio=float(os.environ.get('BENCH_RATE_LIMIT_RATIO', 0)),
+        seed=os.getpid(),
+        verbose=verbose,
+    )
+    app = bench.install()
+    bench.hubspot.seed_contacts(int(os.environ.get('BENCH_PORTAL_SIZE', 100)))
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+    return app
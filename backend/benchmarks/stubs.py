@@ -0,0 +1,548 @@
+"""
+Local stand-ins for the upstream APIs used by the backend (HubSpot and OpenAI).
+
+Both stand-ins are plain async handlers mounted behind a single httpx.MockTransport,
+so the app under test talks to them exactly as it would to the real services.
+"""
+import asyncio
+import base64
+import calendar
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import httpx
+
+HUBSPOT_HOST = 'hubspot.bench'
+OPENAI_HOST = 'openai.bench'
+
+HUBSPOT_BASE_URL = f'http://{HUBSPOT_HOST}'
+OPENAI_BASE_URL = f'http://{OPENAI_HOST}/v1'
+
+
+class LatencyProfile:
+    """Fixed latency plus uniform jitter, in seconds; `stall_ratio` of calls also stall for `stall`"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: int = 0,
+                 stall_ratio: float = 0.0, stall: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.stall_ratio = stall_ratio
+        self.stall = stall
+        self._random = random.Random(seed)
+
+    async def wait(self):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if self.stall_ratio and self._random.random() < self.stall_ratio:
+            delay += self.stall
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def _json_response(status_code: int, payload: Optional[Dict] = None, headers: Optional[Dict] = None) -> httpx.Response:
+    if payload is None:
+        return httpx.Response(status_code, headers=headers)
+    return httpx.Response(status_code, json=payload, headers=headers)
+
+
+# Contact properties the portal defines; bench_score is a custom property
+CONTACT_SCHEMA = (
+    'firstname', 'lastname', 'email', 'phone', 'company', 'createdate', 'lastmodifieddate',
+    'hs_object_id', 'lifecyclestage', 'bench_score',
+)
+
+
+class FakeHubSpot:
+    """
+    In-memory HubSpot CRM portal: contacts CRUD with cursor pagination, OAuth token exchange,
+    latency injection and 429 responses (random and/or a rolling-window rate limit)
+    """
+
+    def __init__(
+            self,
+            portal_size: int = 100,
+            latency: Optional[LatencyProfile] = None,
+            rate_limit_ratio: float = 0.0,
+            rate_limit: Optional[tuple] = None,
+            max_page_size: int = 100,
+            seed: int = 0,
+            portal_id: int = 62515,
+    ):
+        self.latency = latency or LatencyProfile()
+        self.rate_limit_ratio = rate_limit_ratio
+        # (max_requests, window_seconds), mirrors HubSpot's ten-secondly rolling limit
+        self.rate_limit = rate_limit
+        self.max_page_size = max_page_size
+        self.portal_id = portal_id
+        self.contacts: Dict[str, Dict] = {}
+        self.files: Dict[str, Dict] = {}
+        self.notes: Dict[str, Dict] = {}
+        self.contact_notes: Dict[str, list] = {}
+        self.companies: Dict[str, Dict] = {}
+        self.deals: Dict[str, Dict] = {}
+        # (from object type, to object type) -> from id -> [(to id, association type id)]
+        self.associations: Dict[tuple, Dict[str, list]] = {}
+        self.calls = 0
+        self.throttled = 0
+        self._next_id = 1
+        self._window = deque()
+        self._random = random.Random(seed)
+        self.seed_contacts(portal_size)
+
+    def seed_contacts(self, count: int):
+        """Replace the portal with `count` generated contacts"""
+        self.contacts = {}
+        self.files = {}
+        self.notes = {}
+        self.contact_notes = {}
+        self.companies = {}
+        self.deals = {}
+        self.associations = {('contacts', 'companies'): {}, ('contacts', 'deals'): {}}
+        self._next_id = 1
+        for index in range(count):
+            contact = self._add_contact({
+                'firstname': f'First{index}',
+                'lastname': f'Last{index}',
+                'email': f'contact{index}@company{index % 97}.example',
+                'phone': f'+1555{index:07d}',
+                'company': f'Company {index % 97}',
+                'lifecyclestage': 'lead' if index % 3 else 'customer',
+                'bench_score': str(index % 100),
+            })
+            # Every contact works at one of 97 companies (primary association, type 1);
+            # every third contact has an open deal
+            company_id = str(100000 + index % 97)
+            self.companies.setdefault(company_id, {'id': company_id, 'properties': {
+                'name': f'Company {index % 97}', 'domain': f'company{index % 97}.example',
+            }})
+            self.associations[('contacts', 'companies')][contact['id']] = [(company_id, 1)]
+            if index % 3 == 0:
+                deal_id = str(200000 + index)
+                self.deals[deal_id] = {'id': deal_id, 'properties': {
+                    'dealname': f'Deal {index}', 'amount': str(1000 + index), 'dealstage': 'appointmentscheduled',
+                }}
+                self.associations[('contacts', 'deals')][contact['id']] = [(deal_id, 4)]
+
+    def _add_contact(self, properties: Dict) -> Dict:
+        contact_id = str(self._next_id)
+        self._next_id += 1
+        now = '2024-12-01T00:00:00.000Z'
+        contact = {
+            'id': contact_id,
+            'properties': {
+                **properties,
+                'hs_object_id': contact_id,
+                'createdate': now,
+                'lastmodifieddate': now,
+            },
+            'createdAt': now,
+            'updatedAt': now,
+            'archived': False,
+        }
+        self.contacts[contact_id] = contact
+        return contact
+
+    @staticmethod
+    def _touch(contact: Dict):
+        now = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        contact['properties']['lastmodifieddate'] = now
+        contact['updatedAt'] = now
+
+    @staticmethod
+    def _modified_at(contact: Dict) -> int:
+        modified = time.strptime(contact['properties']['lastmodifieddate'][:19], '%Y-%m-%dT%H:%M:%S')
+        return calendar.timegm(modified) * 1000
+
+    def _search(self, request: httpx.Request) -> httpx.Response:
+        """
+        Only the filters the mirror sync sends (lastmodifieddate GTE / GT / EQ, hs_object_id GT) and
+        one sort; results capped at 10k like HubSpot
+        """
+        body = json.loads(request.content)
+        compare = {'GTE': lambda a, b: a >= b, 'GT': lambda a, b: a > b, 'EQ': lambda a, b: a == b}
+        values = {
+            'lastmodifieddate': self._modified_at,
+            'hs_object_id': lambda contact: int(contact['id']),
+        }
+        conditions = [
+            (values[condition['propertyName']], compare[condition['operator']], int(condition['value']))
+            for group in body.get('filterGroups', []) for condition in group.get('filters', [])
+        ]
+        sort = values[(body.get('sorts') or [{'propertyName': 'lastmodifieddate'}])[0]['propertyName']]
+        matches = sorted(
+            (contact for contact in self.contacts.values()
+             if all(matches(value(contact), bound) for value, matches, bound in conditions)),
+            key=lambda contact: (sort(contact), int(contact['id']))
+        )
+        limit = min(int(body.get('limit', 10)), 200)
+        after = int(body.get('after') or 0)
+        if after >= 10000:
+            return _json_response(400, {'status': 'error', 'message': 'Search results are limited to 10000'})
+        properties = ','.join(body.get('properties', []))
+        payload = {'total': len(matches), 'results': [
+            self._project(contact, properties) for contact in matches[after:after + limit]
+        ]}
+        if after + limit < len(matches):
+            payload['paging'] = {'next': {'after': str(after + limit)}}
+        return _json_response(200, payload)
+
+    def seed_duplicates(self, count: int) -> list:
+        """
+        Add `count` near-duplicates of random existing contacts, each matching its original on email,
+        phone or company and name, and return the (original id, duplicate id) pairs
+        """
+        pairs = []
+        originals = self._random.sample(list(self.contacts), min(count, len(self.contacts)))
+        for number, original_id in enumerate(originals):
+            original = self.contacts[original_id]['properties']
+            duplicate = {key: original.get(key) for key in ('firstname', 'lastname', 'company', 'lifecyclestage')}
+            kind = number % 3
+            if kind == 0:
+                # Same mailbox typed differently
+                duplicate['email'] = original['email'].upper()
+            elif kind == 1:
+                # Same phone in another format, personal address
+                digits = original['phone'][-10:]
+                duplicate['phone'] = f'({digits[:3]}) {digits[3:6]}-{digits[6:]}'
+                duplicate['email'] = f"{original['firstname'].lower()}.{original['lastname'].lower()}@gmail.com"
+            else:
+                # Same person at the same company under another address
+                local, _, domain = original['email'].partition('@')
+                duplicate['email'] = f'{local}.work@{domain}'
+            pairs.append((original_id, self._add_contact(duplicate)['id']))
+        return pairs
+
+    def _merge(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        primary = self.contacts.get(str(body.get('primaryObjectId')))
+        merged = self.contacts.get(str(body.get('objectIdToMerge')))
+        if primary is None or merged is None or primary is merged:
+            return _json_response(400, {'status': 'error', 'message': 'Invalid merge request'})
+        # The primary keeps its values; the merged record only fills gaps
+        for key, value in merged['properties'].items():
+            if value and not primary['properties'].get(key):
+                primary['properties'][key] = value
+        del self.contacts[merged['id']]
+        self._touch(primary)
+        return _json_response(200, primary)
+
+    def change_events(self, count: int, occurred_at: int) -> list:
+        """Update `count` random contacts and return the contact.propertyChange webhook events for them"""
+        events = []
+        for contact_id in self._random.sample(list(self.contacts), min(count, len(self.contacts))):
+            self._next_id += 1
+            value = f'Company {self._next_id}'
+            self.contacts[contact_id]['properties']['company'] = value
+            self._touch(self.contacts[contact_id])
+            events.append({
+                'eventId': self._next_id,
+                'subscriptionId': 1,
+                'portalId': self.portal_id,
+                'appId': 1,
+                'occurredAt': occurred_at,
+                'subscriptionType': 'contact.propertyChange',
+                'attemptNumber': 0,
+                'objectId': int(contact_id),
+                'propertyName': 'company',
+                'propertyValue': value,
+                'changeSource': 'CRM_UI',
+            })
+        return events
+
+    def _throttled(self) -> bool:
+        if self.rate_limit_ratio and self._random.random() < self.rate_limit_ratio:
+            return True
+        if self.rate_limit:
+            max_requests, window = self.rate_limit
+            now = time.monotonic()
+            while self._window and now - self._window[0] > window:
+                self._window.popleft()
+            if len(self._window) >= max_requests:
+                return True
+            self._window.append(now)
+        return False
+
+    def _upload_file(self, request: httpx.Request) -> httpx.Response:
+        content_type = request.headers.get('Content-Type', '')
+        boundary = content_type.partition('boundary=')[2].encode()
+        if not boundary:
+            return _json_response(400, {'status': 'error', 'message': 'Expected multipart/form-data'})
+        for part in request.content.split(b'--' + boundary):
+            headers, _, body = part.partition(b'\r\n\r\n')
+            match = re.search(rb'name="file"; filename="([^"]*)"', headers)
+            if match:
+                name, _, extension = match.group(1).decode().rpartition('.')
+                file_id = str(self._next_id)
+                self._next_id += 1
+                self.files[file_id] = {
+                    'id': file_id,
+                    'name': name,
+                    'extension': extension,
+                    'size': len(body) - 2,  # trailing CRLF before the next boundary
+                    'type': 'DOCUMENT' if extension == 'pdf' else 'IMG',
+                    'access': 'PRIVATE',
+                    'url': f'{HUBSPOT_BASE_URL}/files/{file_id}',
+                    'createdAt': '2024-12-01T00:00:00.000Z',
+                }
+                return _json_response(201, self.files[file_id])
+        return _json_response(400, {'status': 'error', 'message': 'Missing file part'})
+
+    def _create_note(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        note_id = str(self._next_id)
+        self._next_id += 1
+        self.notes[note_id] = {'id': note_id, 'properties': body.get('properties', {})}
+        for association in body.get('associations', []):
+            self.contact_notes.setdefault(str(association['to']['id']), []).append(note_id)
+        return _json_response(201, self.notes[note_id])
+
+    @staticmethod
+    def _project(contact: Dict, properties: Optional[str]) -> Dict:
+        if not properties:
+            return contact
+        wanted = properties.split(',')
+        return {**contact, 'properties': {k: v for k, v in contact['properties'].items() if k in wanted}}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        await self.latency.wait()
+
+        if self._throttled():
+            self.throttled += 1
+            return _json_response(429, {
+                'status': 'error',
+                'message': 'You have reached your ten_secondly_rolling limit.',
+                'errorType': 'RATE_LIMIT',
+                'policyName': 'TEN_SECONDLY_ROLLING',
+            }, headers={'Retry-After': '1'})
+
+        path = request.url.path
+        method = request.method
+
+        if path == '/oauth/v1/token' and method == 'POST':
+            form = parse_qs(request.content.decode())
+            if not form.get('code') and not form.get('refresh_token'):
+                return _json_response(400, {'status': 'BAD_AUTH_CODE'})
+            return _json_response(200, {
+                'access_token': f'bench-access-{self._random.getrandbits(64):x}',
+                'refresh_token': f'bench-refresh-{self._random.getrandbits(64):x}',
+                'expires_in': 1800,
+                'token_type': 'bearer',
+            })
+
+        if path.startswith('/oauth/v1/access-tokens/') and method == 'GET':
+            return _json_response(200, {
+                'token': path.rsplit('/', 1)[-1],
+                'hub_id': self.portal_id,
+                'user': 'bench@hubspot.bench',
+                'app_id': 1,
+                'expires_in': 1800,
+            })
+
+        if not request.headers.get('Authorization', '').startswith('Bearer '):
+            return _json_response(401, {'status': 'error', 'category': 'INVALID_AUTHENTICATION'})
+
+        if path == '/files/v3/files' and method == 'POST':
+            return self._upload_file(request)
+        if path.startswith('/files/v3/files/') and method == 'GET':
+            file_data = self.files.get(path.rsplit('/', 1)[-1])
+            return _json_response(200, file_data) if file_data else _json_response(404, {'status': 'error'})
+        if path == '/crm/v3/objects/notes' and method == 'POST':
+            return self._create_note(request)
+        if path == '/crm/v3/objects/notes/batch/read' and method == 'POST':
+            inputs = json.loads(request.content).get('inputs', [])
+            missing = [item['id'] for item in inputs if item['id'] not in self.notes]
+            body = {'status': 'COMPLETE', 'results': [
+                self.notes[item['id']] for item in inputs if item['id'] in self.notes
+            ]}
+            if not missing:
+                return _json_response(200, body)
+            # Like HubSpot: a multi-status partial success listing the ids it could not read
+            return _json_response(207, {**body, 'numErrors': 1, 'errors': [
+                {'status': 'error', 'category': 'OBJECT_NOT_FOUND', 'context': {'ids': missing}}
+            ]})
+        match = re.fullmatch(r'/crm/v4/objects/contacts/([^/]+)/associations/notes', path)
+        if match and method == 'GET':
+            return _json_response(200, {'results': [
+                {'toObjectId': int(note_id), 'associationTypes': [{'category': 'HUBSPOT_DEFINED', 'typeId': 202}]}
+                for note_id in self.contact_notes.get(match.group(1), [])
+            ]})
+
+        if path == '/crm/v3/properties/contacts' and method == 'GET':
+            return _json_response(200, {'results': [
+                {'name': name, 'label': name.title(), 'type': 'string', 'fieldType': 'text',
+                 'groupName': 'contactinformation', 'hubspotDefined': name != 'bench_score'}
+                for name in CONTACT_SCHEMA
+            ]})
+
+        match = re.fullmatch(r'/crm/v4/associations/(\w+)/(\w+)/batch/read', path)
+        if match and method == 'POST':
+            associated = self.associations.get((match.group(1), match.group(2)), {})
+            return _json_response(200, {'status': 'COMPLETE', 'results': [
+                {
+                    'from': {'id': item['id']},
+                    'to': [
+                        {'toObjectId': int(to_id), 'associationTypes': [
+                            {'category': 'HUBSPOT_DEFINED', 'typeId': type_id, 'label': None}
+                        ]}
+                        for to_id, type_id in associated[item['id']]
+                    ],
+                }
+                for item in json.loads(request.content).get('inputs', []) if item['id'] in associated
+            ]})
+        match = re.fullmatch(r'/crm/v3/objects/(companies|deals)/batch/read', path)
+        if match and method == 'POST':
+            objects = self.companies if match.group(1) == 'companies' else self.deals
+            body = json.loads(request.content)
+            properties = ','.join(body.get('properties', []))
+            return _json_response(200, {'status': 'COMPLETE', 'results': [
+                self._project(objects[item['id']], properties)
+                for item in body.get('inputs', []) if item['id'] in objects
+            ]})
+
+        prefix = '/crm/v3/objects/contacts'
+        if path == prefix + '/search' and method == 'POST':
+            return self._search(request)
+        if path == prefix + '/merge' and method == 'POST':
+            return self._merge(request)
+        if path == prefix + '/batch/read' and method == 'POST':
+            body = json.loads(request.content)
+            properties = ','.join(body.get('properties', []))
+            return _json_response(200, {'status': 'COMPLETE', 'results': [
+                self._project(self.contacts[item['id']], properties)
+                for item in body.get('inputs', []) if item['id'] in self.contacts
+            ]})
+        if path == prefix and method == 'GET':
+            limit = min(int(request.url.params.get('limit', 10)), self.max_page_size)
+            after = int(request.url.params.get('after', 0))
+            ids = list(self.contacts)
+            page = ids[after:after + limit]
+            payload = {'results': [
+                self._project(self.contacts[contact_id], request.url.params.get('properties'))
+                for contact_id in page
+            ]}
+            if after + limit < len(ids):
+                payload['paging'] = {'next': {'after': str(after + limit)}}
+            return _json_response(200, payload)
+
+        if path == prefix and method == 'POST':
+            properties = json.loads(request.content).get('properties', {})
+            email = properties.get('email')
+            if email and any(c['properties'].get('email') == email for c in self.contacts.values()):
+                return _json_response(409, {'status': 'error', 'message': 'Contact already exists'})
+            return _json_response(201, self._add_contact(properties))
+
+        if path.startswith(prefix + '/'):
+            contact_id = path[len(prefix) + 1:]
+            if method == 'DELETE':
+                # HubSpot archives idempotently: unknown ids still answer 204
+                self.contacts.pop(contact_id, None)
+                return _json_response(204)
+            contact = self.contacts.get(contact_id)
+            if contact is None:
+                return _json_response(404, {'status': 'error', 'message': 'resource not found'})
+            if method == 'GET':
+                return _json_response(200, self._project(contact, request.url.params.get('properties')))
+            if method == 'PATCH':
+                contact['properties'].update(json.loads(request.content).get('properties', {}))
+                self._touch(contact)
+                return _json_response(200, contact)
+
+        return _json_response(404, {'status': 'error', 'message': f'Unknown route {method} {path}'})
+
+
+def fake_embedding(text: str, dimensions: int) -> list:
+    """
+    Deterministic unit vector hashing the words of the text into buckets, so texts sharing words
+    (a company, an email domain) come out similar, as they would from a real model
+    """
+    vector = [0.0] * dimensions
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        digest = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), 'little')
+        vector[digest % dimensions] += 1.0 if digest >> 63 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class FakeOpenAI:
+    """Minimal OpenAI endpoints: chat completions returning a canned summary, and fake embeddings"""
+
+    def __init__(self, latency: Optional[LatencyProfile] = None):
+        self.latency = latency or LatencyProfile()
+        self.calls = 0
+        # User prompts of the chat completions received, in order
+        self.prompts: List[str] = []
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        await self.latency.wait()
+
+        if request.url.path.endswith('/chat/completions') and request.method == 'POST':
+            body = json.loads(request.content)
+            prompt = body['messages'][-1]['content']
+            self.prompts.append(prompt)
+            content = 'Benchmark summary of the contact.'
+            if body.get('response_format', {}).get('type') == 'json_object':
+                # Batched summaries: one per numbered contact in the prompt
+                numbers = re.findall(r'### Contact (\d+)', prompt)
+                content = json.dumps({'summaries': {number: f'Benchmark summary of contact {number}.'
+                                                    for number in numbers}})
+            return _json_response(200, {
+                'id': f'chatcmpl-bench-{self.calls}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': body.get('model', 'gpt-3.5-turbo'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': content},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': len(prompt) // 4,
+                    'completion_tokens': len(content) // 4,
+                    'total_tokens': (len(prompt) + len(content)) // 4,
+                },
+            })
+
+        if request.url.path.endswith('/embeddings') and request.method == 'POST':
+            body = json.loads(request.content)
+            texts = [body['input']] if isinstance(body['input'], str) else body['input']
+            dimensions = body.get('dimensions', 1536)
+            data = []
+            for index, text in enumerate(texts):
+                embedding = fake_embedding(text, dimensions)
+                if body.get('encoding_format') == 'base64':
+                    embedding = base64.b64encode(struct.pack(f'<{dimensions}f', *embedding)).decode()
+                data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+            tokens = sum(len(text) // 4 for text in texts)
+            return _json_response(200, {
+                'object': 'list',
+                'data': data,
+                'model': body.get('model', 'text-embedding-3-small'),
+                'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+            })
+
+        return _json_response(404, {'error': {'message': f'Unknown route {request.url.path}'}})
+
+
+class UpstreamRouter:
+    """Dispatches requests to the stand-in registered for the request host"""
+
+    def __init__(self, handlers: Dict[str, Callable]):
+        self.handlers = handlers
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        handler = self.handlers.get(request.url.host)
+        if handler is None:
+            return _json_response(502, {'error': f'No stand-in for host {request.url.host}'})
+        return await handler(request)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
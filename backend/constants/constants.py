@@ -1,4 +1,4 @@
-# TODO file upload hubspot
+# Contact file uploads (HubSpot Files API)
 
 ALLOWED_EXTENSIONS = ['pdf', 'jpg', 'jpeg', 'png']
 MAX_FILE_SIZE = 1024 * 1024 * 5  # 5 MB
@@ -0,0 +1,41 @@
+"""
+gunicorn settings for serving the API with several uvicorn workers per container:
+
+    gunicorn -c gunicorn.conf.py main:app
+
+Every setting comes from the environment. Each worker is a separate process with its own event
+loop, Redis pool, job workers (JOB_WORKERS) and in-memory caches; state the workers must agree on
+(OAuth state, sessions, credentials, locks, the job queue) lives in Redis. Set SINGLE_FLIGHT_REDIS
+to also collapse identical upstream reads across workers.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+# One worker per core by default; the app's work is async I/O plus JSON, so more rarely helps
+workers = max(int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1), 1)
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Import the app once in the master and fork it into the workers: faster starts and shared
+# copy-on-write memory. Modules reset their connections and tasks in utils.lifecycle hooks
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+# Long enough for streamed exports and uploads; slower work belongs on the job queue
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+# Lets in-flight requests, job workers and buffered webhook events finish on shutdown
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Recycling workers bounds slow leaks; jitter keeps them from restarting together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked")
+
+
+def worker_exit(server, worker):
+    server.log.info(f"Worker {worker.pid} exited")
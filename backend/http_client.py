@@ -0,0 +1,26 @@
+from typing import Optional
+
+import httpx
+
+from utils.deadline import DeadlineTransport
+from utils.limiter import LimitedTransport
+from utils.tracing import TracingTransport
+
+# Transport override used by the benchmark harness to swap upstream APIs for local stand-ins
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+def set_transport(transport: Optional[httpx.AsyncBaseTransport]):
+    """Route every upstream client created by async_client() through the given transport"""
+    global _transport
+    _transport = transport
+
+
+def async_client(**kwargs) -> httpx.AsyncClient:
+    """
+    Create an httpx.AsyncClient for upstream API calls (HubSpot, Notion, Airtable). Calls to
+    registered upstream hosts go through their adaptive concurrency limit, every call is bounded
+    by the current request's deadline and traced as a client span (including any wait for a slot)
+    """
+    transport = kwargs.pop('transport', None) or _transport or httpx.AsyncHTTPTransport()
+    return httpx.AsyncClient(transport=TracingTransport(DeadlineTransport(LimitedTransport(transport))), **kwargs)
@@ -5,15 +5,19 @@ import json
 import secrets
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
-import httpx
 import asyncio
 import base64
 import hashlib
+from urllib.parse import quote
 
-import requests
+from http_client import async_client
 from integrations.integration_item import IntegrationItem
+from jobs import JobContext, job
 
-from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
+from redis_client import add_key_value_redis, add_key_values_redis, get_value_redis, delete_key_redis, delete_keys_redis
+from utils.limiter import register_upstream
+from utils.responses import CLOSE_WINDOW_PAGE
+from utils.single_flight import fingerprint, single_flight
 
 # CLIENT_ID = 'XXX'
 # CLIENT_SECRET = 'XXX'
@@ -24,6 +28,10 @@ authorization_url = f'https://airtable.com/oauth2/v1/authorize?client_id={CLIENT
 
 encoded_client_id_secret = base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()
 scope = 'data.records:read data.records:write data.recordComments:read data.recordComments:write schema.bases:read schema.bases:write'
+# Static part of the authorize URL; only the state and the PKCE challenge change per request
+authorization_url_prefix = f'{authorization_url}&code_challenge_method=S256&scope={quote(scope)}'
+
+register_upstream('airtable', 'airtable.com', 'api.airtable.com')
 
 async def authorize_airtable(user_id, org_id):
     state_data = {
@@ -38,11 +46,11 @@ async def authorize_airtable(user_id, org_id):
     m.update(code_verifier.encode('utf-8'))
     code_challenge = base64.urlsafe_b64encode(m.digest()).decode('utf-8').replace('=', '')
 
-    auth_url = f'{authorization_url}&state={encoded_state}&code_challenge={code_challenge}&code_challenge_method=S256&scope={scope}'
-    await asyncio.gather(
-        add_key_value_redis(f'airtable_state:{org_id}:{user_id}', json.dumps(state_data), expire=600),
-        add_key_value_redis(f'airtable_verifier:{org_id}:{user_id}', code_verifier, expire=600),
-    )
+    auth_url = f'{authorization_url_prefix}&state={encoded_state}&code_challenge={code_challenge}'
+    await add_key_values_redis({
+        f'airtable_state:{org_id}:{user_id}': json.dumps(state_data),
+        f'airtable_verifier:{org_id}:{user_id}': code_verifier,
+    }, expire=600)
 
     return auth_url
 
@@ -65,8 +73,8 @@ async def oauth2callback_airtable(request: Request):
     if not saved_state or original_state != json.loads(saved_state).get('state'):
         raise HTTPException(status_code=400, detail='State does not match.')
 
-    async with httpx.AsyncClient() as client:
-        response, _, _ = await asyncio.gather(
+    async with async_client() as client:
+        response, _ = await asyncio.gather(
             client.post(
                 'https://airtable.com/oauth2/v1/token',
                 data={
@@ -81,20 +89,12 @@ async def oauth2callback_airtable(request: Request):
                     'Content-Type': 'application/x-www-form-urlencoded',
                 }
             ),
-            delete_key_redis(f'airtable_state:{org_id}:{user_id}'),
-            delete_key_redis(f'airtable_verifier:{org_id}:{user_id}'),
+            delete_keys_redis(f'airtable_state:{org_id}:{user_id}', f'airtable_verifier:{org_id}:{user_id}'),
         )
 
     await add_key_value_redis(f'airtable_credentials:{org_id}:{user_id}', json.dumps(response.json()), expire=600)
     
-    close_window_script = """
-    <html>
-        <script>
-            window.close();
-        </script>
-    </html>
-    """
-    return HTMLResponse(content=close_window_script)
+    return HTMLResponse(content=CLOSE_WINDOW_PAGE)
 
 async def get_airtable_credentials(user_id, org_id):
     credentials = await get_value_redis(f'airtable_credentials:{org_id}:{user_id}')
@@ -120,53 +120,72 @@ def create_integration_item_metadata_object(
     return integration_item_metadata
 
 
-def fetch_items(
-    access_token: str, url: str, aggregated_response: list, offset=None
-) -> dict:
+async def fetch_items(
+    client, access_token: str, url: str, aggregated_response: list, offset=None
+) -> None:
     """Fetching the list of bases"""
-    params = {'offset': offset} if offset is not None else {}
-    headers = {'Authorization': f'Bearer {access_token}'}
-    response = requests.get(url, headers=headers, params=params)
+    while True:
+        params = {'offset': offset} if offset is not None else {}
+        headers = {'Authorization': f'Bearer {access_token}'}
+        response = await client.get(url, headers=headers, params=params)
 
-    if response.status_code == 200:
-        results = response.json().get('bases', {})
+        if response.status_code != 200:
+            return
+        aggregated_response.extend(response.json().get('bases', {}))
         offset = response.json().get('offset', None)
+        if offset is None:
+            return
 
-        for item in results:
-            aggregated_response.append(item)
 
-        if offset is not None:
-            fetch_items(access_token, url, aggregated_response, offset)
-        else:
-            return
+async def _fetch_bases_and_tables(access_token: str) -> list:
+    """Bases with their tables; identical concurrent walks for the same token share one"""
+
+    async def fetch() -> list:
+        bases = []
+        async with async_client() as client:
+            await fetch_items(client, access_token, 'https://api.airtable.com/v0/meta/bases', bases)
+            tables_responses = await asyncio.gather(*(
+                client.get(
+                    f'https://api.airtable.com/v0/meta/bases/{base.get("id")}/tables',
+                    headers={'Authorization': f'Bearer {access_token}'},
+                )
+                for base in bases
+            ))
+        return [
+            {
+                'base': base,
+                'tables': tables_response.json()['tables'] if tables_response.status_code == 200 else [],
+            }
+            for base, tables_response in zip(bases, tables_responses)
+        ]
+
+    return await single_flight(f'airtable:bases:{fingerprint(access_token)}', fetch)
 
 
 async def get_items_airtable(credentials) -> list[IntegrationItem]:
     credentials = json.loads(credentials)
-    url = 'https://api.airtable.com/v0/meta/bases'
     list_of_integration_item_metadata = []
-    list_of_responses = []
 
-    fetch_items(credentials.get('access_token'), url, list_of_responses)
-    for response in list_of_responses:
+    for entry in await _fetch_bases_and_tables(credentials.get('access_token')):
+        response = entry['base']
         list_of_integration_item_metadata.append(
             create_integration_item_metadata_object(response, 'Base')
         )
-        tables_response = requests.get(
-            f'https://api.airtable.com/v0/meta/bases/{response.get("id")}/tables',
-            headers={'Authorization': f'Bearer {credentials.get("access_token")}'},
-        )
-        if tables_response.status_code == 200:
-            tables_response = tables_response.json()
-            for table in tables_response['tables']:
-                list_of_integration_item_metadata.append(
-                    create_integration_item_metadata_object(
-                        table,
-                        'Table',
-                        response.get('id', None),
-                        response.get('name', None),
-                    )
+        for table in entry['tables']:
+            list_of_integration_item_metadata.append(
+                create_integration_item_metadata_object(
+                    table,
+                    'Table',
+                    response.get('id', None),
+                    response.get('name', None),
                 )
+            )
 
     print(f'list_of_integration_item_metadata: {list_of_integration_item_metadata}')
     return list_of_integration_item_metadata
+
+
+@job('airtable.load')
+async def load_airtable_job(ctx: JobContext, credentials: str) -> list[IntegrationItem]:
+    await ctx.progress(0, message='Fetching bases')
+    return await get_items_airtable(credentials)
@@ -1,17 +1,36 @@
+import asyncio
 import json
 import secrets
-from typing import Dict, List
-from urllib.parse import urlencode
+import socket
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import urlencode, urlparse
 
 import httpx
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
+
+from constants.constants import ALLOWED_EXTENSIONS, MAX_FILE_SIZE
+from http_client import async_client
+from integrations import hubspot_contact_store as contact_store, hubspot_mirror
+from integrations.hubspot_changes import CHANGES_PAGE_SIZE, SOURCE_SYNC, read_changes, record_changes
 from integrations.integration_item import IntegrationItem
-from redis_client import add_key_value_redis, get_value_redis, delete_key_redis, get_keys_with_prefix
+from jobs import JobContext, enqueue_job, job
+from redis_client import add_key_value_redis, add_key_values_redis, get_value_redis, delete_key_redis, \
+    get_keys_with_prefix, acquire_lock, release_lock
+from sessions import cache_credentials, create_session, delete_sessions
+from utils.cache import LRUCache
+from utils.deadline import DeadlineExceeded, detached_task, within_deadline
+from utils.hedging import HedgePolicy
+from utils.lifecycle import after_fork
+from utils.limiter import Overloaded, register_upstream
 from utils.logger import log
+from utils.multipart_stream import MultipartFileStream, UploadTooLarge
 from utils.secrets import get_hubspot_secrets
+from utils.single_flight import fingerprint, single_flight
 
-from openai_client import summarize_contact_ai
+from openai_client import BATCH_MAX_CONTACTS, summarize_contact_ai
 
 # Get HubSpot configuration from secrets
 hubspot_config = get_hubspot_secrets()
@@ -23,6 +42,125 @@ AUTH_URL = hubspot_config['auth_url']
 TOKEN_URL = hubspot_config['token_url']
 API_BASE_URL = hubspot_config['api_base_url']
 SCOPES = hubspot_config['scopes'].split(',') if hubspot_config['scopes'] else []
+register_upstream('hubspot', urlparse(API_BASE_URL).hostname, urlparse(TOKEN_URL).hostname)
+# Everything in the authorize URL but the state is fixed, so it is encoded once here
+AUTHORIZE_URL_PREFIX = AUTH_URL + '?' + urlencode({
+    'client_id': CLIENT_ID,
+    'redirect_uri': REDIRECT_URI,
+    'scope': ' '.join(SCOPES),
+}) + '&state='
+# Abandoned OAuth flows expire instead of piling up for the callback's state scan
+OAUTH_STATE_TTL = 600
+
+# Refresh access tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+# Stored credentials outlive the access token so the refresh token stays usable
+CREDENTIALS_TTL = 60 * 60 * 24 * 30
+REFRESH_LOCK_TTL = 30
+REFRESH_WAIT_TIMEOUT = 10
+
+# Single contact and list page reads are idempotent, so a stalled one is hedged with a second request
+_contact_hedge = HedgePolicy('hubspot_contact')
+_contacts_page_hedge = HedgePolicy('hubspot_contacts_page')
+
+# Refreshes in flight in this process, keyed by org/user
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
+# HubSpot-defined association type for note -> contact
+NOTE_TO_CONTACT_ASSOCIATION = 202
+CONTACT_FILES_FOLDER = '/contact-files'
+CONTACT_FILES_CACHE_TTL = 300
+FILE_UPLOAD_TIMEOUT = 120.0
+# Allowance for multipart boundaries and part headers on top of MAX_FILE_SIZE
+MULTIPART_OVERHEAD = 16 * 1024
+
+CONTACTS_PAGE_SIZE = 100
+CONTACT_PROPERTIES = 'firstname,lastname,email,phone,company,createdate,lastmodifieddate'
+DEFAULT_CONTACT_PROPERTIES = CONTACT_PROPERTIES.split(',')
+PROPERTIES_SCHEMA_TTL = 60 * 60
+# Held while a portal's contact store is being crawled, so concurrent loads enqueue one sync
+CONTACT_SYNC_LOCK_TTL = 600
+
+# Objects a contact load can pull in through associations, with the properties loaded for each
+ASSOCIATED_OBJECTS = {
+    'companies': {'type': 'company', 'properties': ['name', 'domain']},
+    'deals': {'type': 'deal', 'properties': ['dealname', 'amount', 'dealstage']},
+}
+# HubSpot batch endpoints take at most 100 inputs per call
+BATCH_SIZE = 100
+# HubSpot-defined association type for a contact's primary company
+PRIMARY_COMPANY_ASSOCIATION = 1
+
+# The search API stops paging after 10,000 results per query
+SEARCH_RESULT_LIMIT = 10000
+# Incremental mirror syncs re-read this much history (ms) to absorb clock skew between us and HubSpot
+MIRROR_SYNC_OVERLAP = 60 * 1000
+
+# Static callback page, encoded once; only the OAuth exchange differs between callbacks
+CALLBACK_PAGE = """
+<html>
+    <head>
+        <title>HubSpot Authorization</title>
+        <style>
+            body {
+                font-family: Arial, sans-serif;
+                display: flex;
+                justify-content: center;
+                align-items: center;
+                height: 100vh;
+                margin: 0;
+                background-color: #f5f5f5;
+            }
+            .container {
+                text-align: center;
+                padding: 40px;
+                background: white;
+                border-radius: 8px;
+                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+            }
+            h3 {
+                color: #2E7D32;
+                margin-bottom: 16px;
+            }
+            .checkmark {
+                color: #2E7D32;
+                font-size: 48px;
+                margin-bottom: 16px;
+            }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="checkmark">✓</div>
+            <h3>Authorization Successful!</h3>
+            <p>This window will close automatically in 3 seconds...</p>
+        </div>
+        <script>
+            setTimeout(function() {
+                window.close();
+            }, 3000);
+        </script>
+    </body>
+</html>
+""".encode()
+
+# portal id -> mirror sync running in this process. Mirrors are local files, so their syncs
+# run here rather than on the shared job queue, which could hand them to another container
+_mirror_syncs: Dict[str, asyncio.Task] = {}
+# Workers on one host share the mirror files; this lock lets only one of them sync a portal
+MIRROR_SYNC_LOCK_TTL = 600
+
+# (org_id, user_id) -> HubSpot portal (hub) id
+_portal_ids: Dict[tuple, str] = {}
+# portal id (or token digest) -> {property name: definition}
+_properties_schemas = LRUCache(maxsize=1000, ttl=PROPERTIES_SCHEMA_TTL)
+
+
+@after_fork
+def _reset_after_fork():
+    # Portal ids and schemas are plain data and stay warm; tasks belong to the parent's loop
+    _refresh_tasks.clear()
+    _mirror_syncs.clear()
 
 
 async def authorize_hubspot(user_id: str, org_id: str) -> str:
@@ -38,22 +176,12 @@ async def authorize_hubspot(user_id: str, org_id: str) -> str:
         }
 
         # Store state in Redis with expiration
-        await add_key_value_redis(
-            f'hubspot_state:{org_id}:{user_id}',
-            json.dumps(state_data)
+        await add_key_values_redis(
+            {f'hubspot_state:{org_id}:{user_id}': json.dumps(state_data)}, expire=OAUTH_STATE_TTL
         )
-        log.info(SCOPES)
-
-        # Construct authorization URL
-        params = {
-            'client_id': CLIENT_ID,
-            'redirect_uri': REDIRECT_URI,
-            'scope': ' '.join(SCOPES),
-            'state': state_data['state']
-        }
 
-        auth_url = f"{AUTH_URL}?{urlencode(params)}"
-        return auth_url
+        # token_urlsafe output needs no escaping
+        return AUTHORIZE_URL_PREFIX + state_data['state']
 
     except Exception as e:
         log.error(f"Error authorizing HubSpot: {str(e)}")
@@ -96,7 +224,7 @@ async def oauth2callback_hubspot(request: Request) -> Dict:
             'code': code
         }
 
-        async with httpx.AsyncClient() as client:
+        async with async_client() as client:
             response = await client.post(TOKEN_URL, data=token_data)
             if response.status_code != 200:
                 raise HTTPException(status_code=400, detail="Token exchange failed")
@@ -104,63 +232,12 @@ async def oauth2callback_hubspot(request: Request) -> Dict:
             credentials = response.json()
 
         # Store credentials in Redis
-        await add_key_value_redis(
-            f'hubspot_credentials:{state_data["org_id"]}:{state_data["user_id"]}',
-            json.dumps(credentials),
-            expire=credentials.get('expires_in', 3600)
-        )
+        await store_hubspot_credentials(state_data["org_id"], state_data["user_id"], credentials)
 
         # Clean up state
         await delete_key_redis(f'hubspot_state:{state_data["org_id"]}:{state_data["user_id"]}')
 
-        close_window = """
-        <html>
-            <head>
-                <title>HubSpot Authorization</title>
-                <style>
-                    body {
-                        font-family: Arial, sans-serif;
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        height: 100vh;
-                        margin: 0;
-                        background-color: #f5f5f5;
-                    }
-                    .container {
-                        text-align: center;
-                        padding: 40px;
-                        background: white;
-                        border-radius: 8px;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    }
-                    h3 {
-                        color: #2E7D32;
-                        margin-bottom: 16px;
-                    }
-                    .checkmark {
-                        color: #2E7D32;
-                        font-size: 48px;
-                        margin-bottom: 16px;
-                    }
-                </style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="checkmark">✓</div>
-                    <h3>Authorization Successful!</h3>
-                    <p>This window will close automatically in 3 seconds...</p>
-                </div>
-                <script>
-                    setTimeout(function() {
-                        window.close();
-                    }, 3000);
-                </script>
-            </body>
-        </html>
-    """
-
-        return HTMLResponse(content=close_window)
+        return HTMLResponse(content=CALLBACK_PAGE)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Callback processing failed: {str(e)}")
@@ -168,7 +245,8 @@ async def oauth2callback_hubspot(request: Request) -> Dict:
 
 async def get_hubspot_credentials(user_id: str, org_id: str) -> Dict:
     """
-    Retrieve stored HubSpot credentials
+    Open a session on the stored HubSpot credentials. Tokens stay server-side; the client
+    sends the returned session handle with every request
     """
     try:
         credentials = await get_value_redis(f'hubspot_credentials:{org_id}:{user_id}')
@@ -176,13 +254,160 @@ async def get_hubspot_credentials(user_id: str, org_id: str) -> Dict:
             log.warn("No credentials found for user")
             raise HTTPException(status_code=400, detail="No credentials found")
 
-        return json.loads(credentials)
+        credentials = json.loads(credentials)
+        if _is_expiring(credentials):
+            credentials = await refresh_hubspot_credentials(org_id, user_id, credentials.get('access_token'))
+
+        return {
+            'session': await create_session('hubspot', org_id, user_id),
+            'org_id': org_id,
+            'user_id': user_id,
+            'expires_at': credentials.get('expires_at')
+        }
 
     except Exception as e:
         log.error(f"Failed to retrieve credentials: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve credentials: {str(e)}")
 
 
+async def store_hubspot_credentials(org_id: str, user_id: str, credentials: Dict) -> Dict:
+    """
+    Store token response from HubSpot along with its absolute expiry and owner
+    """
+    credentials = {
+        **credentials,
+        'org_id': org_id,
+        'user_id': user_id,
+        'expires_at': int(time.time()) + int(credentials.get('expires_in', 3600)),
+    }
+    await add_key_value_redis(
+        f'hubspot_credentials:{org_id}:{user_id}',
+        json.dumps(credentials),
+        expire=CREDENTIALS_TTL
+    )
+    cache_credentials('hubspot', org_id, user_id, credentials)
+    return credentials
+
+
+def _is_expiring(credentials: Dict) -> bool:
+    expires_at = credentials.get('expires_at')
+    if expires_at is None:
+        return False
+    # Short-lived tokens refresh at half-life so a fresh token never counts as expiring
+    margin = min(TOKEN_REFRESH_MARGIN, int(credentials.get('expires_in', 3600)) // 2)
+    return expires_at - time.time() < margin
+
+
+def _can_refresh(credentials: Dict) -> bool:
+    return bool(credentials.get('org_id') and credentials.get('user_id'))
+
+
+async def _request_token_refresh(refresh_token: str) -> Dict:
+    token_data = {
+        'grant_type': 'refresh_token',
+        'client_id': CLIENT_ID,
+        'client_secret': CLIENT_SECRET,
+        'redirect_uri': REDIRECT_URI,
+        'refresh_token': refresh_token
+    }
+    async with async_client() as client:
+        response = await client.post(TOKEN_URL, data=token_data)
+    if response.status_code != 200:
+        log.error(f"Token refresh failed: {response.status_code} {response.text}")
+        raise HTTPException(status_code=401, detail="Token refresh failed, please reconnect HubSpot")
+    return response.json()
+
+
+async def _refresh_with_lock(org_id: str, user_id: str, stale_access_token: Optional[str]) -> Dict:
+    """
+    Refresh under a Redis lock so only one worker calls HubSpot; the others wait for
+    the refreshed credentials to land in the credentials key
+    """
+    key = f'hubspot_credentials:{org_id}:{user_id}'
+    lock_key = f'hubspot_refresh_lock:{org_id}:{user_id}'
+    deadline = time.monotonic() + REFRESH_WAIT_TIMEOUT
+
+    while True:
+        stored = await get_value_redis(key)
+        if not stored:
+            raise HTTPException(status_code=401, detail="No credentials found, please reconnect HubSpot")
+        current = json.loads(stored)
+        if current.get('access_token') != stale_access_token and not _is_expiring(current):
+            return current
+
+        lock_token = await acquire_lock(lock_key, REFRESH_LOCK_TTL)
+        if lock_token:
+            try:
+                # Another worker may have finished refreshing between our read and the lock
+                stored = await get_value_redis(key)
+                current = json.loads(stored) if stored else current
+                if current.get('access_token') != stale_access_token and not _is_expiring(current):
+                    return current
+
+                log.info(f"Refreshing HubSpot token for user {user_id} in org {org_id}")
+                refreshed = await _request_token_refresh(current['refresh_token'])
+                # HubSpot may omit the refresh token when it is unchanged
+                refreshed.setdefault('refresh_token', current['refresh_token'])
+                return await store_hubspot_credentials(org_id, user_id, refreshed)
+            finally:
+                await release_lock(lock_key, lock_token)
+
+        if time.monotonic() > deadline:
+            raise HTTPException(status_code=503, detail="Timed out waiting for HubSpot token refresh")
+        await asyncio.sleep(0.1)
+
+
+async def refresh_hubspot_credentials(org_id: str, user_id: str, stale_access_token: Optional[str]) -> Dict:
+    """
+    Refresh the access token for an org/user. Concurrent callers in this process share one
+    task, and callers across workers share one HubSpot call through the Redis lock
+    """
+    key = f'{org_id}:{user_id}'
+    task = _refresh_tasks.get(key)
+    if task is None:
+        task = detached_task(_refresh_with_lock(org_id, user_id, stale_access_token))
+        _refresh_tasks[key] = task
+        task.add_done_callback(lambda _: _refresh_tasks.pop(key, None))
+    return await within_deadline(asyncio.shield(task))
+
+
+async def resolve_hubspot_credentials(credentials: Union[str, Dict]) -> Dict:
+    """
+    Parse credentials posted by the client (or resolved from a session), swapping in
+    refreshed ones when the token is about to expire
+    """
+    creds = json.loads(credentials) if isinstance(credentials, str) else credentials
+    if _is_expiring(creds) and _can_refresh(creds):
+        creds = await refresh_hubspot_credentials(creds['org_id'], creds['user_id'], creds.get('access_token'))
+    return creds
+
+
+async def _hubspot_request(method: str, path: str, creds: Dict, hedge: Optional[HedgePolicy] = None,
+                           **kwargs) -> httpx.Response:
+    """
+    Call the HubSpot API with the given credentials, refreshing the token and retrying once on 401.
+    Pass a hedge policy only for idempotent reads: a slow call may be sent twice
+    """
+    async with async_client() as client:
+        async def send(creds: Dict) -> httpx.Response:
+            def call():
+                return client.request(method, f"{API_BASE_URL}{path}", headers=_auth_headers(creds), **kwargs)
+            return await (hedge.run(call) if hedge else call())
+
+        response = await send(creds)
+        if response.status_code == 401 and _can_refresh(creds):
+            creds = await refresh_hubspot_credentials(creds['org_id'], creds['user_id'], creds.get('access_token'))
+            response = await send(creds)
+        return response
+
+
+def _auth_headers(creds: Dict) -> Dict:
+    return {
+        'Authorization': f'Bearer {creds.get("access_token")}',
+        'Content-Type': 'application/json'
+    }
+
+
 async def create_integration_item_metadata_object(contact: Dict) -> Dict:
     """
     Transform HubSpot contact data into standardized metadata
@@ -198,71 +423,585 @@ async def create_integration_item_metadata_object(contact: Dict) -> Dict:
     }
 
 
-async def get_items_hubspot(credentials: str) -> List[IntegrationItem]:
+def _contact_integration_item(metadata: Dict, properties: Optional[Dict] = None) -> IntegrationItem:
+    return IntegrationItem(
+        id=metadata['id'],
+        name=metadata['name'],
+        type='contact',
+        parent_id=metadata['company'],
+        parent_path_or_name=metadata['company'],
+        company=metadata['company'],
+        email=metadata['email'],
+        phone=metadata['phone'],
+        visibility=True,
+        properties=properties
+    )
+
+
+async def _contact_items(contacts: List[Dict], properties: List[str]) -> List[IntegrationItem]:
+    """Contacts as IntegrationItems, carrying the requested properties when custom ones were asked for"""
+    projected = not set(properties) <= set(DEFAULT_CONTACT_PROPERTIES)
+    integration_items = []
+    for contact in contacts:
+        metadata = await create_integration_item_metadata_object(contact)
+        contact_properties = contact.get('properties', {})
+        integration_items.append(_contact_integration_item(
+            metadata,
+            {name: contact_properties.get(name) for name in properties} if projected else None
+        ))
+    return integration_items
+
+
+async def get_contact_properties_schema(creds: Dict) -> Dict[str, Dict]:
+    """
+    Contact property definitions of the portal, including custom properties, keyed by name.
+    Cached per portal, so validating a projection rarely costs an API call
+    """
+    portal_id = await get_portal_id(creds)
+    cache_key = portal_id or fingerprint(creds.get('access_token', ''))
+    schema = _properties_schemas.get(cache_key)
+    if schema is not None:
+        return schema
+
+    stored = await get_value_redis(f'hubspot_properties:{cache_key}')
+    if stored:
+        schema = json.loads(stored)
+    else:
+        async def fetch() -> Dict:
+            response = await _hubspot_request('GET', '/crm/v3/properties/contacts', creds)
+            if response.status_code != 200:
+                log.error(f"Failed to fetch HubSpot contact properties: {response.status_code}")
+                raise HTTPException(response.status_code, "Failed to fetch HubSpot contact properties")
+            return {
+                definition['name']: {
+                    'name': definition['name'],
+                    'label': definition.get('label'),
+                    'type': definition.get('type'),
+                    'field_type': definition.get('fieldType'),
+                    'group': definition.get('groupName'),
+                    'custom': not definition.get('hubspotDefined', False),
+                }
+                for definition in response.json().get('results', [])
+            }
+
+        schema = await single_flight(f'hubspot:properties:{cache_key}', fetch)
+        await add_key_value_redis(f'hubspot_properties:{cache_key}', json.dumps(schema), expire=PROPERTIES_SCHEMA_TTL)
+    _properties_schemas.set(cache_key, schema)
+    return schema
+
+
+async def get_contact_properties(credentials: Union[str, Dict]) -> List[Dict]:
+    """Contact properties callers can project loads onto"""
+    creds = await resolve_hubspot_credentials(credentials)
+    return list((await get_contact_properties_schema(creds)).values())
+
+
+async def resolve_contact_properties(creds: Dict, properties: Optional[str]) -> List[str]:
+    """
+    Property names from a comma separated projection, validated against the portal schema.
+    Without a projection the standard contact fields are loaded
+    """
+    if not properties:
+        return DEFAULT_CONTACT_PROPERTIES
+    names = list(dict.fromkeys(name.strip() for name in properties.split(',') if name.strip()))
+    if not set(names) <= set(DEFAULT_CONTACT_PROPERTIES):
+        schema = await get_contact_properties_schema(creds)
+        unknown = [name for name in names if name not in schema]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown HubSpot contact properties: {', '.join(unknown)}")
+    return names
+
+
+async def _fetch_contacts_page(creds: Dict, after: Optional[str] = None,
+                               properties: List[str] = DEFAULT_CONTACT_PROPERTIES) -> Dict:
+    params = {
+        'limit': CONTACTS_PAGE_SIZE,
+        'properties': ','.join(properties)
+    }
+    if after:
+        params['after'] = after
+
+    async def fetch() -> Dict:
+        response = await _hubspot_request('GET', '/crm/v3/objects/contacts', creds, _contacts_page_hedge,
+                                          params=params)
+        if response.status_code != 200:
+            log.error(f"Failed to fetch HubSpot contacts: {response.status_code}")
+            raise HTTPException(status_code=response.status_code, detail="Failed to fetch HubSpot contacts")
+        return response.json()
+
+    # Tabs opening the contacts screen together share one upstream list call
+    key = f'hubspot:contacts:{fingerprint(creds.get("access_token", ""))}:{params["properties"]}:{after or ""}'
+    return await single_flight(key, fetch)
+
+
+async def _fetch_contact(creds: Dict, contact_id: str) -> Dict:
+    async def fetch() -> Dict:
+        response = await _hubspot_request('GET', f'/crm/v3/objects/contacts/{contact_id}', creds, _contact_hedge)
+        if response.status_code != 200:
+            raise HTTPException(response.status_code, "Failed to fetch contact details")
+        return response.json()
+
+    return await single_flight(f'hubspot:contact:{fingerprint(creds.get("access_token", ""))}:{contact_id}', fetch)
+
+
+def parse_associations(associations: Optional[str]) -> List[str]:
+    """Associated object types from a comma separated list such as 'companies,deals'"""
+    if not associations:
+        return []
+    kinds = list(dict.fromkeys(kind.strip() for kind in associations.split(',') if kind.strip()))
+    unknown = [kind for kind in kinds if kind not in ASSOCIATED_OBJECTS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unsupported associations: {', '.join(unknown)}")
+    return kinds
+
+
+async def _batch_read(creds: Dict, path: str, ids: List[str], **body) -> List[Dict]:
+    """POST ids to a HubSpot batch read endpoint in chunks of BATCH_SIZE, concurrently"""
+    responses = await asyncio.gather(*(
+        _hubspot_request('POST', path, creds, json={
+            **body,
+            'inputs': [{'id': object_id} for object_id in ids[start:start + BATCH_SIZE]],
+        })
+        for start in range(0, len(ids), BATCH_SIZE)
+    ))
+    results = []
+    for response in responses:
+        # 207 is a partial success: some ids were not found
+        if response.status_code not in (200, 207):
+            log.error(f"HubSpot batch read {path} failed: {response.status_code}")
+            raise HTTPException(response.status_code, "Failed to read HubSpot associations")
+        results.extend(response.json().get('results', []))
+    return results
+
+
+async def _read_associations(creds: Dict, kind: str, contact_ids: List[str]) -> Dict[str, List[tuple]]:
+    """contact id -> [(associated object id, association type ids)]"""
+    results = await _batch_read(creds, f'/crm/v4/associations/contacts/{kind}/batch/read', contact_ids)
+    return {
+        str(result['from']['id']): [
+            (str(link['toObjectId']), {association['typeId'] for association in link.get('associationTypes', [])})
+            for link in result.get('to', [])
+        ]
+        for result in results
+    }
+
+
+async def _read_objects(creds: Dict, kind: str, ids: List[str]) -> Dict[str, Dict]:
+    results = await _batch_read(creds, f'/crm/v3/objects/{kind}/batch/read', ids,
+                                properties=ASSOCIATED_OBJECTS[kind]['properties'])
+    return {str(result['id']): result for result in results}
+
+
+async def _link_associations(creds: Dict, contacts: List[Dict], contact_items: List[IntegrationItem],
+                             kinds: List[str]) -> List[IntegrationItem]:
+    """
+    Link contacts to their primary company (parent) and deals (children). Each associated object is
+    fetched once however many contacts share it: two batched calls per object type per 100 contacts
+    """
+    contact_ids = [str(contact['id']) for contact in contacts]
+    links = dict(zip(kinds, await asyncio.gather(*(
+        _read_associations(creds, kind, contact_ids) for kind in kinds
+    ))))
+    objects = dict(zip(kinds, await asyncio.gather(*(
+        _read_objects(creds, kind, sorted({object_id for targets in links[kind].values() for object_id, _ in targets}))
+        for kind in kinds
+    ))))
+
+    items_by_contact = {item.id: item for item in contact_items}
+    company_items: Dict[str, IntegrationItem] = {}
+    deal_items: Dict[str, IntegrationItem] = {}
+
+    if 'companies' in kinds:
+        for contact_id, contact_item in items_by_contact.items():
+            targets = links['companies'].get(contact_id, [])
+            primary = next((object_id for object_id, types in targets if PRIMARY_COMPANY_ASSOCIATION in types),
+                           targets[0][0] if targets else None)
+            company = objects['companies'].get(primary)
+            if company is None:
+                # Unlinked contacts no longer point at the free-text company name
+                contact_item.parent_id = None
+                continue
+            company_item = company_items.get(primary)
+            if company_item is None:
+                company_item = company_items[primary] = IntegrationItem(
+                    id=f'{primary}_Company',
+                    type='company',
+                    directory=True,
+                    name=company.get('properties', {}).get('name'),
+                    children=[],
+                    properties=company.get('properties'),
+                )
+            company_item.children.append(contact_id)
+            contact_item.parent_id = company_item.id
+            contact_item.parent_path_or_name = company_item.name
+
+    if 'deals' in kinds:
+        for contact_id, contact_item in items_by_contact.items():
+            for deal_id, _ in links['deals'].get(contact_id, []):
+                deal = objects['deals'].get(deal_id)
+                if deal is None:
+                    continue
+                if deal_id not in deal_items:
+                    deal_items[deal_id] = IntegrationItem(
+                        id=f'{deal_id}_Deal',
+                        type='deal',
+                        name=deal.get('properties', {}).get('dealname'),
+                        parent_id=contact_id,
+                        parent_path_or_name=contact_item.name,
+                        properties=deal.get('properties'),
+                    )
+                contact_item.children = (contact_item.children or []) + [deal_items[deal_id].id]
+
+    return list(company_items.values()) + contact_items + list(deal_items.values())
+
+
+async def get_items_hubspot(credentials: Union[str, Dict], properties: Optional[str] = None,
+                            associations: Optional[str] = None) -> List[IntegrationItem]:
     """
-    Fetch contacts from HubSpot and convert them to IntegrationItem objects
+    Fetch contacts from HubSpot and convert them to IntegrationItem objects, optionally
+    projected to a comma separated list of (custom) properties and linked to associated
+    companies and deals
     """
     try:
-        creds = json.loads(credentials)
+        creds = await resolve_hubspot_credentials(credentials)
         access_token = creds.get('access_token')
 
         if not access_token:
             log.error("Invalid credentials provided")
             raise HTTPException(status_code=400, detail="Invalid credentials")
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
-        # Fetch contacts from HubSpot
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{API_BASE_URL}/crm/v3/objects/contacts",
-                headers=headers,
-                params={
-                    'limit': 100,
-                    'properties': 'firstname,lastname,email,phone,company,createdate,lastmodifieddate'
-                }
-            )
-
-            if response.status_code != 200:
-                log.error(f"Failed to fetch HubSpot contacts: {response.status_code}")
-                raise HTTPException(status_code=response.status_code, detail="Failed to fetch HubSpot contacts")
-
-            contacts_data = response.json()
+        property_names = await resolve_contact_properties(creds, properties)
+        kinds = parse_associations(associations)
+
+        # The mirror and the store only hold the standard fields
+        contacts = None
+        if set(property_names) <= set(DEFAULT_CONTACT_PROPERTIES):
+            portal_id = await _get_mirror_portal(creds)
+            if portal_id is not None:
+                _, contacts = await hubspot_mirror.query_contacts(portal_id)
+            else:
+                contacts = await _get_stored_contacts(creds)
+        if contacts is None:
+            # Fetch contacts from HubSpot
+            contacts = (await _fetch_contacts_page(creds, properties=property_names)).get('results', [])
 
         # Transform contacts into IntegrationItem objects
-        integration_items = []
-        for contact in contacts_data.get('results', []):
-            metadata = await create_integration_item_metadata_object(contact)
-
-            integration_items.append(
-                IntegrationItem(
-                    id=metadata['id'],
-                    name=metadata['name'],
-                    type='contact',
-                    parent_id=metadata['company'],
-                    parent_path_or_name=metadata['company'],
-                    company=metadata['company'],
-                    email=metadata['email'],
-                    phone=metadata['phone'],
-                    visibility=True
-                )
-            )
-
+        integration_items = await _contact_items(contacts, property_names)
+        if kinds:
+            integration_items = await _link_associations(creds, contacts, integration_items, kinds)
         return integration_items
 
+    except HTTPException as e:
+        raise e
     except Exception as e:
         log.error(f"Failed to fetch HubSpot items: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch HubSpot items: {str(e)}")
 
 
+def hubspot_job_credentials(credentials: Union[str, Dict]) -> Dict:
+    """
+    Credentials to store with a queued job. Session-backed credentials are stored as their
+    owner only, so the job runs with whatever token is current when a worker picks it up
+    """
+    creds = json.loads(credentials) if isinstance(credentials, str) else credentials
+    if creds.get('org_id') and creds.get('user_id'):
+        return {'org_id': creds['org_id'], 'user_id': creds['user_id']}
+    return creds
+
+
+async def _load_job_credentials(credentials: Dict) -> Dict:
+    if 'access_token' in credentials:
+        return await resolve_hubspot_credentials(credentials)
+    stored = await get_value_redis(f'hubspot_credentials:{credentials["org_id"]}:{credentials["user_id"]}')
+    if not stored:
+        raise HTTPException(status_code=401, detail="No credentials found, please reconnect")
+    return await resolve_hubspot_credentials(stored.decode() if isinstance(stored, bytes) else stored)
+
+
+async def _crawl_contacts(creds: Dict, ctx: Optional[JobContext] = None,
+                          properties: List[str] = DEFAULT_CONTACT_PROPERTIES) -> List[Dict]:
+    contacts = []
+    after = None
+    while True:
+        contacts_data = await _fetch_contacts_page(creds, after, properties)
+        contacts.extend(contacts_data.get('results', []))
+        after = contacts_data.get('paging', {}).get('next', {}).get('after')
+        if ctx is not None:
+            await ctx.progress(len(contacts), message='Fetching contacts')
+        if not after:
+            return contacts
+
+
+@job('hubspot.load')
+async def load_hubspot_job(ctx: JobContext, credentials: Dict, properties: List[str] = DEFAULT_CONTACT_PROPERTIES,
+                           associations: Optional[List[str]] = None) -> List[IntegrationItem]:
+    """Crawl every contact page, reporting progress after each one"""
+    creds = await _load_job_credentials(credentials)
+    contacts = await _crawl_contacts(creds, ctx, properties)
+    integration_items = await _contact_items(contacts, properties)
+    if associations:
+        await ctx.progress(len(contacts), len(contacts), message='Linking associations')
+        integration_items = await _link_associations(creds, contacts, integration_items, associations)
+    return integration_items
+
+
+@job('hubspot.sync')
+async def sync_hubspot_contacts_job(ctx: JobContext, credentials: Dict, portal_id: str) -> Dict:
+    """Snapshot a portal's contacts into the contact store that webhooks keep current"""
+    creds = await _load_job_credentials(credentials)
+    try:
+        await contact_store.begin_crawl(portal_id)
+        contacts = await _crawl_contacts(creds, ctx)
+        await contact_store.replace_contacts(portal_id, contacts)
+    finally:
+        await contact_store.end_crawl(portal_id)
+        await delete_key_redis(f'hubspot_contacts_sync:{portal_id}')
+    log.info(f"Synced {len(contacts)} HubSpot contacts for portal {portal_id}")
+    return {'portal_id': portal_id, 'contacts': len(contacts)}
+
+
+def _search_filter(property_name: str, operator: str, value) -> Dict:
+    return {'propertyName': property_name, 'operator': operator, 'value': str(value)}
+
+
+async def _search_contacts_page(creds: Dict, filters: List[Dict], sort: str, after: Optional[str]) -> Dict:
+    response = await _hubspot_request('POST', '/crm/v3/objects/contacts/search', creds, json={
+        'filterGroups': [{'filters': filters}],
+        # The search API takes a single sort
+        'sorts': [{'propertyName': sort, 'direction': 'ASCENDING'}],
+        'properties': DEFAULT_CONTACT_PROPERTIES,
+        'limit': CONTACTS_PAGE_SIZE,
+        'after': after or '0',
+    })
+    if response.status_code != 200:
+        log.error(f"Failed to search HubSpot contacts: {response.status_code}")
+        raise HTTPException(response.status_code, "Failed to search HubSpot contacts")
+    return response.json()
+
+
+def _modified_at(contact: Dict) -> int:
+    """A contact's lastmodifieddate in epoch milliseconds, 0 when missing"""
+    last_modified = (contact.get('properties') or {}).get('lastmodifieddate')
+    if not last_modified:
+        return 0
+    return int(datetime.fromisoformat(last_modified.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+async def _apply_search(creds: Dict, portal_id: str, filters: List[Dict],
+                        sort: str) -> Tuple[int, Optional[Dict], bool]:
+    """
+    Apply a search's results to the mirror and the change log page by page, up to the search cap.
+    Returns how many contacts it applied, the last of them, and whether the cap cut it short
+    """
+    after = None
+    applied = 0
+    last = None
+    while True:
+        page = await _search_contacts_page(creds, filters, sort, after)
+        results = page.get('results', [])
+        await hubspot_mirror.apply_changes(portal_id, results)
+        await record_changes(creds.get('org_id'), results, source=SOURCE_SYNC)
+        applied += len(results)
+        last = results[-1] if results else last
+        after = page.get('paging', {}).get('next', {}).get('after')
+        if not after:
+            return applied, last, False
+        if int(after) >= SEARCH_RESULT_LIMIT:
+            return applied, last, True
+
+
+async def _sync_mirror(creds: Dict, portal_id: str, full: bool):
+    """
+    Bring the portal's local mirror up to date: a full crawl, or only contacts modified since the
+    last sync through the search API. Deletions arrive through webhooks or the next full crawl
+    """
+    started = int(time.time() * 1000)
+    watermark = str(started - MIRROR_SYNC_OVERLAP)
+    state = await hubspot_mirror.get_sync_state(portal_id)
+    since = int(state.get('watermark') or 0)
+    if full:
+        contacts = await _crawl_contacts(creds)
+        removed = await hubspot_mirror.replace_contacts(portal_id, contacts, watermark)
+        if since:
+            # Against the previous sync; a first crawl has nothing to compare with
+            modified = [contact for contact in contacts if _modified_at(contact) >= since]
+            await record_changes(creds.get('org_id'), modified, removed, SOURCE_SYNC)
+        log.info(f"Mirrored {len(contacts)} HubSpot contacts for portal {portal_id}")
+        return
+
+    changed = 0
+    operator = 'GTE'
+    while True:
+        applied, last, capped = await _apply_search(
+            creds, portal_id, [_search_filter('lastmodifieddate', operator, since)], 'lastmodifieddate'
+        )
+        changed += applied
+        if not capped:
+            break
+        newest = _modified_at(last)
+        if newest > since:
+            # Continue past the search cap from the newest modification seen so far
+            since, operator = newest, 'GTE'
+            continue
+        # A whole search of contacts share this timestamp (a bulk import): page through them by id instead,
+        # then carry on after it
+        last_id = 0
+        while True:
+            applied, last, capped = await _apply_search(creds, portal_id, [
+                _search_filter('lastmodifieddate', 'EQ', since), _search_filter('hs_object_id', 'GT', last_id),
+            ], 'hs_object_id')
+            changed += applied
+            if not capped:
+                break
+            last_id = int(last['id'])
+        operator = 'GT'
+    await hubspot_mirror.apply_changes(portal_id, [], watermark=watermark)
+    log.info(f"Synced {changed} changed HubSpot contacts into the mirror for portal {portal_id}")
+
+
+async def _sync_mirror_exclusive(creds: Dict, portal_id: str, full: bool):
+    lock_key = f'hubspot_mirror_sync:{socket.gethostname()}:{portal_id}'
+    lock_token = await acquire_lock(lock_key, MIRROR_SYNC_LOCK_TTL)
+    if lock_token is None:
+        # Another worker on this host is already syncing the same file
+        return
+    try:
+        await _sync_mirror(creds, portal_id, full)
+    finally:
+        await release_lock(lock_key, lock_token)
+
+
+async def _get_mirror_portal(creds: Dict) -> Optional[str]:
+    """
+    Portal whose local mirror can serve this read, or None. Starts a background sync when the
+    mirror is missing or due for one
+    """
+    if not hubspot_mirror.is_enabled():
+        return None
+    portal_id = await get_portal_id(creds)
+    if portal_id is None:
+        return None
+
+    state = await hubspot_mirror.get_sync_state(portal_id)
+    now = time.time()
+    full = now - float(state.get('full_synced_at', 0)) > hubspot_mirror.MIRROR_FULL_SYNC_INTERVAL
+    due = full or now - float(state.get('synced_at', 0)) > hubspot_mirror.MIRROR_SYNC_INTERVAL
+    if due and portal_id not in _mirror_syncs:
+        task = detached_task(_sync_mirror_exclusive(creds, portal_id, full))
+        _mirror_syncs[portal_id] = task
+
+        def done(_):
+            _mirror_syncs.pop(portal_id, None)
+            if not task.cancelled() and task.exception():
+                log.error(f"HubSpot mirror sync failed for portal {portal_id}: {str(task.exception())}")
+
+        task.add_done_callback(done)
+    return portal_id if 'full_synced_at' in state else None
+
+
+async def search_contacts(credentials: Union[str, Dict], search: Optional[str] = None, filters: Optional[Dict] = None,
+                          sort: str = 'id', order: str = 'asc', limit: int = 100, offset: int = 0) -> Dict:
+    """
+    Full-text search, filtering, sorting and counting over the portal's local contact mirror
+    """
+    if sort not in hubspot_mirror.SORTABLE_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail=f"Unsupported order: {order}")
+    if not hubspot_mirror.is_enabled():
+        raise HTTPException(status_code=501, detail="Contact mirror is not enabled")
+
+    creds = await resolve_hubspot_credentials(credentials)
+    portal_id = await _get_mirror_portal(creds)
+    if portal_id is None:
+        raise HTTPException(status_code=503, detail="Contact mirror is syncing, try again shortly",
+                            headers={'Retry-After': '5'})
+
+    total, contacts = await hubspot_mirror.query_contacts(
+        portal_id, search, filters, sort, order == 'desc', min(max(limit, 1), 1000), max(offset, 0)
+    )
+    return {'total': total, 'results': await _contact_items(contacts, DEFAULT_CONTACT_PROPERTIES)}
+
+
+async def get_contact_changes(credentials: Union[str, Dict], since: Optional[str] = None,
+                              limit: int = CHANGES_PAGE_SIZE) -> Dict:
+    """Page of the org's contact change log after the `since` cursor (see hubspot_changes)"""
+    creds = await resolve_hubspot_credentials(credentials)
+    if not creds.get('org_id'):
+        raise HTTPException(status_code=400, detail="Changes are tracked per org; connect with a session")
+    # Webhook events name only the portal; this records which org's log they belong in
+    await get_portal_id(creds)
+    return await read_changes(creds['org_id'], since, limit)
+
+
+async def get_portal_id(creds: Dict) -> Optional[str]:
+    """
+    HubSpot portal the credentials belong to, looked up once per org/user. Also records the
+    portal's owner so webhook handling can fetch contacts on its behalf
+    """
+    if not creds.get('org_id') or not creds.get('user_id'):
+        return None
+    key = (creds['org_id'], creds['user_id'])
+    portal_id = _portal_ids.get(key)
+    if portal_id is None:
+        stored = await get_value_redis(f'hubspot_portal:{creds["org_id"]}:{creds["user_id"]}')
+        if stored:
+            portal_id = stored.decode() if isinstance(stored, bytes) else stored
+        else:
+            async with async_client() as client:
+                response = await client.get(f"{API_BASE_URL}/oauth/v1/access-tokens/{creds.get('access_token')}")
+            if response.status_code != 200:
+                log.warn(f"Failed to look up HubSpot portal: {response.status_code}")
+                return None
+            portal_id = str(response.json()['hub_id'])
+            await add_key_value_redis(f'hubspot_portal:{creds["org_id"]}:{creds["user_id"]}', portal_id,
+                                      expire=CREDENTIALS_TTL)
+            await add_key_value_redis(f'hubspot_portal_owner:{portal_id}', json.dumps(
+                {'org_id': creds['org_id'], 'user_id': creds['user_id']}), expire=CREDENTIALS_TTL)
+        _portal_ids[key] = portal_id
+    return portal_id
+
+
+async def _get_stored_contacts(creds: Dict) -> Optional[List[Dict]]:
+    """
+    Contacts from the webhook-maintained store, or None when it cannot serve this read yet.
+    The first miss for a portal enqueues the crawl that fills it
+    """
+    if not contact_store.STORE_ENABLED:
+        return None
+    portal_id = await get_portal_id(creds)
+    if portal_id is None:
+        return None
+    contacts = await contact_store.get_stored_contacts(portal_id)
+    if contacts is None and await acquire_lock(f'hubspot_contacts_sync:{portal_id}', CONTACT_SYNC_LOCK_TTL):
+        await enqueue_job('hubspot.sync', {'credentials': hubspot_job_credentials(creds), 'portal_id': portal_id},
+                          creds['org_id'], creds['user_id'])
+    return contacts
+
+
+@job('hubspot.summarize')
+async def summarize_hubspot_job(ctx: JobContext, credentials: Dict, contact_ids: List[str]) -> Dict:
+    """
+    Summarize contacts a batch at a time: each batch is requested concurrently so the summaries share
+    completions, and the job can be cancelled between batches
+    """
+    creds = await _load_job_credentials(credentials)
+    summaries = {}
+    for start in range(0, len(contact_ids), BATCH_MAX_CONTACTS):
+        chunk = contact_ids[start:start + BATCH_MAX_CONTACTS]
+        results = await asyncio.gather(*(summarize_contact(creds, contact_id) for contact_id in chunk))
+        for contact_id, result in zip(chunk, results):
+            summaries[contact_id] = result['summary']
+        await ctx.progress(len(summaries), len(contact_ids))
+    return summaries
+
+
 async def logout_hubspot_account(user_id: str, org_id: str):
     try:
         # Clear credentials from Redis
         await delete_key_redis(f'hubspot_credentials:{org_id}:{user_id}')
         await delete_key_redis(f'hubspot_state:{org_id}:{user_id}')
+        await delete_sessions('hubspot', org_id, user_id)
         log.info(f"Successfully logged out user {user_id} from org {org_id}")
         return {
             "status": "success",
@@ -274,22 +1013,17 @@ async def logout_hubspot_account(user_id: str, org_id: str):
         raise HTTPException(status_code=500, detail=f"Logout failed: {str(e)}")
 
 
-async def create_contact(credentials: str, contact_data: Dict) -> Dict:
+async def create_contact(credentials: Union[str, Dict], contact_data: Dict) -> Dict:
     log.info(f"Creating contact with data: {contact_data}")
     """Create a new HubSpot contact"""
     try:
-        creds = json.loads(credentials)
+        creds = await resolve_hubspot_credentials(credentials)
         access_token = creds.get('access_token')
 
         if not access_token:
             log.error("No access token found in credentials")
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
         # Map IntegrationItem fields to HubSpot properties
         properties = {
             "firstname": str(contact_data.get("firstname", "")),
@@ -301,24 +1035,26 @@ async def create_contact(credentials: str, contact_data: Dict) -> Dict:
         # Log the request details for debugging
         log.info(f"Making request to HubSpot with properties: {properties}")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{API_BASE_URL}/crm/v3/objects/contacts",
-                headers=headers,
-                json={"properties": properties}
-            )
+        response = await _hubspot_request(
+            'POST',
+            '/crm/v3/objects/contacts',
+            creds,
+            json={"properties": properties}
+        )
 
-            # Log the response for debugging
-            log.info(f"HubSpot response status: {response.status_code}")
-            if response.status_code != 201:
-                log.error(f"HubSpot error response: {response.text}")
-                if response.status_code == 409:
-                    # Handle conflict error when contact already exists
-                    error_data = response.json()
-                    raise HTTPException(409, error_data.get("message", "Contact already exists"))
-                raise HTTPException(response.status_code, f"Failed to create contact: {response.text}")
+        # Log the response for debugging
+        log.info(f"HubSpot response status: {response.status_code}")
+        if response.status_code != 201:
+            log.error(f"HubSpot error response: {response.text}")
+            if response.status_code == 409:
+                # Handle conflict error when contact already exists
+                error_data = response.json()
+                raise HTTPException(409, error_data.get("message", "Contact already exists"))
+            raise HTTPException(response.status_code, f"Failed to create contact: {response.text}")
 
-            return response.json()
+        contact = response.json()
+        await record_changes(creds.get('org_id'), [contact])
+        return contact
 
     except json.JSONDecodeError as e:
         log.error(f"Failed to parse credentials: {str(e)}")
@@ -331,22 +1067,17 @@ async def create_contact(credentials: str, contact_data: Dict) -> Dict:
         raise HTTPException(500, f"Failed to create contact: {str(e)}")
 
 
-async def update_contact(credentials: str, contact_id: str,
+async def update_contact(credentials: Union[str, Dict], contact_id: str,
                          contact_data: Dict) -> Dict:
     """Update an existing HubSpot contact"""
     try:
-        creds = json.loads(credentials)
+        creds = await resolve_hubspot_credentials(credentials)
         access_token = creds.get('access_token')
 
         if not access_token:
             log.error("No access token found in credentials")
             raise HTTPException(401, "Invalid credentials")
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
         # Map IntegrationItem fields to HubSpot properties
         properties = {
             "firstname": str(contact_data.get("firstname", "")),
@@ -362,90 +1093,74 @@ async def update_contact(credentials: str, contact_id: str,
         # Log the request details for debugging
         log.info(f"Making update request to HubSpot for contact {contact_id} with properties: {properties}")
 
-        async with httpx.AsyncClient() as client:
-            response = await client.patch(
-                f"{API_BASE_URL}/crm/v3/objects/contacts/{contact_id}",
-                headers=headers,
-                json={"properties": properties}
-            )
+        response = await _hubspot_request(
+            'PATCH',
+            f'/crm/v3/objects/contacts/{contact_id}',
+            creds,
+            json={"properties": properties}
+        )
 
-            # Log the response for debugging
-            log.info(f"HubSpot response status: {response.status_code}")
-            if response.status_code != 200:
-                log.error(f"HubSpot error response: {response.text}")
-                raise HTTPException(response.status_code, f"Failed to update contact: {response.text}")
+        # Log the response for debugging
+        log.info(f"HubSpot response status: {response.status_code}")
+        if response.status_code != 200:
+            log.error(f"HubSpot error response: {response.text}")
+            raise HTTPException(response.status_code, f"Failed to update contact: {response.text}")
 
-            return response.json()
+        contact = response.json()
+        await record_changes(creds.get('org_id'), [contact])
+        return contact
 
     except json.JSONDecodeError as e:
         log.error(f"Failed to parse credentials: {str(e)}")
         raise HTTPException(400, "Invalid credentials format")
+    except (Overloaded, DeadlineExceeded):
+        raise
     except Exception as e:
         log.error(f"Failed to update contact: {str(e)}")
         raise HTTPException(500, f"Failed to update contact: {str(e)}")
 
 
-async def delete_contact(credentials: str, contact_id: str):
+async def delete_contact(credentials: Union[str, Dict], contact_id: str):
     """Delete a HubSpot contact"""
     try:
-        creds = json.loads(credentials)
-        access_token = creds.get('access_token')
+        creds = await resolve_hubspot_credentials(credentials)
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-        }
-
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{API_BASE_URL}/crm/v3/objects/contacts/{contact_id}",
-                headers=headers
-            )
+        response = await _hubspot_request('DELETE', f'/crm/v3/objects/contacts/{contact_id}', creds)
 
-            if response.status_code != 204:
-                log.error(f"Failed to delete contact: {response.status_code}")
-                raise HTTPException(response.status_code, "Failed to delete contact")
+        if response.status_code != 204:
+            log.error(f"Failed to delete contact: {response.status_code}")
+            raise HTTPException(response.status_code, "Failed to delete contact")
 
-            log.info(f"Successfully deleted contact {contact_id}")
-            return {"status": "success", "message": "Contact deleted successfully"}
+        await record_changes(creds.get('org_id'), deletions=[contact_id])
+        log.info(f"Successfully deleted contact {contact_id}")
+        return {"status": "success", "message": "Contact deleted successfully"}
 
+    except (Overloaded, DeadlineExceeded):
+        raise
     except Exception as e:
         log.error(f"Failed to delete contact: {str(e)}")
         raise HTTPException(500, f"Failed to delete contact: {str(e)}")
 
 
-async def summarize_contact(credentials: str, contact_id: str):
+async def summarize_contact(credentials: Union[str, Dict], contact_id: str):
     log.info(f"Summarizing contact{contact_id}  {credentials}")
     try:
         # Get contact data using existing function
-        creds = json.loads(credentials)
+        creds = await resolve_hubspot_credentials(credentials)
         access_token = creds.get('access_token')
 
         if not access_token:
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-            'Content-Type': 'application/json'
-        }
-
         # Fetch contact details
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{API_BASE_URL}/crm/v3/objects/contacts/{contact_id}",
-                headers=headers
-            )
+        contact_data = await _fetch_contact(creds, contact_id)
+        # Create metadata object using existing function
+        metadata = await create_integration_item_metadata_object(contact_data)
 
-            if response.status_code != 200:
-                raise HTTPException(response.status_code, "Failed to fetch contact details")
+        # Generate summary, batched only with other contacts of the same org (or legacy token)
+        summary = await summarize_contact_ai(metadata, creds.get('org_id') or fingerprint(access_token))
 
-            contact_data = response.json()
-            # Create metadata object using existing function
-            metadata = await create_integration_item_metadata_object(contact_data)
-
-            # Generate summary
-            summary = await summarize_contact_ai(metadata)
-
-            return {"summary": summary}
+        return {"summary": summary}
 
     except json.JSONDecodeError:
         raise HTTPException(400, "Invalid credentials format")
@@ -454,3 +1169,173 @@ async def summarize_contact(credentials: str, contact_id: str):
     except Exception as e:
         log.error(f"Failed to summarize contact: {str(e)}")
         raise HTTPException(500, f"Failed to summarize contact: {str(e)}")
+
+
+def _file_metadata(file_data: Dict) -> Dict:
+    name = file_data.get('name', '')
+    extension = file_data.get('extension')
+    return {
+        "id": str(file_data.get('id', '')),
+        "name": f"{name}.{extension}" if extension else name,
+        "size": file_data.get('size'),
+        "type": file_data.get('type'),
+        "url": file_data.get('url'),
+        "created_at": file_data.get('createdAt')
+    }
+
+
+async def _contact_files_cache_key(creds: Dict, contact_id: str) -> Optional[str]:
+    # Scoped to the portal the contact lives in; legacy credential blobs carry no owner to look
+    # it up with, so their listings are not cached
+    portal_id = await get_portal_id(creds)
+    if portal_id is None:
+        return None
+    return f'hubspot_contact_files:{portal_id}:{contact_id}'
+
+
+async def _file_upload_body(boundary: str, upload: MultipartFileStream, contact_id: str):
+    """Multipart body for the Files API, streaming the file part straight from the incoming request"""
+    options = json.dumps({'access': 'PRIVATE', 'overwrite': False})
+    filename = upload.filename.replace('"', '')
+    yield (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="options"\r\n\r\n{options}\r\n'
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="folderPath"\r\n\r\n{CONTACT_FILES_FOLDER}/{contact_id}\r\n'
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: {upload.content_type}\r\n\r\n'
+    ).encode()
+    async for chunk in upload.chunks():
+        yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+
+async def upload_contact_file(credentials: Union[str, Dict], contact_id: str, request: Request) -> Dict:
+    """
+    Stream a multipart upload to the HubSpot Files API and attach it to the contact through a note
+    """
+    try:
+        creds = await resolve_hubspot_credentials(credentials)
+
+        content_length = request.headers.get('content-length')
+        if content_length and int(content_length) > MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+            raise HTTPException(413, f"File exceeds the {MAX_FILE_SIZE} byte limit")
+
+        upload = MultipartFileStream(request, 'file', MAX_FILE_SIZE)
+        await upload.open()
+        extension = upload.filename.rsplit('.', 1)[-1].lower() if '.' in upload.filename else ''
+        if extension not in ALLOWED_EXTENSIONS:
+            raise HTTPException(400, f"File type not allowed, expected one of {', '.join(ALLOWED_EXTENSIONS)}")
+
+        log.info(f"Uploading {upload.filename} for contact {contact_id}")
+        boundary = secrets.token_hex(16)
+        # The body is a one-shot stream, so this call cannot go through the 401 retry in _hubspot_request
+        async with async_client(timeout=FILE_UPLOAD_TIMEOUT) as client:
+            response = await client.post(
+                f"{API_BASE_URL}/files/v3/files",
+                headers={
+                    'Authorization': f'Bearer {creds.get("access_token")}',
+                    'Content-Type': f'multipart/form-data; boundary={boundary}'
+                },
+                content=_file_upload_body(boundary, upload, contact_id)
+            )
+
+        if response.status_code not in (200, 201):
+            log.error(f"HubSpot file upload failed: {response.status_code} {response.text}")
+            raise HTTPException(response.status_code, "Failed to upload file")
+        file_data = response.json()
+
+        note = await _hubspot_request(
+            'POST',
+            '/crm/v3/objects/notes',
+            creds,
+            json={
+                "properties": {
+                    "hs_timestamp": int(time.time() * 1000),
+                    "hs_note_body": f"Attached file {upload.filename}",
+                    "hs_attachment_ids": str(file_data['id'])
+                },
+                "associations": [{
+                    "to": {"id": contact_id},
+                    "types": [{
+                        "associationCategory": "HUBSPOT_DEFINED",
+                        "associationTypeId": NOTE_TO_CONTACT_ASSOCIATION
+                    }]
+                }]
+            }
+        )
+        if note.status_code != 201:
+            log.error(f"Failed to attach file {file_data['id']} to contact {contact_id}: {note.text}")
+            raise HTTPException(note.status_code, "Failed to attach file to contact")
+
+        cache_key = await _contact_files_cache_key(creds, contact_id)
+        if cache_key:
+            await delete_key_redis(cache_key)
+
+        return _file_metadata(file_data)
+
+    except UploadTooLarge:
+        raise HTTPException(413, f"File exceeds the {MAX_FILE_SIZE} byte limit")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.error(f"Failed to upload file: {str(e)}")
+        raise HTTPException(500, f"Failed to upload file: {str(e)}")
+
+
+async def get_contact_files(credentials: Union[str, Dict], contact_id: str) -> List[Dict]:
+    """
+    List files attached to a contact through its notes, cached per contact
+    """
+    try:
+        creds = await resolve_hubspot_credentials(credentials)
+
+        cache_key = await _contact_files_cache_key(creds, contact_id)
+        if cache_key:
+            cached = await get_value_redis(cache_key)
+            if cached:
+                return json.loads(cached)
+
+        # Notes associated with the contact
+        note_ids = []
+        params = {'limit': 500}
+        while True:
+            response = await _hubspot_request(
+                'GET', f'/crm/v4/objects/contacts/{contact_id}/associations/notes', creds, params=params
+            )
+            if response.status_code != 200:
+                raise HTTPException(response.status_code, "Failed to fetch contact notes")
+            data = response.json()
+            note_ids.extend(str(result['toObjectId']) for result in data.get('results', []))
+            after = data.get('paging', {}).get('next', {}).get('after')
+            if not after:
+                break
+            params = {'limit': 500, 'after': after}
+
+        # Attachment ids on those notes; notes deleted since (per-item errors of a 207) are skipped
+        notes = await _batch_read(creds, '/crm/v3/objects/notes/batch/read', note_ids, properties=['hs_attachment_ids'])
+        file_ids = list(dict.fromkeys(
+            file_id
+            for note in notes
+            for file_id in ((note.get('properties') or {}).get('hs_attachment_ids') or '').split(';')
+            if file_id
+        ))
+
+        responses = await asyncio.gather(
+            *(_hubspot_request('GET', f'/files/v3/files/{file_id}', creds) for file_id in file_ids)
+        )
+        files = [_file_metadata(response.json()) for response in responses if response.status_code == 200]
+
+        if cache_key:
+            await add_key_value_redis(cache_key, json.dumps(files), expire=CONTACT_FILES_CACHE_TTL)
+
+        return files
+
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        log.error(f"Failed to list contact files: {str(e)}")
+        raise HTTPException(500, f"Failed to list contact files: {str(e)}")
@@ -0,0 +1,162 @@
+"""
+Per-org contact change log, so downstream consumers can poll for deltas instead of diffing
+full loads.
+
+Every contact change the backend makes or learns about (create / update / delete / merge
+endpoints, webhook batches, mirror syncs) is appended to a Redis Stream per org. The stream id of
+an entry is the consumer's cursor: GET /integrations/hubspot/changes?since=<cursor> returns the
+entries after it, oldest first. Entries older than CHANGELOG_RETENTION are trimmed, and a cursor
+from before the oldest retained entry is answered with 410 so the consumer knows to reload in full.
+Polls that find nothing new still move the cursor forward, so a quiet org's consumer never expires.
+
+Consumers start by asking without `since` for the current cursor, do one full load, then poll
+with the cursor from each response. An upsert carries the contact's properties as known to the
+source, which may be only the ones that changed, so consumers apply it as a patch. The same change
+can be reported by more than one source (e.g. our own update and the webhook HubSpot sends for
+it); applying entries in order is idempotent.
+"""
+import json
+import os
+import re
+import time
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from redis_client import append_stream_redis, get_value_redis, read_stream_redis, stream_info_redis, time_ms_redis
+from utils.logger import log
+
+# Changes are kept this long (seconds); consumers polling less often must reload in full
+CHANGELOG_RETENTION = int(os.environ.get('HUBSPOT_CHANGELOG_RETENTION', 60 * 60 * 24 * 7))
+CHANGES_PAGE_SIZE = 500
+MAX_CHANGES_PAGE_SIZE = 5000
+
+UPSERT = 'upsert'
+DELETE = 'delete'
+
+# Change sources
+SOURCE_API = 'api'
+SOURCE_WEBHOOK = 'webhook'
+SOURCE_SYNC = 'sync'
+SOURCE_MERGE = 'merge'
+
+CURSOR = re.compile(r'^\d+(-\d+)?$')
+
+
+def _stream_key(org_id: str) -> str:
+    return f'hubspot_changes:{org_id}'
+
+
+def _decode(value: Union[str, bytes]) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def record_changes(org_id: Optional[str], upserts: Iterable[Dict] = (), deletions: Iterable[str] = (),
+                         source: str = SOURCE_API):
+    """
+    Append contact changes to the org's log: upserts are contacts in HubSpot API shape
+    ({'id', 'properties'}), deletions are contact ids
+    """
+    entries = [
+        {'op': UPSERT, 'id': str(contact['id']), 'properties': json.dumps(contact.get('properties', {})),
+         'source': source}
+        for contact in upserts
+    ]
+    entries += [{'op': DELETE, 'id': str(contact_id), 'source': source} for contact_id in deletions]
+    if not org_id or not entries:
+        return
+    min_id = f'{int(time.time() * 1000) - CHANGELOG_RETENTION * 1000}-0'
+    try:
+        await append_stream_redis(_stream_key(org_id), entries, min_id=min_id, expire=CHANGELOG_RETENTION)
+    except Exception as e:
+        # The change has already happened in HubSpot; failing the caller now would not undo it
+        log.error(f"Failed to record {len(entries)} HubSpot contact changes for org {org_id}: {str(e)}")
+
+
+async def record_portal_changes(portal_id: str, upserts: Iterable[Dict] = (), deletions: Iterable[str] = (),
+                                source: str = SOURCE_WEBHOOK):
+    """Record changes to a portal under the org that connected it"""
+    owner = await get_value_redis(f'hubspot_portal_owner:{portal_id}')
+    if not owner:
+        return
+    await record_changes(json.loads(owner).get('org_id'), upserts, deletions, source)
+
+
+def _position(entry_id: str):
+    milliseconds, _, sequence = entry_id.partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+async def _tail(key: str) -> Tuple[str, Optional[Dict]]:
+    """
+    Cursor at the newest change or at the present, whichever is later, and the stream's info. Past
+    the present rather than the last change, so polling a quiet log still moves cursors forward
+    """
+    info = await stream_info_redis(key)
+    # Entries appended from here on get ids from this millisecond on, so stop just short of it
+    now = f'{await time_ms_redis() - 1}-0'
+    if info is None:
+        return now, None
+    return max(_decode(info['last_id']), now, key=_position), info
+
+
+def _expired(since: str, info: Optional[Dict]) -> bool:
+    """Whether changes after `since` may have been trimmed away"""
+    if since == '0':
+        return False
+    # Trimming only drops entries older than the retention window, so a newer cursor has lost nothing;
+    # consumers that keep polling always hold one
+    if _position(since)[0] >= (time.time() - CHANGELOG_RETENTION) * 1000:
+        return False
+    if info is None:
+        # A whole retention period without writes expired the log, and whatever it held
+        return True
+    # Everything after the cursor is still there if the oldest retained entry is not past it
+    oldest = info['first_id'] if info['first_id'] is not None else info['last_id']
+    return _position(since) < _position(_decode(oldest))
+
+
+def _change(entry_id, fields: Dict) -> Dict:
+    entry_id = _decode(entry_id)
+    fields = {_decode(name): _decode(value) for name, value in fields.items()}
+    change = {
+        'cursor': entry_id,
+        'op': fields['op'],
+        'id': fields['id'],
+        'source': fields.get('source'),
+        'changed_at': int(entry_id.split('-')[0]),
+    }
+    if fields['op'] == UPSERT:
+        change['properties'] = json.loads(fields.get('properties') or '{}')
+    return change
+
+
+async def read_changes(org_id: str, since: Optional[str] = None, limit: int = CHANGES_PAGE_SIZE) -> Dict:
+    """
+    Changes after the `since` cursor, oldest first, with the cursor to poll from next. Without
+    `since` only the current cursor is returned; since=0 returns every retained change
+    """
+    key = _stream_key(org_id)
+    if since is not None and not CURSOR.match(since):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Read before the entries, so a change appended in between is after it and not skipped
+    tail, info = await _tail(key)
+    if since is None:
+        return {'changes': [], 'cursor': tail, 'has_more': False}
+    if _expired(since, info):
+        raise HTTPException(status_code=410, detail="Cursor expired, reload all contacts and start over")
+
+    limit = min(max(limit, 1), MAX_CHANGES_PAGE_SIZE)
+    # One extra entry tells whether another page follows
+    entries = await read_stream_redis(key, since, limit + 1)
+    changes = [_change(entry_id, fields) for entry_id, fields in entries[:limit]]
+    if changes:
+        cursor = changes[-1]['cursor']
+    else:
+        # Nothing new up to the tail: move the cursor there rather than handing `since` back
+        cursor = tail if _position(tail) > _position(since) else since
+    return {
+        'changes': changes,
+        'cursor': cursor,
+        'has_more': len(entries) > limit,
+    }
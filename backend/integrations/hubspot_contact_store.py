@@ -0,0 +1,107 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+from redis_client import add_key_value_redis, delete_keys_redis, get_hash_redis, get_hash_fields_redis, \
+    set_hash_redis, delete_hash_fields_redis, key_exists_redis, replace_hash_redis
+
+# Serve contact reads from the store only when HubSpot is configured to send contact webhooks,
+# otherwise nothing would keep it up to date
+STORE_ENABLED = os.environ.get('HUBSPOT_WEBHOOKS_ENABLED', '').lower() in ('1', 'true', 'yes')
+# A portal is re-crawled once its snapshot is this old, bounding drift from missed webhooks
+CONTACT_STORE_TTL = 60 * 60 * 24
+# Upper bound on a crawl; webhook changes are journaled for replay onto the snapshot meanwhile
+CRAWL_TTL = 60 * 60
+
+
+def _contacts_key(portal_id: str) -> str:
+    return f'hubspot_contacts:{portal_id}'
+
+
+def _synced_key(portal_id: str) -> str:
+    return f'hubspot_contacts_synced:{portal_id}'
+
+
+def _crawling_key(portal_id: str) -> str:
+    return f'hubspot_contacts_crawling:{portal_id}'
+
+
+def _journal_key(portal_id: str) -> str:
+    return f'hubspot_contacts_journal:{portal_id}'
+
+
+async def is_synced(portal_id: str) -> bool:
+    return await key_exists_redis(_synced_key(portal_id))
+
+
+async def is_crawling(portal_id: str) -> bool:
+    return await key_exists_redis(_crawling_key(portal_id))
+
+
+async def begin_crawl(portal_id: str):
+    """Start journaling contact changes, to be replayed onto the crawl's snapshot when it is stored"""
+    await delete_keys_redis(_journal_key(portal_id))
+    await add_key_value_redis(_crawling_key(portal_id), '1', expire=CRAWL_TTL)
+
+
+async def end_crawl(portal_id: str):
+    await delete_keys_redis(_crawling_key(portal_id), _journal_key(portal_id))
+
+
+async def get_stored_contacts(portal_id: str) -> Optional[List[Dict]]:
+    """
+    All stored contacts of a portal in HubSpot API shape ({'id', 'properties'}),
+    or None when the portal has not been crawled yet
+    """
+    if not await is_synced(portal_id):
+        return None
+    stored = await get_hash_redis(_contacts_key(portal_id))
+    contacts = [
+        {
+            'id': contact_id.decode() if isinstance(contact_id, bytes) else contact_id,
+            'properties': json.loads(properties)
+        }
+        for contact_id, properties in stored.items()
+    ]
+    # HubSpot ids are numeric strings; order them numerically like the API does
+    contacts.sort(key=lambda contact: (len(contact['id']), contact['id']))
+    return contacts
+
+
+async def replace_contacts(portal_id: str, contacts: List[Dict]):
+    """
+    Store a full crawl of the portal and mark it as synced, in one step: reads see either the
+    previous snapshot or this one, with the changes journaled since begin_crawl applied on top
+    """
+    await replace_hash_redis(
+        _contacts_key(portal_id),
+        {contact['id']: json.dumps(contact.get('properties', {})) for contact in contacts},
+        _journal_key(portal_id),
+        _synced_key(portal_id),
+        CONTACT_STORE_TTL
+    )
+
+
+async def get_stored_properties(portal_id: str, contact_ids: List[str]) -> Dict[str, Optional[Dict]]:
+    values = await get_hash_fields_redis(_contacts_key(portal_id), contact_ids)
+    return {
+        contact_id: json.loads(value) if value else None
+        for contact_id, value in zip(contact_ids, values)
+    }
+
+
+async def apply_contact_changes(portal_id: str, upserts: Dict[str, Dict], deletions: List[str]):
+    """Write one coalesced batch of contact changes: full property sets to store and ids to drop"""
+    if (upserts or deletions) and await is_crawling(portal_id):
+        # A crawl's snapshot may predate these; an empty value records a deletion
+        await set_hash_redis(_journal_key(portal_id), {
+            **{contact_id: json.dumps(properties) for contact_id, properties in upserts.items()},
+            **{contact_id: '' for contact_id in deletions},
+        }, expire=CRAWL_TTL)
+    if upserts:
+        await set_hash_redis(
+            _contacts_key(portal_id),
+            {contact_id: json.dumps(properties) for contact_id, properties in upserts.items()}
+        )
+    if deletions:
+        await delete_hash_fields_redis(_contacts_key(portal_id), deletions)
@@ -0,0 +1,409 @@
+import asyncio
+import difflib
+import json
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+from integrations import hubspot_contact_store as contact_store, hubspot_mirror
+from integrations.hubspot_changes import SOURCE_MERGE, record_changes
+from integrations.hubspot import _crawl_contacts, _get_mirror_portal, _get_stored_contacts, _hubspot_request, \
+    _load_job_credentials, get_portal_id
+from jobs import JobContext, get_job, get_job_result, job
+from utils.logger import log
+
+# Personal mailbox providers say nothing about where someone works
+FREE_EMAIL_DOMAINS = frozenset({
+    'gmail.com', 'googlemail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'live.com', 'msn.com',
+    'icloud.com', 'me.com', 'aol.com', 'proton.me', 'protonmail.com', 'gmx.com', 'mail.com',
+})
+# Legal suffixes dropped when comparing company names
+COMPANY_SUFFIXES = frozenset({
+    'inc', 'llc', 'ltd', 'limited', 'corp', 'corporation', 'co', 'company', 'gmbh', 'plc', 'sa', 'ag', 'bv', 'pty',
+})
+# Blocks larger than this are too generic to compare pairwise (a switchboard number, a common name at a big
+# company); their contacts still meet in their other, smaller blocks
+MAX_BLOCK_SIZE = 50
+# Matches chaining this many contacts together are more likely bad data than one person; left out of merges
+MAX_GROUP_SIZE = 10
+# Blocks compared per hand-off to a worker thread; progress and cancellation are checked in between
+COMPARE_CHUNK_SIZE = 20000
+
+# Minimum name similarity for each kind of evidence; weaker evidence needs closer names
+EMAIL_NAME_SIMILARITY = 0.6
+PHONE_NAME_SIMILARITY = 0.85
+ORGANIZATION_NAME_SIMILARITY = 0.92
+
+# HubSpot merges one pair per call; groups are merged concurrently, each group's pairs in order
+MERGE_CONCURRENCY = 4
+MERGE_BATCH_SIZE = 50
+MERGE_MAX_RETRIES = 5
+# Merges cannot be undone: merging a detection job's groups wholesale takes only those at least this
+# certain (an email match) unless the caller asks for less
+MERGE_MIN_CONFIDENCE = 0.9
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+_NON_DIGIT = re.compile(r'\D+')
+
+# Normalized contact: (email, phone, first name, last name, full name, organizations). Plain tuples of
+# strings, which the garbage collector stops tracking, so indexing half a million contacts stays fast
+Record = Tuple[Optional[str], Optional[str], str, str, str, Tuple[str, ...]]
+# (index, index, confidence, evidence)
+Match = Tuple[int, int, float, str]
+
+
+def _fold(text: Optional[str]) -> str:
+    """Lowercase and strip accents, so José and jose compare equal"""
+    if not text or text.isascii():
+        return (text or '').lower()
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    if not email or '@' not in email:
+        return None
+    local, _, domain = email.strip().lower().rpartition('@')
+    local = local.split('+', 1)[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        # Gmail ignores dots in the mailbox name
+        local = local.replace('.', '')
+        domain = 'gmail.com'
+    return f'{local}@{domain}' if local and domain else None
+
+
+def normalize_phone(phone: Optional[str]) -> Optional[str]:
+    digits = _NON_DIGIT.sub('', phone or '')
+    # National number only, so +1 (555) 010-0000 and 555.010.0000 match
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+# Names and companies repeat a lot across an org's contacts; caching them saves most of the indexing time
+@lru_cache(maxsize=65536)
+def normalize_name(name: Optional[str]) -> str:
+    return _NON_ALNUM.sub('', _fold(name))
+
+
+@lru_cache(maxsize=65536)
+def normalize_company(company: Optional[str]) -> Optional[str]:
+    words = [word for word in _NON_ALNUM.split(_fold(company)) if word and word not in COMPANY_SUFFIXES]
+    return ' '.join(words) or None
+
+
+def normalize_contact(properties: Dict) -> Record:
+    email = normalize_email(properties.get('email'))
+    first = normalize_name(properties.get('firstname'))
+    last = normalize_name(properties.get('lastname'))
+    organizations = ()
+    domain = email.rpartition('@')[2] if email else None
+    if domain and domain not in FREE_EMAIL_DOMAINS:
+        organizations += (domain,)
+    company = normalize_company(properties.get('company'))
+    if company and company != domain:
+        organizations += (company,)
+    # Sorted so swapped first and last names still compare equal
+    full_name = ' '.join(sorted(name for name in (first, last) if name))
+    return email, normalize_phone(properties.get('phone')), first, last, full_name, organizations
+
+
+def blocking_keys(record: Record) -> List[str]:
+    """
+    Keys a possible duplicate must share with the contact. Only contacts sharing a key are compared,
+    which keeps the pass near linear instead of comparing every pair
+    """
+    email, phone, first, last, _, organizations = record
+    keys = []
+    if email:
+        keys.append('e:' + email)
+    if phone:
+        keys.append('p:' + phone)
+    for organization in organizations:
+        # Surname and given name separately, so a typo in one still leaves a shared block
+        if last:
+            keys.append(f'l:{organization}|{last}')
+        if first:
+            keys.append(f'f:{organization}|{first}')
+    return keys
+
+
+def match_score(a: Record, b: Record) -> Optional[Tuple[float, str]]:
+    """Confidence that two contacts are the same person and the evidence for it, or None"""
+    same_email = a[0] is not None and a[0] == b[0]
+    same_phone = a[1] is not None and a[1] == b[1]
+    same_organization = any(organization in b[5] for organization in a[5])
+    if not (same_email or same_phone or same_organization):
+        return None
+
+    if not a[4] or not b[4]:
+        # Nothing to compare names on; only an identical email is enough
+        return (0.9, 'email') if same_email else None
+    similarity = 1.0 if a[4] == b[4] else difflib.SequenceMatcher(None, a[4], b[4]).ratio()
+
+    if same_email and similarity >= EMAIL_NAME_SIMILARITY:
+        return 0.9 + 0.1 * similarity, 'email'
+    if same_phone and similarity >= PHONE_NAME_SIMILARITY:
+        return 0.7 + 0.2 * similarity, 'phone'
+    if same_organization and similarity >= ORGANIZATION_NAME_SIMILARITY:
+        return 0.6 + 0.2 * similarity, 'organization'
+    return None
+
+
+def index_contacts(contacts: List[Dict]) -> Tuple[List[Record], List[List[int]], int]:
+    """Normalized contacts, the blocks worth comparing, and how many blocks were too large to compare"""
+    records = [normalize_contact(contact.get('properties', {})) for contact in contacts]
+    # Most keys belong to a single contact; those hold a bare index rather than a list of one
+    blocks: Dict[str, Union[int, List[int]]] = {}
+    for index, record in enumerate(records):
+        for key in blocking_keys(record):
+            members = blocks.get(key)
+            if members is None:
+                blocks[key] = index
+            elif isinstance(members, int):
+                blocks[key] = [members, index]
+            else:
+                members.append(index)
+
+    comparable = []
+    oversized = 0
+    for members in blocks.values():
+        if isinstance(members, int):
+            continue
+        if len(members) > MAX_BLOCK_SIZE:
+            oversized += 1
+        else:
+            comparable.append(members)
+    return records, comparable, oversized
+
+
+def compare_blocks(records: List[Record], blocks: List[List[int]]) -> List[Match]:
+    # A pair sharing several blocks is compared once per block; that is cheaper than tracking every pair seen
+    matches = []
+    for members in blocks:
+        for position, i in enumerate(members):
+            a = records[i]
+            for j in members[position + 1:]:
+                result = match_score(a, records[j])
+                if result is not None:
+                    matches.append((i, j, *result))
+    return matches
+
+
+def _created(contact: Dict) -> Tuple[str, int, str]:
+    contact_id = str(contact['id'])
+    return contact.get('properties', {}).get('createdate') or '', len(contact_id), contact_id
+
+
+def _summary(contact: Dict) -> Dict:
+    properties = contact.get('properties', {})
+    return {
+        'id': str(contact['id']),
+        'name': ' '.join(name for name in (properties.get('firstname'), properties.get('lastname')) if name),
+        'email': properties.get('email'),
+        'phone': properties.get('phone'),
+        'company': properties.get('company'),
+    }
+
+
+def group_matches(contacts: List[Dict], matches: List[Match]) -> Tuple[List[Dict], int]:
+    """
+    Merge candidates: matched contacts joined transitively, the oldest as the record to keep.
+    Also returns how many groups were too large to propose
+    """
+    parent: Dict[int, int] = {}
+
+    def find(index: int) -> int:
+        root = index
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while index != root:
+            parent[index], index = root, parent[index]
+        return root
+
+    for i, j, _, _ in matches:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    members: Dict[int, List[int]] = {}
+    for index in {index for i, j, _, _ in matches for index in (i, j)}:
+        members.setdefault(find(index), []).append(index)
+    evidence: Dict[int, List[Tuple[float, str]]] = {}
+    for i, j, confidence, reason in matches:
+        evidence.setdefault(find(i), []).append((confidence, reason))
+
+    groups = []
+    oversized = 0
+    for root, indexes in members.items():
+        if len(indexes) > MAX_GROUP_SIZE:
+            oversized += 1
+            continue
+        ordered = sorted((contacts[index] for index in indexes), key=_created)
+        groups.append({
+            'primary': str(ordered[0]['id']),
+            'duplicates': [str(contact['id']) for contact in ordered[1:]],
+            # A group is only as certain as its weakest link
+            'confidence': round(min(confidence for confidence, _ in evidence[root]), 3),
+            'matched_on': sorted({reason for _, reason in evidence[root]}),
+            'contacts': [_summary(contact) for contact in ordered],
+        })
+    groups.sort(key=lambda group: -group['confidence'])
+    return groups, oversized
+
+
+def find_duplicates(contacts: List[Dict]) -> Dict:
+    """Whole duplicate-detection pass in one call, for callers without a job context"""
+    records, blocks, oversized_blocks = index_contacts(contacts)
+    groups, oversized_groups = group_matches(contacts, compare_blocks(records, blocks))
+    return {'groups': groups, 'stats': _stats(contacts, blocks, oversized_blocks, groups, oversized_groups)}
+
+
+def _stats(contacts: List[Dict], blocks: List[List[int]], oversized_blocks: int, groups: List[Dict],
+           oversized_groups: int) -> Dict:
+    return {
+        'contacts': len(contacts),
+        'blocks': len(blocks),
+        'comparisons': sum(len(members) * (len(members) - 1) // 2 for members in blocks),
+        'skipped_blocks': oversized_blocks,
+        'groups': len(groups),
+        'duplicates': sum(len(group['duplicates']) for group in groups),
+        'skipped_groups': oversized_groups,
+    }
+
+
+async def _load_contacts(creds: Dict, ctx: Optional[JobContext] = None) -> List[Dict]:
+    """All contacts, from the local mirror or the webhook store when they can serve it"""
+    portal_id = await _get_mirror_portal(creds)
+    if portal_id is not None:
+        _, contacts = await hubspot_mirror.query_contacts(portal_id)
+        return contacts
+    contacts = await _get_stored_contacts(creds)
+    if contacts is not None:
+        return contacts
+    return await _crawl_contacts(creds, ctx)
+
+
+@job('hubspot.dedupe')
+async def dedupe_hubspot_job(ctx: JobContext, credentials: Dict) -> Dict:
+    """
+    Find likely duplicate contacts. CPU-bound steps run in a worker thread, in chunks, so the
+    event loop keeps serving requests and the job can be cancelled between chunks
+    """
+    creds = await _load_job_credentials(credentials)
+    contacts = await _load_contacts(creds, ctx)
+
+    await ctx.progress(0, message='Indexing contacts')
+    records, blocks, oversized_blocks = await asyncio.to_thread(index_contacts, contacts)
+    matches = []
+    for start in range(0, len(blocks), COMPARE_CHUNK_SIZE):
+        matches.extend(await asyncio.to_thread(compare_blocks, records, blocks[start:start + COMPARE_CHUNK_SIZE]))
+        await ctx.progress(min(start + COMPARE_CHUNK_SIZE, len(blocks)), len(blocks), message='Comparing contacts')
+    groups, oversized_groups = await asyncio.to_thread(group_matches, contacts, matches)
+
+    stats = _stats(contacts, blocks, oversized_blocks, groups, oversized_groups)
+    log.info(f"Found {stats['duplicates']} likely duplicate HubSpot contacts in {stats['groups']} groups "
+             f"({stats['comparisons']} comparisons over {stats['contacts']} contacts)")
+    return {'groups': groups, 'stats': stats}
+
+
+def _validate_groups(groups) -> List[Dict]:
+    if not isinstance(groups, list):
+        raise HTTPException(status_code=400, detail="Merge groups must be a list")
+    seen = set()
+    validated = []
+    for group in groups:
+        if not isinstance(group, dict) or 'primary' not in group or not isinstance(group.get('duplicates'), list):
+            raise HTTPException(status_code=400, detail="Each merge group needs a primary and a list of duplicates")
+        ids = [str(group['primary'])] + [str(contact_id) for contact_id in group['duplicates']]
+        if seen.intersection(ids) or len(set(ids)) != len(ids):
+            raise HTTPException(status_code=400, detail="A contact can only appear once across merge groups")
+        seen.update(ids)
+        if len(ids) > 1:
+            validated.append({'primary': ids[0], 'duplicates': ids[1:]})
+    return validated
+
+
+async def resolve_merge_groups(job_credentials: Dict, groups: Optional[str] = None, job_id: Optional[str] = None,
+                               min_confidence: Optional[float] = None) -> List[Dict]:
+    """
+    Groups to merge: given explicitly (e.g. after review) as JSON, or the candidates of a finished
+    duplicate-detection job of the same org with at least min_confidence
+    """
+    if groups:
+        try:
+            return _validate_groups(json.loads(groups))
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=400, detail="Invalid merge groups")
+    if job_id:
+        record = await get_job(job_id)
+        if record.get('type') != 'hubspot.dedupe' or record.get('org_id') != job_credentials.get('org_id'):
+            raise HTTPException(status_code=404, detail="Job not found")
+        if min_confidence is None:
+            min_confidence = MERGE_MIN_CONFIDENCE
+        if not 0 <= min_confidence <= 1:
+            raise HTTPException(status_code=400, detail="min_confidence must be between 0 and 1")
+        candidates = (await get_job_result(job_id))['groups']
+        return _validate_groups([group for group in candidates if group['confidence'] >= min_confidence])
+    raise HTTPException(status_code=400, detail="Either groups or job_id is required")
+
+
+async def _merge_pair(creds: Dict, primary_id: str, duplicate_id: str) -> Tuple[int, str]:
+    """Status of merging one contact into another and the id of the surviving record"""
+    for attempt in range(MERGE_MAX_RETRIES):
+        response = await _hubspot_request('POST', '/crm/v3/objects/contacts/merge', creds, json={
+            'primaryObjectId': primary_id,
+            'objectIdToMerge': duplicate_id,
+        })
+        if response.status_code != 429:
+            if response.status_code == 200:
+                return 200, str(response.json().get('id', primary_id))
+            return response.status_code, primary_id
+        await asyncio.sleep(float(response.headers.get('Retry-After', 0.5 * 2 ** attempt)))
+    return 429, primary_id
+
+
+async def _merge_group(creds: Dict, group: Dict, semaphore: asyncio.Semaphore, merged: List[str],
+                       failed: List[Dict]):
+    async with semaphore:
+        primary_id = group['primary']
+        for duplicate_id in group['duplicates']:
+            status, primary_id = await _merge_pair(creds, primary_id, duplicate_id)
+            if status == 200:
+                merged.append(duplicate_id)
+            else:
+                failed.append({'primary': primary_id, 'duplicate': duplicate_id, 'status': status})
+
+
+async def _forget_merged(creds: Dict, merged: List[str]):
+    """Drop merged-away contacts from local copies and tell change log consumers, rather than waiting for a sync"""
+    if not merged:
+        return
+    await record_changes(creds.get('org_id'), deletions=merged, source=SOURCE_MERGE)
+    portal_id = await get_portal_id(creds)
+    if portal_id is None:
+        return
+    if contact_store.STORE_ENABLED and await contact_store.is_synced(portal_id):
+        await contact_store.apply_contact_changes(portal_id, {}, merged)
+    if await hubspot_mirror.is_ready(portal_id):
+        await hubspot_mirror.apply_changes(portal_id, [], merged)
+
+
+@job('hubspot.merge')
+async def merge_hubspot_job(ctx: JobContext, credentials: Dict, groups: List[Dict]) -> Dict:
+    """Merge each group's duplicates into its primary through the HubSpot merge API, in batches"""
+    creds = await _load_job_credentials(credentials)
+    semaphore = asyncio.Semaphore(MERGE_CONCURRENCY)
+    merged: List[str] = []
+    failed: List[Dict] = []
+    try:
+        for start in range(0, len(groups), MERGE_BATCH_SIZE):
+            batch = groups[start:start + MERGE_BATCH_SIZE]
+            await asyncio.gather(*(_merge_group(creds, group, semaphore, merged, failed) for group in batch))
+            await ctx.progress(start + len(batch), len(groups), message='Merging contacts')
+    finally:
+        # Also after a cancellation, for the merges that did go through
+        await _forget_merged(creds, merged)
+    log.info(f"Merged {len(merged)} HubSpot contacts, {len(failed)} merges failed")
+    return {'merged': len(merged), 'failed': failed}
@@ -0,0 +1,302 @@
+"""
+Similarity search over a portal's contacts.
+
+A build embeds each contact's metadata (create_integration_item_metadata_object) in batches
+through OpenAI, caching vectors in Redis under a hash of the embedded text, so rebuilds only pay
+for contacts that changed. The index is written to HUBSPOT_EMBEDDINGS_DIR as a float32 matrix of
+unit vectors, one row per contact, plus the contacts' metadata. Workers memory-map the matrix
+(sharing one copy in the page cache) and answer top-k cosine queries with a single matrix-vector
+product: a few milliseconds for 100k contacts at 256 dimensions.
+
+The directory is local to each host, so queries build their host's index themselves, in the
+background, rather than through the shared job queue. The hubspot.embed job rebuilds the index of
+whichever host runs it and asks every other host to rebuild on its next query; the cached vectors
+make those rebuilds cheap.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import socket
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+try:
+    import numpy as np
+except ImportError:  # Similarity search is unavailable without numpy
+    np = None
+
+from integrations.hubspot import _fetch_contact, _load_job_credentials, create_integration_item_metadata_object, \
+    get_portal_id, resolve_hubspot_credentials
+from integrations.hubspot_dedupe import _load_contacts
+from jobs import JobContext, enqueue_job, job
+from openai_client import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, embed_texts
+from redis_client import acquire_lock, add_key_value_redis, add_key_values_redis, get_value_redis, \
+    get_values_redis, release_lock
+from utils.deadline import detached_task
+from utils.lifecycle import after_fork
+from utils.logger import log
+
+# Directory for the per-portal indexes; unset disables similarity search
+EMBEDDINGS_DIR = os.environ.get('HUBSPOT_EMBEDDINGS_DIR')
+# Indexes older than this are rebuilt in the background when queried
+EMBEDDINGS_REFRESH_INTERVAL = 60 * 60 * 24
+EMBEDDINGS_BUILD_LOCK_TTL = 600
+# Contacts per embeddings API call, and per Redis round trip for cached vectors
+EMBED_BATCH_SIZE = 256
+# Cached vectors are keyed by content, so they stay valid until evicted
+EMBEDDING_CACHE_TTL = 60 * 60 * 24 * 30
+MAX_SIMILAR = 100
+
+# portal id -> (index version, index) loaded by this worker
+_indexes: Dict[str, Tuple[str, 'ContactIndex']] = {}
+# Background builds of this host's indexes started by this worker
+_builds: Dict[str, asyncio.Task] = {}
+
+
+@after_fork
+def _reset_after_fork():
+    _indexes.clear()
+    _builds.clear()
+
+
+def embedding_text(metadata: Dict) -> str:
+    """
+    What a contact's embedding describes: who they are and where they work. Ids, phone numbers and
+    timestamps would only add noise. Empty when there is nothing to compare
+    """
+    name = metadata.get('name', '').strip()
+    email = metadata.get('email') or ''
+    domain = email.rsplit('@', 1)[1] if '@' in email else ''
+    company = (metadata.get('company') or '').strip()
+    if not (name or domain or company):
+        return ''
+    return f"Name: {name}\nEmail domain: {domain}\nCompany: {company}"
+
+
+def _cache_key(text: str) -> str:
+    digest = hashlib.sha256(f'{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}:{text}'.encode()).hexdigest()[:32]
+    return f'hubspot_embedding:{digest}'
+
+
+def _normalize(vectors: 'np.ndarray') -> 'np.ndarray':
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+async def _embed(texts: List[str]) -> Tuple['np.ndarray', int]:
+    """Unit vectors of the texts, from the cache where possible, and how many had to be embedded"""
+    keys = [_cache_key(text) for text in texts]
+    vectors = np.zeros((len(texts), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    missing = []
+    for row, cached in enumerate(await get_values_redis(keys)):
+        if cached is not None and len(cached) == EMBEDDING_DIMENSIONS * 4:
+            vectors[row] = np.frombuffer(cached, dtype=np.float32)
+        else:
+            missing.append(row)
+    if missing:
+        fresh = np.asarray(await embed_texts([texts[row] for row in missing]), dtype=np.float32)
+        vectors[missing] = _normalize(fresh)
+        await add_key_values_redis({keys[row]: vectors[row].tobytes() for row in missing}, expire=EMBEDDING_CACHE_TTL)
+    return vectors, len(missing)
+
+
+class ContactIndex:
+    """Unit vectors of a portal's contacts, one row per contact, with the contacts' metadata"""
+
+    def __init__(self, vectors: 'np.ndarray', contacts: List[Dict], built_at: float, model: str):
+        self.vectors = vectors
+        self.contacts = contacts
+        self.built_at = built_at
+        self.model = model
+        self.rows = {contact['id']: row for row, contact in enumerate(contacts)}
+
+    def search(self, query: 'np.ndarray', limit: int, exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Rows with the highest cosine similarity to the unit vector `query`, best first"""
+        scores = self.vectors @ query
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(limit, len(scores) - (exclude is not None))
+        if k <= 0:
+            return []
+        # Partial selection of the top k, then sorting only those
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+def _base_path(portal_id: str) -> str:
+    return os.path.join(EMBEDDINGS_DIR, f'hubspot_{re.sub(r"[^0-9A-Za-z_-]", "_", portal_id)}')
+
+
+def _write_index(portal_id: str, vectors: 'np.ndarray', contacts: List[Dict], built_at: float) -> str:
+    """
+    Write a new index version next to the current one, then switch the pointer to it, so workers
+    never read a matrix and metadata from different builds
+    """
+    os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+    base = _base_path(portal_id)
+    version = str(time.time_ns())
+    np.save(f'{base}.{version}.npy', vectors)
+    with open(f'{base}.{version}.json', 'w') as f:
+        json.dump({'built_at': built_at, 'model': f'{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}',
+                   'contacts': contacts}, f, separators=(',', ':'))
+    with open(f'{base}.current.{version}', 'w') as f:
+        f.write(version)
+    os.replace(f'{base}.current.{version}', f'{base}.current')
+    # Workers still mapping an older version keep reading it until they notice the new pointer
+    prefix = os.path.basename(base) + '.'
+    for name in os.listdir(EMBEDDINGS_DIR):
+        if name.startswith(prefix) and name.endswith(('.npy', '.json')) and version not in name:
+            try:
+                os.remove(os.path.join(EMBEDDINGS_DIR, name))
+            except FileNotFoundError:
+                pass
+    return version
+
+
+def _load_index(portal_id: str) -> Optional[ContactIndex]:
+    """The portal's current index, reloaded when a build has replaced the one this worker holds"""
+    base = _base_path(portal_id)
+    loaded = _indexes.get(portal_id)
+    try:
+        with open(f'{base}.current') as f:
+            version = f.read().strip()
+        if loaded is not None and loaded[0] == version:
+            return loaded[1]
+        with open(f'{base}.{version}.json') as f:
+            stored = json.load(f)
+        contacts = stored['contacts']
+        # Mapped rather than read, so every worker shares the same pages; an empty file cannot be mapped
+        vectors = np.load(f'{base}.{version}.npy', mmap_mode='r' if contacts else None)
+    except FileNotFoundError:
+        # No index yet, or replaced while loading; the next query picks up the new one
+        return loaded[1] if loaded is not None else None
+    index = ContactIndex(vectors, contacts, stored['built_at'], stored['model'])
+    _indexes[portal_id] = (version, index)
+    return index
+
+
+def _requested_key(portal_id: str) -> str:
+    return f'hubspot_embeddings_requested:{portal_id}'
+
+
+async def _build_index(creds: Dict, portal_id: str, ctx: Optional[JobContext] = None) -> Dict:
+    """Embed every contact of the portal, reusing cached vectors, and publish a new index on this host"""
+    built_at = time.time()
+    contacts = await _load_contacts(creds, ctx)
+
+    entries = []
+    for contact in contacts:
+        metadata = await create_integration_item_metadata_object(contact)
+        text = embedding_text(metadata)
+        if text:
+            entries.append((metadata, text))
+
+    vectors = np.empty((len(entries), EMBEDDING_DIMENSIONS), dtype=np.float32)
+    embedded = 0
+    for start in range(0, len(entries), EMBED_BATCH_SIZE):
+        chunk = entries[start:start + EMBED_BATCH_SIZE]
+        vectors[start:start + len(chunk)], fresh = await _embed([text for _, text in chunk])
+        embedded += fresh
+        if ctx is not None:
+            await ctx.progress(start + len(chunk), len(entries), message='Embedding contacts')
+
+    await asyncio.to_thread(_write_index, portal_id, vectors, [metadata for metadata, _ in entries], built_at)
+    log.info(f"Indexed {len(entries)} HubSpot contacts of portal {portal_id} for similarity search "
+             f"({embedded} embedded, {len(entries) - embedded} from cache)")
+    return {'portal_id': portal_id, 'contacts': len(entries), 'embedded': embedded, 'built_at': built_at}
+
+
+@job('hubspot.embed')
+async def embed_hubspot_contacts_job(ctx: JobContext, credentials: Dict) -> Dict:
+    """Rebuild the portal's index on this host, and have every other host rebuild its own on its next query"""
+    creds = await _load_job_credentials(credentials)
+    portal_id = await get_portal_id(creds)
+    if portal_id is None:
+        raise HTTPException(status_code=502, detail="Could not determine the HubSpot portal")
+    result = await _build_index(creds, portal_id, ctx)
+    await add_key_value_redis(_requested_key(portal_id), str(result['built_at']), expire=EMBEDDINGS_REFRESH_INTERVAL)
+    return result
+
+
+def _require_enabled():
+    if np is None:
+        raise HTTPException(status_code=501, detail="Similarity search requires numpy")
+    if not EMBEDDINGS_DIR:
+        raise HTTPException(status_code=501, detail="Contact embeddings are not enabled")
+
+
+async def enqueue_embeddings_job(job_credentials: Dict) -> Dict:
+    """Rebuild the portal's index now, e.g. after a bulk import"""
+    _require_enabled()
+    return await enqueue_job('hubspot.embed', {'credentials': job_credentials},
+                             job_credentials.get('org_id'), job_credentials.get('user_id'))
+
+
+async def _build_index_exclusive(creds: Dict, portal_id: str):
+    # The index lives on this host's disk, so it is built here rather than by any worker of the job
+    # queue: one build per portal per host, and the lock lapses on its own if the process dies
+    lock_key = f'hubspot_embeddings_build:{socket.gethostname()}:{portal_id}'
+    lock_token = await acquire_lock(lock_key, EMBEDDINGS_BUILD_LOCK_TTL)
+    if lock_token is None:
+        return
+    try:
+        await _build_index(creds, portal_id)
+    finally:
+        await release_lock(lock_key, lock_token)
+
+
+def _schedule_build(creds: Dict, portal_id: str):
+    if portal_id in _builds:
+        return
+    task = detached_task(_build_index_exclusive(creds, portal_id))
+    _builds[portal_id] = task
+
+    def done(_):
+        _builds.pop(portal_id, None)
+        if not task.cancelled() and task.exception():
+            log.error(f"Building HubSpot contact embeddings failed for portal {portal_id}: {str(task.exception())}")
+
+    task.add_done_callback(done)
+
+
+async def find_similar_contacts(credentials: Union[str, Dict], contact_id: str, limit: int = 10) -> Dict:
+    """
+    Contacts most similar to the given one (same company, similar profile) by cosine similarity,
+    as of when the index was built. Starts a build when the portal has none or it is stale
+    """
+    _require_enabled()
+    creds = await resolve_hubspot_credentials(credentials)
+    portal_id = await get_portal_id(creds)
+    if portal_id is None:
+        raise HTTPException(status_code=502, detail="Could not determine the HubSpot portal")
+    index = await asyncio.to_thread(_load_index, portal_id)
+    current = index is not None and index.model == f'{EMBEDDING_MODEL}:{EMBEDDING_DIMENSIONS}'
+    # A rebuild requested through the job since this host built its index
+    requested = float(await get_value_redis(_requested_key(portal_id)) or 0)
+    if not current or time.time() - index.built_at > EMBEDDINGS_REFRESH_INTERVAL or index.built_at < requested:
+        _schedule_build(creds, portal_id)
+    if not current:
+        raise HTTPException(status_code=503, detail="Contact embeddings are being built, try again shortly",
+                            headers={'Retry-After': '30'})
+
+    row = index.rows.get(str(contact_id))
+    if row is not None:
+        query = index.vectors[row]
+    else:
+        # Created since the index was built
+        text = embedding_text(await create_integration_item_metadata_object(await _fetch_contact(creds, contact_id)))
+        if not text:
+            raise HTTPException(status_code=422, detail="Contact has no name, email or company to compare")
+        query = (await _embed([text]))[0][0]
+
+    matches = await asyncio.to_thread(index.search, query, min(max(limit, 1), MAX_SIMILAR), row)
+    return {
+        'contact_id': str(contact_id),
+        'indexed_at': index.built_at,
+        'results': [{**index.contacts[match], 'score': round(score, 4)} for match, score in matches],
+    }
@@ -0,0 +1,205 @@
+import asyncio
+import os
+import re
+import sqlite3
+import time
+from contextlib import closing
+from typing import Dict, List, Optional, Tuple
+
+# Directory for the per-portal SQLite mirrors; unset disables the mirror
+MIRROR_DIR = os.environ.get('HUBSPOT_MIRROR_DIR')
+# Incremental syncs run at most this often, triggered by reads
+MIRROR_SYNC_INTERVAL = 60
+# Full re-crawls reconcile deletions that no webhook reported
+MIRROR_FULL_SYNC_INTERVAL = 60 * 60 * 24
+
+MIRRORED_PROPERTIES = ('firstname', 'lastname', 'email', 'phone', 'company', 'createdate', 'lastmodifieddate')
+SORTABLE_COLUMNS = {
+    'id': 'id',
+    'name': 'firstname COLLATE NOCASE, lastname COLLATE NOCASE',
+    'email': 'email COLLATE NOCASE',
+    'company': 'company COLLATE NOCASE',
+    'createdate': 'createdate',
+    'lastmodifieddate': 'lastmodifieddate',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS contacts (
+    id INTEGER PRIMARY KEY,
+    firstname TEXT,
+    lastname TEXT,
+    email TEXT,
+    phone TEXT,
+    company TEXT,
+    createdate TEXT,
+    lastmodifieddate TEXT
+);
+CREATE INDEX IF NOT EXISTS contacts_company ON contacts (company COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS contacts_email ON contacts (email COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS contacts_createdate ON contacts (createdate);
+CREATE INDEX IF NOT EXISTS contacts_lastmodifieddate ON contacts (lastmodifieddate);
+CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+    firstname, lastname, email, phone, company, content='contacts', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS contacts_ai AFTER INSERT ON contacts BEGIN
+    INSERT INTO contacts_fts (rowid, firstname, lastname, email, phone, company)
+    VALUES (new.id, new.firstname, new.lastname, new.email, new.phone, new.company);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_ad AFTER DELETE ON contacts BEGIN
+    INSERT INTO contacts_fts (contacts_fts, rowid, firstname, lastname, email, phone, company)
+    VALUES ('delete', old.id, old.firstname, old.lastname, old.email, old.phone, old.company);
+END;
+CREATE TRIGGER IF NOT EXISTS contacts_au AFTER UPDATE ON contacts BEGIN
+    INSERT INTO contacts_fts (contacts_fts, rowid, firstname, lastname, email, phone, company)
+    VALUES ('delete', old.id, old.firstname, old.lastname, old.email, old.phone, old.company);
+    INSERT INTO contacts_fts (rowid, firstname, lastname, email, phone, company)
+    VALUES (new.id, new.firstname, new.lastname, new.email, new.phone, new.company);
+END;
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_initialized = set()
+
+
+def is_enabled() -> bool:
+    return bool(MIRROR_DIR)
+
+
+def _path(portal_id: str) -> str:
+    return os.path.join(MIRROR_DIR, f'hubspot_{re.sub(r"[^0-9A-Za-z_-]", "_", portal_id)}.db')
+
+
+def _connect(portal_id: str) -> sqlite3.Connection:
+    path = _path(portal_id)
+    os.makedirs(MIRROR_DIR, exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    if path not in _initialized:
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.executescript(SCHEMA)
+        _initialized.add(path)
+    return connection
+
+
+def _row(contact: Dict) -> Tuple:
+    properties = contact.get('properties', {})
+    return (int(contact['id']), *(properties.get(name) for name in MIRRORED_PROPERTIES))
+
+
+def _upsert(connection: sqlite3.Connection, contacts: List[Dict]):
+    connection.executemany(
+        f"INSERT INTO contacts (id, {', '.join(MIRRORED_PROPERTIES)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{name} = excluded.{name}' for name in MIRRORED_PROPERTIES)}",
+        [_row(contact) for contact in contacts]
+    )
+
+
+def _set_state(connection: sqlite3.Connection, **values):
+    connection.executemany(
+        'INSERT INTO sync_state (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+        [(key, str(value)) for key, value in values.items()]
+    )
+
+
+def _get_state(portal_id: str) -> Dict[str, str]:
+    with closing(_connect(portal_id)) as connection:
+        return {row['key']: row['value'] for row in connection.execute('SELECT key, value FROM sync_state')}
+
+
+def _replace_all(portal_id: str, contacts: List[Dict], watermark: Optional[str]) -> List[str]:
+    with closing(_connect(portal_id)) as connection, connection:
+        previous = {row['id'] for row in connection.execute('SELECT id FROM contacts')}
+        connection.execute('DELETE FROM contacts')
+        _upsert(connection, contacts)
+        now = time.time()
+        _set_state(connection, full_synced_at=now, synced_at=now, watermark=watermark or '')
+    return [str(contact_id) for contact_id in sorted(previous - {int(contact['id']) for contact in contacts})]
+
+
+def _apply(portal_id: str, contacts: List[Dict], deletions: List[str], watermark: Optional[str]):
+    with closing(_connect(portal_id)) as connection, connection:
+        if contacts:
+            _upsert(connection, contacts)
+        if deletions:
+            connection.executemany('DELETE FROM contacts WHERE id = ?',
+                                   [(int(contact_id),) for contact_id in deletions])
+        if watermark is not None:
+            _set_state(connection, synced_at=time.time(), watermark=watermark)
+
+
+def _fts_query(search: str) -> str:
+    """Every word must prefix-match some field; quoting keeps FTS5 syntax out of user input"""
+    words = re.findall(r'\w+', search)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _query(portal_id: str, search: Optional[str], filters: Dict, sort: str, descending: bool,
+           limit: Optional[int], offset: int) -> Tuple[int, List[Dict]]:
+    conditions = []
+    params = []
+    if search and _fts_query(search):
+        conditions.append('id IN (SELECT rowid FROM contacts_fts WHERE contacts_fts MATCH ?)')
+        params.append(_fts_query(search))
+    for name in ('email', 'phone', 'company'):
+        if filters.get(f'has_{name}'):
+            conditions.append(f"COALESCE({name}, '') != ''")
+    if filters.get('created_after'):
+        conditions.append('createdate >= ?')
+        params.append(filters['created_after'])
+    if filters.get('created_before'):
+        conditions.append('createdate <= ?')
+        params.append(filters['created_before'])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    direction = 'DESC' if descending else 'ASC'
+    # id breaks ties so pages are stable
+    sort_columns = SORTABLE_COLUMNS[sort].split(', ')
+    if sort != 'id':
+        sort_columns.append('id')
+    order = ', '.join(f'{column} {direction}' for column in sort_columns)
+    page = 'LIMIT ? OFFSET ?' if limit is not None else ''
+    columns = ', '.join(MIRRORED_PROPERTIES)
+
+    with closing(_connect(portal_id)) as connection:
+        total = connection.execute(f'SELECT COUNT(*) FROM contacts {where}', params).fetchone()[0]
+        rows = connection.execute(
+            f'SELECT id, {columns} FROM contacts {where} ORDER BY {order} {page}',
+            params + ([limit, offset] if limit is not None else [])
+        ).fetchall()
+    return total, [
+        {'id': str(row['id']), 'properties': {name: row[name] for name in MIRRORED_PROPERTIES}}
+        for row in rows
+    ]
+
+
+async def is_ready(portal_id: str) -> bool:
+    """Whether this process has a completed mirror of the portal"""
+    if not is_enabled() or not os.path.exists(_path(portal_id)):
+        return False
+    return 'full_synced_at' in await get_sync_state(portal_id)
+
+
+async def get_sync_state(portal_id: str) -> Dict[str, str]:
+    return await asyncio.to_thread(_get_state, portal_id)
+
+
+async def replace_contacts(portal_id: str, contacts: List[Dict], watermark: Optional[str]) -> List[str]:
+    """Replace the mirror with a full crawl; returns the ids of contacts the crawl no longer has"""
+    return await asyncio.to_thread(_replace_all, portal_id, contacts, watermark)
+
+
+async def apply_changes(portal_id: str, contacts: List[Dict], deletions: List[str] = (),
+                        watermark: Optional[str] = None):
+    await asyncio.to_thread(_apply, portal_id, contacts, list(deletions), watermark)
+
+
+async def query_contacts(portal_id: str, search: Optional[str] = None, filters: Optional[Dict] = None,
+                         sort: str = 'id', descending: bool = False, limit: Optional[int] = None,
+                         offset: int = 0) -> Tuple[int, List[Dict]]:
+    """
+    Total matching contacts and one page of them, in HubSpot API shape ({'id', 'properties'})
+    """
+    return await asyncio.to_thread(_query, portal_id, search, filters or {}, sort, descending, limit, offset)
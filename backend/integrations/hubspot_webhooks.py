@@ -0,0 +1,197 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Dict, List
+
+from fastapi import Request, HTTPException
+
+from integrations import hubspot_contact_store as contact_store, hubspot_mirror
+from integrations.hubspot_changes import SOURCE_WEBHOOK, record_portal_changes
+from integrations.hubspot import CLIENT_SECRET, CONTACT_PROPERTIES, _hubspot_request, _load_job_credentials
+from redis_client import get_value_redis
+from utils.deadline import detached_task
+from utils.lifecycle import after_fork
+from utils.logger import log
+
+# HubSpot signs against the URL it was configured to call, which differs from request.url behind a proxy
+WEBHOOK_URL = os.environ.get('HUBSPOT_WEBHOOK_URL')
+# Reject v3 signatures older than this (HubSpot's recommendation) to stop replays
+WEBHOOK_MAX_AGE = 300
+# Events for a portal arriving within this window are applied as one batch
+WEBHOOK_COALESCE_WINDOW = 1.0
+BATCH_READ_SIZE = 100
+
+# portal_id -> contact_id -> coalesced change
+_pending: Dict[str, Dict[str, Dict]] = {}
+_flush_tasks: Dict[str, asyncio.Task] = {}
+
+
+@after_fork
+def _reset_after_fork():
+    # Events buffered before the fork are the parent's to flush; a copy here would apply them twice
+    _pending.clear()
+    _flush_tasks.clear()
+
+
+def verify_hubspot_signature(request: Request, body: bytes):
+    """
+    Validate X-HubSpot-Signature-v3, falling back to the v1/v2 signatures older apps send
+    """
+    uri = WEBHOOK_URL or str(request.url)
+    signature_v3 = request.headers.get('x-hubspot-signature-v3')
+    if signature_v3:
+        timestamp = request.headers.get('x-hubspot-request-timestamp', '')
+        if not timestamp.isdigit() or abs(time.time() * 1000 - int(timestamp)) > WEBHOOK_MAX_AGE * 1000:
+            raise HTTPException(status_code=401, detail="Stale webhook timestamp")
+        message = f"{request.method}{uri}".encode() + body + timestamp.encode()
+        expected = base64.b64encode(hmac.new(CLIENT_SECRET.encode(), message, hashlib.sha256).digest()).decode()
+        if not hmac.compare_digest(expected, signature_v3):
+            raise HTTPException(status_code=401, detail="Invalid webhook signature")
+        return
+
+    signature = request.headers.get('x-hubspot-signature', '')
+    if request.headers.get('x-hubspot-signature-version') == 'v2':
+        source = CLIENT_SECRET.encode() + f"{request.method}{uri}".encode() + body
+    else:
+        source = CLIENT_SECRET.encode() + body
+    if not signature or not hmac.compare_digest(hashlib.sha256(source).hexdigest(), signature):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+
+
+def _coalesce(event: Dict):
+    portal_id = str(event.get('portalId'))
+    contact_id = str(event.get('objectId'))
+    subscription_type = event.get('subscriptionType')
+    change = _pending.setdefault(portal_id, {}).setdefault(
+        contact_id, {'deleted': False, 'fetch': False, 'properties': {}}
+    )
+
+    if subscription_type == 'contact.deletion':
+        change.update(deleted=True, fetch=False, properties={})
+    elif subscription_type in ('contact.creation', 'contact.restore'):
+        change.update(deleted=False, fetch=True)
+    elif subscription_type == 'contact.propertyChange':
+        change['deleted'] = False
+        change['properties'][event.get('propertyName')] = event.get('propertyValue')
+
+
+async def receive_hubspot_webhook(request: Request) -> Dict:
+    """
+    Accept a batch of HubSpot contact events. Events are acknowledged immediately and applied
+    to the contact store after the portal's coalescing window
+    """
+    body = await request.body()
+    verify_hubspot_signature(request, body)
+    try:
+        events = json.loads(body)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+
+    # HubSpot does not guarantee delivery order within or across batches
+    for event in sorted(events, key=lambda event: event.get('occurredAt', 0)):
+        _coalesce(event)
+        portal_id = str(event.get('portalId'))
+        if portal_id not in _flush_tasks:
+            _flush_tasks[portal_id] = detached_task(_flush_after_window(portal_id))
+    return {'received': len(events)}
+
+
+async def _flush_after_window(portal_id: str):
+    try:
+        await asyncio.sleep(WEBHOOK_COALESCE_WINDOW)
+    finally:
+        _flush_tasks.pop(portal_id, None)
+        await _apply_pending(portal_id)
+
+
+async def _fetch_contacts(portal_id: str, contact_ids: List[str]) -> Dict[str, Dict]:
+    """Full properties for new or unknown contacts, batch read as the portal's connected user"""
+    owner = await get_value_redis(f'hubspot_portal_owner:{portal_id}')
+    if not owner:
+        log.warn(f"No connected user for HubSpot portal {portal_id}, skipping {len(contact_ids)} contacts")
+        return {}
+    creds = await _load_job_credentials(json.loads(owner))
+
+    fetched = {}
+    for start in range(0, len(contact_ids), BATCH_READ_SIZE):
+        response = await _hubspot_request('POST', '/crm/v3/objects/contacts/batch/read', creds, json={
+            'properties': CONTACT_PROPERTIES.split(','),
+            'inputs': [{'id': contact_id} for contact_id in contact_ids[start:start + BATCH_READ_SIZE]],
+        })
+        if response.status_code not in (200, 207):
+            log.error(f"Failed to batch read HubSpot contacts: {response.status_code}")
+            continue
+        for contact in response.json().get('results', []):
+            fetched[str(contact['id'])] = contact.get('properties', {})
+    return fetched
+
+
+async def _apply_pending(portal_id: str):
+    changes = _pending.pop(portal_id, {})
+    if not changes:
+        return
+    try:
+        store_synced = await contact_store.is_synced(portal_id)
+        # A crawl filling the store journals changes for its snapshot, which may predate them
+        store_crawling = not store_synced and await contact_store.is_crawling(portal_id)
+        mirror_ready = await hubspot_mirror.is_ready(portal_id)
+
+        deletions = [contact_id for contact_id, change in changes.items() if change['deleted']]
+        updated = [contact_id for contact_id, change in changes.items() if not change['deleted']]
+        if store_synced:
+            stored = await contact_store.get_stored_properties(portal_id, updated) if updated else {}
+            to_fetch = [contact_id for contact_id in updated
+                        if changes[contact_id]['fetch'] or stored[contact_id] is None]
+        elif mirror_ready or store_crawling:
+            # The mirror keeps only a few columns and the journal full property sets, so without the
+            # store every change is read back in full
+            stored = {}
+            to_fetch = updated
+        else:
+            # Nothing local to keep current (the first crawl will see these changes); the change log
+            # only needs new contacts read back, property changes go to it as they are
+            stored = {}
+            to_fetch = [contact_id for contact_id in updated if changes[contact_id]['fetch']]
+        fetched = await _fetch_contacts(portal_id, to_fetch) if to_fetch else {}
+
+        # Fetched contacts are already current; stored ones get the coalesced property changes
+        upserts = dict(fetched)
+        for contact_id in updated:
+            if contact_id in fetched:
+                continue
+            if stored.get(contact_id) is not None:
+                upserts[contact_id] = {**stored[contact_id], **changes[contact_id]['properties']}
+            elif not store_synced and not store_crawling and not mirror_ready and changes[contact_id]['properties']:
+                upserts[contact_id] = changes[contact_id]['properties']
+
+        if store_synced or store_crawling:
+            await contact_store.apply_contact_changes(portal_id, upserts, deletions)
+        if mirror_ready:
+            await hubspot_mirror.apply_changes(
+                portal_id,
+                [{'id': contact_id, 'properties': properties} for contact_id, properties in upserts.items()],
+                deletions
+            )
+        await record_portal_changes(
+            portal_id,
+            [{'id': contact_id, 'properties': properties} for contact_id, properties in upserts.items()],
+            deletions,
+            SOURCE_WEBHOOK
+        )
+        log.info(f"Applied {len(upserts)} updates and {len(deletions)} deletions for HubSpot portal {portal_id}")
+    except Exception as e:
+        log.error(f"Failed to apply HubSpot webhook events for portal {portal_id}: {str(e)}")
+
+
+async def flush_webhook_events():
+    """Apply buffered events immediately, e.g. before shutdown"""
+    tasks = list(_flush_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for portal_id in list(_pending):
+        await _apply_pending(portal_id)
@@ -22,6 +22,7 @@ class IntegrationItem:
             delta: Optional[str] = None,
             drive_id: Optional[str] = None,
             visibility: Optional[bool] = True,
+            properties: Optional[dict] = None,
     ):
         self.id = id
         self.type = type
@@ -40,3 +41,5 @@ class IntegrationItem:
         self.delta = delta
         self.drive_id = drive_id
         self.visibility = visibility
+        # Provider-specific fields the caller asked for, beyond the standard ones above
+        self.properties = properties
@@ -4,13 +4,16 @@ import asyncio
 import base64
 import json
 import secrets
+from urllib.parse import quote
 
-import httpx
-import requests
 from fastapi import Request, HTTPException
 from fastapi.responses import HTMLResponse
+from http_client import async_client
 from integrations.integration_item import IntegrationItem
-from redis_client import add_key_value_redis, get_value_redis, delete_key_redis
+from redis_client import add_key_value_redis, add_key_values_redis, get_value_redis, delete_key_redis
+from utils.limiter import register_upstream
+from utils.responses import CLOSE_WINDOW_PAGE
+from utils.single_flight import fingerprint, single_flight
 
 CLIENT_ID = '15bd872b-594c-80a0-8abd-003722cff0f5'
 CLIENT_SECRET = 'secret_GIFW4DOJWg73OW2PfLanaTptrXttHvD3oqlCPpALL4l'
@@ -18,6 +21,9 @@ encoded_client_id_secret = base64.b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encod
 
 REDIRECT_URI = 'http://localhost:8000/integrations/notion/oauth2callback'
 authorization_url = f'https://api.notion.com/v1/oauth/authorize?client_id={CLIENT_ID}&response_type=code&owner=user&redirect_uri=http%3A%2F%2Flocalhost%3A8000%2Fintegrations%2Fnotion%2Foauth2callback'
+authorization_url_prefix = f'{authorization_url}&state='
+
+register_upstream('notion', 'api.notion.com')
 
 
 async def authorize_notion(user_id, org_id):
@@ -27,9 +33,10 @@ async def authorize_notion(user_id, org_id):
         'org_id': org_id
     }
     encoded_state = json.dumps(state_data)
-    await add_key_value_redis(f'notion_state:{org_id}:{user_id}', encoded_state, expire=600)
+    await add_key_values_redis({f'notion_state:{org_id}:{user_id}': encoded_state}, expire=600)
 
-    return f'{authorization_url}&state={encoded_state}'
+    # The state is JSON, so it is percent-encoded to survive the round trip through the browser
+    return authorization_url_prefix + quote(encoded_state, safe='')
 
 
 async def oauth2callback_notion(request: Request):
@@ -48,7 +55,7 @@ async def oauth2callback_notion(request: Request):
     if not saved_state or original_state != json.loads(saved_state).get('state'):
         raise HTTPException(status_code=400, detail='State does not match.')
 
-    async with httpx.AsyncClient() as client:
+    async with async_client() as client:
         response, _ = await asyncio.gather(
             client.post(
                 'https://api.notion.com/v1/oauth/token',
@@ -67,14 +74,7 @@ async def oauth2callback_notion(request: Request):
 
     await add_key_value_redis(f'notion_credentials:{org_id}:{user_id}', json.dumps(response.json()), expire=600)
 
-    close_window_script = """
-    <html>
-        <script>
-            window.close();
-        </script>
-    </html>
-    """
-    return HTMLResponse(content=close_window_script)
+    return HTMLResponse(content=CLOSE_WINDOW_PAGE)
 
 
 async def get_notion_credentials(user_id, org_id):
@@ -141,24 +141,33 @@ def create_integration_item_metadata_object(
     return integration_item_metadata
 
 
+async def _search_notion(access_token: str) -> list:
+    async def fetch() -> list:
+        async with async_client() as client:
+            response = await client.post(
+                'https://api.notion.com/v1/search',
+                headers={
+                    'Authorization': f'Bearer {access_token}',
+                    'Notion-Version': '2022-06-28',
+                },
+            )
+        if response.status_code != 200:
+            raise HTTPException(status_code=response.status_code, detail='Failed to search Notion.')
+        return response.json()['results']
+
+    return await single_flight(f'notion:search:{fingerprint(access_token)}', fetch)
+
+
 async def get_items_notion(credentials) -> list[IntegrationItem]:
     """Aggregates all metadata relevant for a notion integration"""
     credentials = json.loads(credentials)
-    response = requests.post(
-        'https://api.notion.com/v1/search',
-        headers={
-            'Authorization': f'Bearer {credentials.get("access_token")}',
-            'Notion-Version': '2022-06-28',
-        },
-    )
+    results = await _search_notion(credentials.get('access_token'))
 
-    if response.status_code == 200:
-        results = response.json()['results']
-        list_of_integration_item_metadata = []
-        for result in results:
-            list_of_integration_item_metadata.append(
-                create_integration_item_metadata_object(result)
-            )
+    list_of_integration_item_metadata = []
+    for result in results:
+        list_of_integration_item_metadata.append(
+            create_integration_item_metadata_object(result)
+        )
 
-        print(list_of_integration_item_metadata)
-    return
+    print(list_of_integration_item_metadata)
+    return list_of_integration_item_metadata
@@ -0,0 +1,332 @@
+import asyncio
+import json
+import os
+import secrets
+import socket
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from redis_client import add_key_value_redis, add_key_values_redis, add_to_set_redis, delete_key_redis, \
+    delete_keys_redis, get_list_redis, get_set_members_redis, get_value_redis, key_exists_redis, \
+    move_blocking_redis, move_list_item_redis, push_redis, remove_from_list_redis, remove_from_set_redis
+from utils.lifecycle import after_fork
+from utils.limiter import shed_when_busy
+from utils.logger import log
+from utils.tracing import current_traceparent, span
+
+QUEUE_KEY = 'jobs:queue'
+# Every worker that may hold jobs in its jobs:processing:<worker> list
+WORKERS_KEY = 'jobs:workers'
+JOB_TTL = 60 * 60 * 24
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# Each process refreshes its workers' heartbeats this often; the jobs of a worker whose heartbeat
+# lapses (a crashed or killed process) go back on the queue
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+JOB_HEARTBEAT_TTL = int(os.environ.get('JOB_HEARTBEAT_TTL', 60))
+# Seconds between status checks when streaming job events
+JOB_EVENTS_INTERVAL = 0.5
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATUSES = (SUCCEEDED, FAILED, CANCELLED)
+
+JobHandler = Callable[..., Awaitable]
+
+_handlers: Dict[str, JobHandler] = {}
+# Jobs running in this process, so cancellation does not wait for the next progress check
+_running: Dict[str, asyncio.Task] = {}
+_workers: List[asyncio.Task] = []
+# Names of this process's workers, which key their processing lists and heartbeats
+_consumers: List[str] = []
+_heartbeat: Optional[asyncio.Task] = None
+# Workers currently running a job; only these are cancelled on shutdown
+_busy: Set[asyncio.Task] = set()
+_stopping = False
+
+
+@after_fork
+def _reset_after_fork():
+    # Tasks belong to the parent's event loop; each worker starts its own pool in the lifespan
+    global _heartbeat
+    _running.clear()
+    _workers.clear()
+    _consumers.clear()
+    _heartbeat = None
+    _busy.clear()
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def job(name: str):
+    """Register an async function as the handler for a job type"""
+
+    def decorator(handler: JobHandler) -> JobHandler:
+        _handlers[name] = handler
+        return handler
+
+    return decorator
+
+
+class JobContext:
+    """
+    Passed to job handlers for progress reporting and cooperative cancellation
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    async def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        """Record progress; raises JobCancelled if the job was cancelled from another worker"""
+        if await get_value_redis(f'job_cancel:{self.job_id}'):
+            raise JobCancelled()
+        await _update_job(self.job_id, progress={'done': done, 'total': total, 'message': message})
+
+
+async def _update_job(job_id: str, **fields) -> Optional[Dict]:
+    stored = await get_value_redis(f'job:{job_id}')
+    if not stored:
+        return None
+    record = {**json.loads(stored), **fields}
+    await add_key_value_redis(f'job:{job_id}', json.dumps(record), expire=JOB_TTL)
+    return record
+
+
+async def enqueue_job(job_type: str, params: Dict, org_id: Optional[str] = None,
+                      user_id: Optional[str] = None) -> Dict:
+    """
+    Queue a job and return its record; workers pick it up in FIFO order
+    """
+    if job_type not in _handlers:
+        raise HTTPException(status_code=400, detail=f"Unknown job type: {job_type}")
+
+    job_id = secrets.token_urlsafe(16)
+    record = {
+        'id': job_id,
+        'type': job_type,
+        'status': QUEUED,
+        'org_id': org_id,
+        'user_id': user_id,
+        'progress': {'done': 0, 'total': None, 'message': None},
+        'error': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        # The job's span continues the trace of the request that queued it
+        'traceparent': current_traceparent(),
+    }
+    await add_key_value_redis(f'job:{job_id}', json.dumps(record), expire=JOB_TTL)
+    await add_key_value_redis(f'job_params:{job_id}', json.dumps(params), expire=JOB_TTL)
+    await push_redis(QUEUE_KEY, job_id)
+    log.info(f"Queued job {job_id} ({job_type})")
+    return record
+
+
+async def get_job(job_id: str) -> Dict:
+    stored = await get_value_redis(f'job:{job_id}')
+    if not stored:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return json.loads(stored)
+
+
+async def get_job_result(job_id: str):
+    record = await get_job(job_id)
+    if record['status'] != SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job is {record['status']}")
+    result = await get_value_redis(f'job_result:{job_id}')
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job result expired")
+    return json.loads(result)
+
+
+async def cancel_job(job_id: str) -> Dict:
+    """
+    Cancel a job. Queued jobs are skipped by workers; running jobs stop at their next progress check
+    """
+    record = await get_job(job_id)
+    if record['status'] in FINISHED_STATUSES:
+        return record
+
+    await add_key_value_redis(f'job_cancel:{job_id}', '1', expire=JOB_TTL)
+    task = _running.get(job_id)
+    if task is not None:
+        task.cancel()
+    if record['status'] == QUEUED:
+        record = await _update_job(job_id, status=CANCELLED, finished_at=time.time())
+    return record
+
+
+async def job_events(job_id: str):
+    """Server-sent events with the job record whenever it changes, until the job finishes"""
+    last = None
+    while True:
+        try:
+            record = await get_job(job_id)
+        except HTTPException as e:
+            yield f"event: error\ndata: {json.dumps({'detail': e.detail})}\n\n"
+            return
+        payload = json.dumps(record)
+        if payload != last:
+            yield f"data: {payload}\n\n"
+            last = payload
+        if record['status'] in FINISHED_STATUSES:
+            return
+        await asyncio.sleep(JOB_EVENTS_INTERVAL)
+
+
+def _processing_key(consumer: str) -> str:
+    return f'jobs:processing:{consumer}'
+
+
+def _heartbeat_key(consumer: str) -> str:
+    return f'jobs:heartbeat:{consumer}'
+
+
+async def _run_job(job_id: str, processing: str):
+    stored_params = await get_value_redis(f'job_params:{job_id}')
+    record = await get_job(job_id)
+    if record['status'] != QUEUED or stored_params is None:
+        return
+
+    handler = _handlers.get(record['type'])
+    if handler is None:
+        await _update_job(job_id, status=FAILED, error=f"No handler for {record['type']}", finished_at=time.time())
+        return
+
+    await _update_job(job_id, status=RUNNING, started_at=time.time())
+    with span(f"job {record['type']}", traceparent=record.get('traceparent'), root=True, **{'job.id': job_id}):
+        await _execute_job(job_id, handler, json.loads(stored_params), processing)
+
+
+async def _execute_job(job_id: str, handler: JobHandler, params: Dict, processing: str):
+    task = asyncio.create_task(handler(JobContext(job_id), **params))
+    _running[job_id] = task
+    requeued = False
+    try:
+        result = await task
+        await add_key_value_redis(f'job_result:{job_id}', json.dumps(jsonable_encoder(result)), expire=JOB_TTL)
+        await _update_job(job_id, status=SUCCEEDED, finished_at=time.time())
+        log.info(f"Job {job_id} succeeded")
+    except (JobCancelled, asyncio.CancelledError):
+        if not await get_value_redis(f'job_cancel:{job_id}'):
+            # Worker shutting down rather than a user cancel: hand the job to another worker
+            await _update_job(job_id, status=QUEUED, started_at=None)
+            await move_list_item_redis(processing, QUEUE_KEY, job_id)
+            requeued = True
+            raise
+        await _update_job(job_id, status=CANCELLED, finished_at=time.time())
+        log.info(f"Job {job_id} cancelled")
+    except Exception as e:
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        await _update_job(job_id, status=FAILED, error=detail, finished_at=time.time())
+        log.error(f"Job {job_id} failed: {detail}")
+    finally:
+        _running.pop(job_id, None)
+        # A requeued job needs its params when the next worker picks it up
+        if not requeued:
+            await delete_key_redis(f'job_params:{job_id}')
+
+
+async def _requeue_jobs_of(consumer: str):
+    """Put the jobs a worker took off the queue back on it and forget the worker"""
+    processing = _processing_key(consumer)
+    for job_id in await get_list_redis(processing):
+        job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+        stored = await get_value_redis(f'job:{job_id}')
+        if stored and json.loads(stored)['status'] == RUNNING:
+            # Marked queued first: a worker picking it up runs only queued jobs
+            await _update_job(job_id, status=QUEUED, started_at=None)
+        if await move_list_item_redis(processing, QUEUE_KEY, job_id):
+            log.warn(f"Requeued job {job_id} abandoned by worker {consumer}")
+    await remove_from_set_redis(WORKERS_KEY, consumer)
+    await delete_keys_redis(processing, _heartbeat_key(consumer))
+
+
+async def _heartbeat_loop():
+    """Keep this process's workers alive in Redis and requeue the jobs of workers that died"""
+    while True:
+        try:
+            await add_key_values_redis({_heartbeat_key(consumer): '1' for consumer in _consumers},
+                                       expire=JOB_HEARTBEAT_TTL)
+            for consumer in await get_set_members_redis(WORKERS_KEY):
+                consumer = consumer.decode() if isinstance(consumer, bytes) else consumer
+                if not await key_exists_redis(_heartbeat_key(consumer)):
+                    await _requeue_jobs_of(consumer)
+        except Exception as e:
+            log.error(f"Job heartbeat error: {str(e)}")
+        await asyncio.sleep(JOB_HEARTBEAT_INTERVAL)
+
+
+async def _worker_loop(worker_id: int, consumer: str):
+    # Jobs queue for upstream capacity rather than being shed like requests
+    shed_when_busy.set(False)
+    processing = _processing_key(consumer)
+    registered = False
+    while not _stopping:
+        try:
+            if not registered:
+                # Alive before it is listed, so the reaper never sees it without a heartbeat
+                await add_key_value_redis(_heartbeat_key(consumer), '1', expire=JOB_HEARTBEAT_TTL)
+                await add_to_set_redis(WORKERS_KEY, consumer)
+                registered = True
+            # Held in the worker's processing list until it finishes, so a crash does not lose it
+            job_id = await move_blocking_redis(QUEUE_KEY, processing, timeout=1)
+            if job_id and _stopping:
+                # Taken while shutting down: leave it to another worker
+                await move_list_item_redis(processing, QUEUE_KEY, job_id)
+            elif job_id:
+                job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+                _busy.add(asyncio.current_task())
+                try:
+                    await _run_job(job_id, processing)
+                finally:
+                    _busy.discard(asyncio.current_task())
+                    # No-op when the job was requeued
+                    await remove_from_list_redis(processing, job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.error(f"Job worker {worker_id} error: {str(e)}")
+            await asyncio.sleep(1)
+
+
+def start_workers(count: int = JOB_WORKERS):
+    """Start the job worker pool on the running event loop"""
+    global _stopping, _heartbeat
+    _stopping = False
+    process = f'{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}'
+    for worker_id in range(count):
+        consumer = f'{process}:{worker_id}'
+        _consumers.append(consumer)
+        _workers.append(asyncio.create_task(_worker_loop(worker_id, consumer)))
+    if count:
+        _heartbeat = asyncio.create_task(_heartbeat_loop())
+        log.info(f"Started {count} job workers")
+
+
+async def stop_workers():
+    """
+    Interrupt running jobs, which requeue themselves. Idle workers are left to finish their
+    current pop (a second at most) rather than cancelled; anything still in their processing
+    lists afterwards goes back on the queue
+    """
+    global _stopping, _heartbeat
+    _stopping = True
+    for task in list(_busy):
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    if _heartbeat is not None:
+        _heartbeat.cancel()
+        await asyncio.gather(_heartbeat, return_exceptions=True)
+        _heartbeat = None
+    for consumer in _consumers:
+        await _requeue_jobs_of(consumer)
+    _consumers.clear()
@@ -1,19 +1,55 @@
 import json
+import os
+import re
+from contextlib import asynccontextmanager
 from http.client import HTTPException
+from typing import Optional
 
 import uvicorn
-from fastapi import FastAPI, Form, Request
+from fastapi import Depends, FastAPI, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from integrations.airtable import authorize_airtable, get_items_airtable, oauth2callback_airtable, \
     get_airtable_credentials
 from integrations.hubspot import authorize_hubspot, get_hubspot_credentials, get_items_hubspot, oauth2callback_hubspot, \
-    logout_hubspot_account, delete_contact, update_contact, create_contact, summarize_contact
+    logout_hubspot_account, delete_contact, update_contact, create_contact, summarize_contact, upload_contact_file, \
+    get_contact_files, hubspot_job_credentials, get_contact_properties, resolve_contact_properties, \
+    resolve_hubspot_credentials, parse_associations, search_contacts, get_contact_changes
+from integrations.hubspot_changes import CHANGES_PAGE_SIZE
+from integrations.hubspot_dedupe import resolve_merge_groups
+from integrations.hubspot_embeddings import enqueue_embeddings_job, find_similar_contacts
+from integrations.hubspot_export import export_contacts
+from integrations.hubspot_webhooks import receive_hubspot_webhook, flush_webhook_events
 from integrations.notion import authorize_notion, get_items_notion, oauth2callback_notion, get_notion_credentials
-from redis_client import redis_client
+from jobs import JOB_WORKERS, cancel_job, enqueue_job, get_job, get_job_result, job_events, start_workers, \
+    stop_workers
+from openai_client import batching_stats
+from redis_client import REDIS_BREAKER_RESET, RedisConnectionError, RedisTimeoutError, breaker, ping, pool_stats
+from sessions import session_credentials
+from utils.deadline import DeadlineMiddleware
+from utils.hedging import hedging_stats
+from utils.lifecycle import start_worker, stop_worker, worker_count
+from utils.limiter import limiter_stats
 from utils.logger import log
+from utils.pagination import paginate_items
+from utils.profiling import profile_worker, require_admin
+from utils.tracing import TraceMiddleware
+from utils.responses import json_list_response
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker process; anything that needs its event loop starts here
+    await start_worker()
+    start_workers(JOB_WORKERS)
+    yield
+    await stop_workers()
+    await flush_webhook_events()
+    await stop_worker()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",  # React app address
@@ -28,7 +64,22 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Clients read ETag to revalidate lists with If-None-Match
+    expose_headers=["ETag"],
 )
+# Streaming routes (exports, file transfers, job events) and profiles legitimately outlive any request deadline
+app.add_middleware(DeadlineMiddleware, exempt=re.compile(r'/(export|files|events|profile)$'))
+# Outermost, so the server span covers the other middleware and records deadline and CORS responses
+app.add_middleware(TraceMiddleware)
+
+
+@app.exception_handler(RedisConnectionError)
+@app.exception_handler(RedisTimeoutError)
+async def redis_unavailable_handler(request: Request, exc: Exception):
+    # Redis outages are transient (and fail fast while the breaker is open): ask clients to retry
+    log.error(f"Redis unavailable for {request.url.path}: {str(exc)}")
+    return JSONResponse(status_code=503, content={"detail": "Service temporarily unavailable"},
+                        headers={"Retry-After": str(int(REDIS_BREAKER_RESET))})
 
 
 @app.get('/')
@@ -53,8 +104,21 @@ async def get_airtable_credentials_integration(user_id: str = Form(...), org_id:
 
 
 @app.post('/integrations/airtable/load')
-async def get_airtable_items(credentials: str = Form(...)):
-    return await get_items_airtable(credentials)
+async def get_airtable_items(
+        request: Request,
+        credentials: str = Form(...),
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+        sort: Optional[str] = None,
+        order: Optional[str] = None
+):
+    items = await get_items_airtable(credentials)
+    return json_list_response(request, paginate_items(items, cursor, page_size, sort, order))
+
+
+@app.post('/integrations/airtable/load/jobs')
+async def get_airtable_items_job(credentials: str = Form(...)):
+    return await enqueue_job('airtable.load', {'credentials': credentials})
 
 
 # Notion
@@ -74,11 +138,25 @@ async def get_notion_credentials_integration(user_id: str = Form(...), org_id: s
 
 
 @app.post('/integrations/notion/load')
-async def get_notion_items(credentials: str = Form(...)):
-    return await get_items_notion(credentials)
+async def get_notion_items(
+        request: Request,
+        credentials: str = Form(...),
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+        sort: Optional[str] = None,
+        order: Optional[str] = None
+):
+    items = await get_items_notion(credentials)
+    return json_list_response(request, paginate_items(items, cursor, page_size, sort, order))
 
 
 # HubSpot
+# Credentials come from a session handle (Authorization header) or the legacy credentials form field
+hubspot_credentials = session_credentials('hubspot')
+# Streaming routes leave the request body untouched, so they only accept session handles
+hubspot_session = session_credentials('hubspot', allow_form=False)
+
+
 @app.post('/integrations/hubspot/authorize')
 async def authorize_hubspot_integration(user_id: str = Form(...), org_id: str = Form(...)):
     return await authorize_hubspot(user_id, org_id)
@@ -101,15 +179,90 @@ async def logout_hubspot_integration(user_id: str = Form(...), org_id: str = For
 
 @app.post('/integrations/hubspot/load')
 async def load_hubspot_data_integration(
-        credentials: str = Form(...)
+        request: Request,
+        credentials=Depends(hubspot_credentials),
+        properties: Optional[str] = None,
+        associations: Optional[str] = None,
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = None,
+        sort: Optional[str] = None,
+        order: Optional[str] = None
+):
+    items = await get_items_hubspot(credentials, properties, associations)
+    return json_list_response(request, paginate_items(items, cursor, page_size, sort, order))
+
+
+@app.post('/integrations/hubspot/load/jobs')
+async def load_hubspot_data_job(
+        credentials=Depends(hubspot_credentials),
+        properties: Optional[str] = None,
+        associations: Optional[str] = None
+):
+    creds = await resolve_hubspot_credentials(credentials)
+    job_credentials = hubspot_job_credentials(creds)
+    params = {
+        'credentials': job_credentials,
+        'properties': await resolve_contact_properties(creds, properties),
+        'associations': parse_associations(associations),
+    }
+    return await enqueue_job('hubspot.load', params, job_credentials.get('org_id'), job_credentials.get('user_id'))
+
+
+@app.get('/integrations/hubspot/export')
+async def export_hubspot_contacts(
+        credentials=Depends(hubspot_session),
+        format: str = 'csv',
+        properties: Optional[str] = None
+):
+    return await export_contacts(credentials, format, properties)
+
+
+@app.get('/integrations/hubspot/changes')
+async def get_hubspot_contact_changes(
+        credentials=Depends(hubspot_session),
+        since: Optional[str] = None,
+        limit: int = CHANGES_PAGE_SIZE
 ):
-    return await get_items_hubspot(credentials)
+    return await get_contact_changes(credentials, since, limit)
+
+
+@app.get('/integrations/hubspot/properties')
+async def get_hubspot_contact_properties(
+        request: Request,
+        credentials=Depends(hubspot_session)
+):
+    return json_list_response(request, await get_contact_properties(credentials))
+
+
+@app.get('/integrations/hubspot/contacts/search')
+async def search_hubspot_contacts(
+        request: Request,
+        credentials=Depends(hubspot_session),
+        q: Optional[str] = None,
+        has_email: bool = False,
+        has_phone: bool = False,
+        has_company: bool = False,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None,
+        sort: str = 'id',
+        order: str = 'asc',
+        limit: int = 100,
+        offset: int = 0
+):
+    filters = {
+        'has_email': has_email,
+        'has_phone': has_phone,
+        'has_company': has_company,
+        'created_after': created_after,
+        'created_before': created_before,
+    }
+    return json_list_response(request, await search_contacts(credentials, q, filters, sort, order, limit, offset))
 
 
 # Enhancements
 @app.post('/integrations/hubspot/contacts')
 async def create_hubspot_contact(
-        credentials: str = Form(...),
+        credentials=Depends(hubspot_credentials),
         contact_data: str = Form(...)
 ):
     try:
@@ -127,7 +280,7 @@ async def create_hubspot_contact(
 @app.patch('/integrations/hubspot/contacts/{contact_id}')
 async def update_hubspot_contact(
         contact_id: str,
-        credentials: str = Form(...),
+        credentials=Depends(hubspot_credentials),
         contact_data: str = Form(...)
 ):
     return await update_contact(credentials, contact_id, json.loads(contact_data))
@@ -136,7 +289,7 @@ async def update_hubspot_contact(
 @app.delete('/integrations/hubspot/contacts/{contact_id}')
 async def delete_hubspot_contact(
         contact_id: str,
-        credentials: str = Form(...)
+        credentials=Depends(hubspot_credentials)
 ):
     return await delete_contact(credentials, contact_id)
 
@@ -144,20 +297,132 @@ async def delete_hubspot_contact(
 @app.post('/integrations/hubspot/contacts/{contact_id}/summarize')
 async def summarize_hubspot_contact(
         contact_id: str,
-        credentials: str = Form(...)
+        credentials=Depends(hubspot_credentials)
 ):
     return await summarize_contact(credentials, contact_id)
 
 
+@app.post('/integrations/hubspot/contacts/summarize/jobs')
+async def summarize_hubspot_contacts_job(
+        credentials=Depends(hubspot_credentials),
+        contact_ids: str = Form(...)
+):
+    job_credentials = hubspot_job_credentials(credentials)
+    params = {'credentials': job_credentials, 'contact_ids': json.loads(contact_ids)}
+    return await enqueue_job('hubspot.summarize', params, job_credentials.get('org_id'), job_credentials.get('user_id'))
+
+
+@app.get('/integrations/hubspot/contacts/{contact_id}/similar')
+async def get_similar_hubspot_contacts(
+        contact_id: str,
+        credentials=Depends(hubspot_session),
+        limit: int = 10
+):
+    return await find_similar_contacts(credentials, contact_id, limit)
+
+
+@app.post('/integrations/hubspot/contacts/embeddings/jobs')
+async def embed_hubspot_contacts_job(
+        credentials=Depends(hubspot_credentials)
+):
+    return await enqueue_embeddings_job(hubspot_job_credentials(credentials))
+
+
+@app.post('/integrations/hubspot/contacts/duplicates/jobs')
+async def find_hubspot_duplicates_job(
+        credentials=Depends(hubspot_credentials)
+):
+    job_credentials = hubspot_job_credentials(credentials)
+    params = {'credentials': job_credentials}
+    return await enqueue_job('hubspot.dedupe', params, job_credentials.get('org_id'), job_credentials.get('user_id'))
+
+
+@app.post('/integrations/hubspot/contacts/merge/jobs')
+async def merge_hubspot_duplicates_job(
+        credentials=Depends(hubspot_credentials),
+        groups: Optional[str] = Form(None),
+        job_id: Optional[str] = Form(None),
+        min_confidence: Optional[float] = Form(None)
+):
+    job_credentials = hubspot_job_credentials(credentials)
+    params = {
+        'credentials': job_credentials,
+        'groups': await resolve_merge_groups(job_credentials, groups, job_id, min_confidence),
+    }
+    return await enqueue_job('hubspot.merge', params, job_credentials.get('org_id'), job_credentials.get('user_id'))
+
+
+@app.post('/integrations/hubspot/contacts/{contact_id}/files')
+async def upload_hubspot_contact_file(
+        contact_id: str,
+        request: Request,
+        credentials=Depends(hubspot_session)
+):
+    return await upload_contact_file(credentials, contact_id, request)
+
+
+@app.post('/integrations/hubspot/webhooks')
+async def hubspot_webhook(request: Request):
+    return await receive_hubspot_webhook(request)
+
+
+@app.get('/integrations/hubspot/contacts/{contact_id}/files')
+async def get_hubspot_contact_files(
+        contact_id: str,
+        credentials=Depends(hubspot_session)
+):
+    return await get_contact_files(credentials, contact_id)
+
+
+# Background jobs
+@app.get('/jobs/{job_id}')
+async def get_job_status(job_id: str):
+    return await get_job(job_id)
+
+
+@app.get('/jobs/{job_id}/result')
+async def get_job_result_integration(request: Request, job_id: str):
+    return json_list_response(request, await get_job_result(job_id))
+
+
+@app.get('/jobs/{job_id}/events')
+async def stream_job_events(job_id: str):
+    return StreamingResponse(job_events(job_id), media_type='text/event-stream')
+
+
+@app.delete('/jobs/{job_id}')
+async def cancel_job_integration(job_id: str):
+    return await cancel_job(job_id)
+
+
 @app.get("/health")
 async def health_check():
+    # Read before the PING below takes a connection of its own
+    pool = pool_stats()
     try:
         # Check Redis connection
-        await redis_client.ping()
-        return {"status": "healthy", "redis": "connected"}
+        await ping()
     except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
+        return JSONResponse(status_code=503, content={
+            "status": "unhealthy", "redis": str(e), "pool": pool, "circuit": breaker.to_dict()
+        })
+    return {
+        "status": "degraded" if pool['saturated'] else "healthy",
+        "redis": "connected",
+        "pool": pool,
+        "circuit": breaker.to_dict(),
+        # Never touches an upstream, so it answers even while upstream-bound routes shed load
+        "upstreams": limiter_stats(),
+        "hedging": hedging_stats(),
+        "summary_batching": batching_stats(),
+    }
+
+
+@app.get('/admin/profile', dependencies=[Depends(require_admin)])
+async def profile_worker_integration(seconds: float = 10, kinds: Optional[str] = None, format: str = 'json'):
+    return await profile_worker(seconds, kinds, format)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Several workers need an import string so each process loads its own app
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.environ.get('PORT', 8000)), workers=worker_count())
@@ -1,21 +1,64 @@
-from openai import OpenAI
+import asyncio
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from openai import APIConnectionError, AsyncOpenAI, InternalServerError, RateLimitError
 from fastapi import HTTPException
 
+from utils.deadline import set_deadline, within_deadline
+from utils.lifecycle import after_fork, on_worker_stop
+from utils.limiter import get_limiter, register_upstream
 from utils.logger import log
 from utils.secrets import get_hubspot_secrets
+from utils.tracing import CLIENT, span
 
 # Get OpenAI API key from secrets and create client
 openai_config = get_hubspot_secrets()
-client = OpenAI(api_key=openai_config.get('openai_api_key'))
+client = AsyncOpenAI(api_key=openai_config.get('openai_api_key'))
+# Rate limits, 5xx and timeouts (APITimeoutError is an APIConnectionError) after the client's own retries
+OVERLOAD_ERRORS = (RateLimitError, InternalServerError, APIConnectionError)
+register_upstream('openai')
+MODEL = "gpt-3.5-turbo"
+SUMMARY_MAX_TOKENS = 150
+EMBEDDING_MODEL = os.environ.get('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+# Shortened embeddings (text-embedding-3 models) keep vector indexes small at little cost in quality
+EMBEDDING_DIMENSIONS = int(os.environ.get('OPENAI_EMBEDDING_DIMENSIONS', 256))
 
+# Summaries requested within this window are packed into one completion; 0 sends each on its own
+BATCH_WINDOW = float(os.environ.get('OPENAI_BATCH_WINDOW_MS', 10)) / 1000
+BATCH_MAX_CONTACTS = int(os.environ.get('OPENAI_BATCH_MAX_CONTACTS', 8))
+# Token budgets of one batched completion: the contacts sent, and the summaries its reply must hold
+BATCH_PROMPT_TOKENS = int(os.environ.get('OPENAI_BATCH_PROMPT_TOKENS', 3000))
+BATCH_COMPLETION_TOKENS = int(os.environ.get('OPENAI_BATCH_COMPLETION_TOKENS', 1500))
+# JSON keys and quoting around each summary in a batched reply
+BATCH_ITEM_OVERHEAD_TOKENS = 20
 
-async def summarize_contact_ai(contact_data: dict) -> str:
-    """
-    Generate a summary of contact information using OpenAI's GPT model
-    """
-    try:
-        # Format contact data into a readable string
-        contact_info = f"""
+SYSTEM_PROMPT = "You are a helpful assistant that summarizes contact information concisely."
+BATCH_SYSTEM_PROMPT = (
+    SYSTEM_PROMPT + " You will be given several numbered contacts. Reply with a JSON object of the form "
+    '{"summaries": {"<contact number>": "<summary>"}} holding one brief, professional summary per contact.'
+)
+
+
+@after_fork
+def _reset_after_fork():
+    global client
+    client = AsyncOpenAI(api_key=openai_config.get('openai_api_key'))
+
+
+@on_worker_stop
+async def _close_client():
+    await client.close()
+
+
+def _estimate_tokens(text: str) -> int:
+    # About four characters per token for English text; close enough for budgeting without a tokenizer
+    return len(text) // 4 + 1
+
+
+def _format_contact(contact_data: dict) -> str:
+    return f"""
         Name: {contact_data.get('name', 'N/A')}
         Email: {contact_data.get('email', 'N/A')}
         Phone: {contact_data.get('phone', 'N/A')}
@@ -25,22 +68,207 @@ async def summarize_contact_ai(contact_data: dict) -> str:
         Additional Info: {contact_data.get('additional_info', 'N/A')}
         """
 
-        # Call OpenAI API
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system",
-                 "content": "You are a helpful assistant that summarizes contact information concisely."},
-                {"role": "user",
-                 "content": f"Please provide a brief, professional summary of this contact: {contact_info}"}
-            ],
-            max_tokens=150,
-            temperature=0.7,
-        )
-
-        summary = response.choices[0].message.content.strip()
-        return summary
 
+async def _complete(messages: List[Dict], max_tokens: int, contacts: int = 1, **kwargs):
+    """One chat completion under the OpenAI concurrency limit, traced with its token usage"""
+    with span('openai chat.completions', CLIENT, **{
+        'gen_ai.system': 'openai', 'gen_ai.request.model': MODEL, 'app.contacts': contacts,
+    }) as traced:
+        async with get_limiter('openai').slot(OVERLOAD_ERRORS):
+            response = await within_deadline(client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.7,
+                **kwargs,
+            ))
+        if traced is not None and response.usage is not None:
+            traced.set(**{'gen_ai.usage.input_tokens': response.usage.prompt_tokens,
+                          'gen_ai.usage.output_tokens': response.usage.completion_tokens})
+    return response
+
+
+async def embed_texts(texts: List[str]) -> List[List[float]]:
+    """Embeddings of the texts, in order, from one API call"""
+    with span('openai embeddings', CLIENT, **{
+        'gen_ai.system': 'openai', 'gen_ai.request.model': EMBEDDING_MODEL, 'app.inputs': len(texts),
+    }) as traced:
+        async with get_limiter('openai').slot(OVERLOAD_ERRORS):
+            response = await within_deadline(client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts,
+                dimensions=EMBEDDING_DIMENSIONS,
+            ))
+        if traced is not None and response.usage is not None:
+            traced.set(**{'gen_ai.usage.input_tokens': response.usage.prompt_tokens})
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+async def _summarize_one(contact_info: str) -> str:
+    response = await _complete([
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Please provide a brief, professional summary of this contact: {contact_info}"}
+    ], SUMMARY_MAX_TOKENS)
+    return response.choices[0].message.content.strip()
+
+
+async def _summarize_many(contact_infos: List[str]) -> List[Optional[str]]:
+    """
+    Summaries of several contacts from one structured-output completion, in order. None for each
+    contact whose summary is missing from the reply, or for all of them when it does not parse
+    """
+    numbered = ''.join(f"\n### Contact {number}{info}" for number, info in enumerate(contact_infos, start=1))
+    response = await _complete([
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Please summarize each of these contacts:{numbered}"}
+    ], len(contact_infos) * (SUMMARY_MAX_TOKENS + BATCH_ITEM_OVERHEAD_TOKENS), contacts=len(contact_infos),
+        response_format={"type": "json_object"})
+    choice = response.choices[0]
+    try:
+        summaries = json.loads(choice.message.content)['summaries']
+        if not isinstance(summaries, dict):
+            raise TypeError('summaries is not an object')
+    except (TypeError, KeyError, ValueError) as e:
+        log.warn(f"Unparseable batched summary reply ({choice.finish_reason}): {str(e)}")
+        return [None] * len(contact_infos)
+    results = []
+    for number in range(1, len(contact_infos) + 1):
+        summary = summaries.get(str(number))
+        results.append(summary.strip() if isinstance(summary, str) and summary.strip() else None)
+    return results
+
+
+def _settle(future: asyncio.Future, result=None, error: Optional[BaseException] = None):
+    # Callers that gave up (deadline, disconnect) have cancelled their future already
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class SummaryBatcher:
+    """
+    Queues summary prompts for BATCH_WINDOW and sends them as one completion, closing a batch
+    early once another contact would not fit BATCH_MAX_CONTACTS or the token budgets. Batches are
+    kept per tenant key: contact notes are free text, so one tenant's contacts must never share a
+    prompt (or a reply) with another's. Contacts the batched reply does not cover are retried with
+    single-contact prompts
+    """
+
+    def __init__(self):
+        self.capacity = max(1, min(BATCH_MAX_CONTACTS,
+                                   BATCH_COMPLETION_TOKENS // (SUMMARY_MAX_TOKENS + BATCH_ITEM_OVERHEAD_TOKENS)))
+        # tenant key -> queued prompts, their estimated tokens, and the timer closing the batch
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._prompt_tokens: Dict[str, int] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # Held so in-flight batches are not garbage collected
+        self._tasks = set()
+        self.completions = 0
+        self.contacts = 0
+        self.fallbacks = 0
+
+    def submit(self, key: str, contact_info: str) -> asyncio.Future:
+        """Future resolving to the summary of one formatted contact, batched only with the same key's"""
+        loop = asyncio.get_running_loop()
+        tokens = _estimate_tokens(contact_info)
+        if key in self._pending and self._prompt_tokens[key] + tokens > BATCH_PROMPT_TOKENS:
+            self._flush(key)
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append((contact_info, future))
+        self._prompt_tokens[key] = self._prompt_tokens.get(key, 0) + tokens
+        if len(self._pending[key]) >= self.capacity:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(BATCH_WINDOW, self._flush, key)
+        return future
+
+    def _flush(self, key: str):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = [(info, future) for info, future in self._pending.pop(key, []) if not future.done()]
+        self._prompt_tokens.pop(key, None)
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        # Shared by several requests: each bounds its own wait, so the first one's deadline must not apply
+        set_deadline(None)
+        self.completions += 1
+        self.contacts += len(batch)
+        if len(batch) == 1:
+            await self._send_one(*batch[0])
+            return
+        try:
+            summaries = await _summarize_many([info for info, _ in batch])
+        except Exception as e:
+            # Overload and API errors would fail the single prompts too
+            for _, future in batch:
+                _settle(future, error=e)
+            return
+        retry = []
+        for (info, future), summary in zip(batch, summaries):
+            if summary is None:
+                retry.append((info, future))
+            else:
+                _settle(future, summary)
+        if retry:
+            self.fallbacks += len(retry)
+            self.completions += len(retry)
+            log.warn(f"Batched summary reply missed {len(retry)} of {len(batch)} contacts; summarizing them one by one")
+            await asyncio.gather(*(self._send_one(info, future) for info, future in retry))
+
+    @staticmethod
+    async def _send_one(contact_info: str, future: asyncio.Future):
+        try:
+            _settle(future, await _summarize_one(contact_info))
+        except Exception as e:
+            _settle(future, error=e)
+
+    def stats(self) -> Dict:
+        return {
+            'completions': self.completions,
+            'contacts': self.contacts,
+            'fallbacks': self.fallbacks,
+            'queued': sum(len(batch) for batch in self._pending.values()),
+        }
+
+
+_batcher = SummaryBatcher()
+
+
+@after_fork
+def _reset_batcher():
+    global _batcher
+    _batcher = SummaryBatcher()
+
+
+def batching_stats() -> Dict:
+    """Completions sent for how many contacts in this worker, for the health check"""
+    return _batcher.stats()
+
+
+async def summarize_contact_ai(contact_data: dict, batch_key: Optional[str] = None) -> str:
+    """
+    Generate a summary of contact information using OpenAI's GPT model. Concurrent requests with
+    the same batch_key (the tenant the contact belongs to) are batched into shared completions
+    (see SummaryBatcher); without one the contact is summarized on its own
+    """
+    try:
+        # Format contact data into a readable string
+        contact_info = _format_contact(contact_data)
+
+        if BATCH_WINDOW <= 0 or batch_key is None:
+            return await _summarize_one(contact_info)
+        return await within_deadline(_batcher.submit(batch_key, contact_info))
+
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(f"Failed to generate contact summary: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to generate summary: {str(e)}")
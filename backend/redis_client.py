@@ -1,10 +1,20 @@
+import functools
 import json
 import os
+import re
+from secrets import token_hex
 
 import redis.asyncio as redis
 from kombu.utils.url import safequote
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, ResponseError, TimeoutError as RedisTimeoutError
 
+from utils.cache import LRUCache
+from utils.circuit_breaker import CircuitBreaker
+from utils.lifecycle import after_fork, on_worker_stop
 from utils.secrets import get_aws_client
+from utils.tracing import CLIENT, span
 
 try:
     # Get Secrets Manager client
@@ -16,24 +26,298 @@ except Exception:
     # Fall back to environment variable or localhost if secrets fail
     redis_host = safequote(os.environ.get('REDIS_HOST', 'localhost'))
 
-redis_client = redis.Redis(host=redis_host, port=6379, db=0)
+# Connections per worker process; callers wait up to REDIS_POOL_TIMEOUT for a free one
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 2.0))
+# Bounds every command, so a stalled Redis fails requests instead of hanging them
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 2.0))
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 1.0))
+# Idle connections are PINGed before reuse after this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+REDIS_RETRIES = int(os.environ.get('REDIS_RETRIES', 2))
+# Consecutive failures before commands fail fast, and how long until one is tried again
+REDIS_BREAKER_FAILURES = int(os.environ.get('REDIS_BREAKER_FAILURES', 5))
+REDIS_BREAKER_RESET = float(os.environ.get('REDIS_BREAKER_RESET', 10.0))
+# How long a hot value read from Redis may be served locally while Redis is unreachable
+REDIS_FALLBACK_TTL = float(os.environ.get('REDIS_FALLBACK_TTL', 60))
 
+# Pool usage at which /health reports the worker as degraded
+REDIS_POOL_SATURATION_WARNING = 0.9
 
+# Reads worth serving stale during an outage: sessions, credentials and per-user lookups
+FALLBACK_KEYS = re.compile(r'^(session|\w+_credentials|hubspot_portal|hubspot_properties):')
+
+
+class RedisUnavailable(RedisConnectionError):
+    """Raised without contacting Redis while the circuit breaker is open"""
+
+
+def _create_client() -> redis.Redis:
+    pool = redis.BlockingConnectionPool(
+        host=redis_host, port=6379, db=0,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        # Only connection errors are retried: after a timeout the command may already have run
+        retry=Retry(ExponentialBackoff(cap=0.5, base=0.05), REDIS_RETRIES),
+        retry_on_error=[RedisConnectionError],
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+redis_client = _create_client()
+breaker = CircuitBreaker('redis', REDIS_BREAKER_FAILURES, REDIS_BREAKER_RESET)
+# key -> last value read from Redis, for FALLBACK_KEYS only
+_fallback = LRUCache(maxsize=10000, ttl=REDIS_FALLBACK_TTL)
+
+
+@after_fork
+def _reset_after_fork():
+    # Pooled sockets are shared with the parent after a fork; each worker opens its own
+    global redis_client
+    redis_client = _create_client()
+    breaker.record_success()
+    _fallback.clear()
+
+
+@on_worker_stop
+async def _close_pool():
+    await redis_client.aclose()
+
+
+def _guarded(fn):
+    """Fail fast while the breaker is open, feed it the outcome of every call, and trace the call"""
+    operation = fn.__name__.lstrip('_')
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if not breaker.allow():
+            raise RedisUnavailable('Redis unavailable (circuit open)')
+        with span(f'redis {operation}', CLIENT, **{'db.system': 'redis', 'db.operation': operation}):
+            try:
+                result = await fn(*args, **kwargs)
+            except (RedisConnectionError, RedisTimeoutError):
+                breaker.record_failure()
+                raise
+        breaker.record_success()
+        return result
+
+    return wrapper
+
+
+def pool_stats() -> dict:
+    """Connection pool usage in this worker, for the health check"""
+    pool = redis_client.connection_pool
+    in_use = len(getattr(pool, '_in_use_connections', ()))
+    idle = len(getattr(pool, '_available_connections', ()))
+    max_connections = pool.max_connections
+    saturation = in_use / max_connections if max_connections else 0.0
+    return {
+        'in_use': in_use,
+        'idle': idle,
+        'max': max_connections,
+        'saturation': round(saturation, 3),
+        'saturated': saturation >= REDIS_POOL_SATURATION_WARNING,
+    }
+
+
+@_guarded
 async def add_key_value_redis(key, value, expire=None):
-    print(f'Adding key {key} with value {value}')
+    _fallback.pop(key)
     await redis_client.set(key, value)
     if expire:
         await redis_client.expire(key, expire)
+    if FALLBACK_KEYS.match(key):
+        # As Redis will return it, so a fresh session or token survives an outage right after login
+        _fallback.set(key, value if isinstance(value, bytes) else str(value).encode())
 
 
-async def get_value_redis(key):
+@_guarded
+async def add_key_values_redis(mapping, expire=None):
+    """SET several keys, each with the same expiry, in one round trip"""
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key, value in mapping.items():
+            _fallback.pop(key)
+            pipe.set(key, value, ex=expire)
+        await pipe.execute()
+
+
+@_guarded
+async def _get(key):
     return await redis_client.get(key)
 
 
+async def get_value_redis(key):
+    """
+    GET, falling back to this worker's last read of hot keys (FALLBACK_KEYS) while Redis is
+    unreachable, so signed-in users keep working through a short outage
+    """
+    try:
+        value = await _get(key)
+    except (RedisConnectionError, RedisTimeoutError):
+        value = _fallback.get(key)
+        if value is None:
+            raise
+        return value
+    if FALLBACK_KEYS.match(key):
+        if value is None:
+            _fallback.pop(key)
+        else:
+            _fallback.set(key, value)
+    return value
+
+
+@_guarded
+async def get_values_redis(keys):
+    """MGET: values of the keys in order, None for missing ones"""
+    return await redis_client.mget(keys) if keys else []
+
+
+@_guarded
 async def delete_key_redis(key):
+    _fallback.pop(key)
     await redis_client.delete(key)
 
 
+@_guarded
+async def delete_keys_redis(*keys):
+    for key in keys:
+        _fallback.pop(key)
+    await redis_client.delete(*keys)
+
+
+@_guarded
+async def add_to_set_redis(key, value, expire=None):
+    await redis_client.sadd(key, value)
+    if expire:
+        await redis_client.expire(key, expire)
+
+
+@_guarded
+async def remove_from_set_redis(key, value):
+    await redis_client.srem(key, value)
+
+
+@_guarded
+async def get_set_members_redis(key):
+    return await redis_client.smembers(key)
+
+
+@_guarded
+async def set_hash_redis(key, mapping, expire=None):
+    await redis_client.hset(key, mapping=mapping)
+    if expire:
+        await redis_client.expire(key, expire)
+
+
+@_guarded
+async def get_hash_redis(key):
+    return await redis_client.hgetall(key)
+
+
+@_guarded
+async def get_hash_fields_redis(key, fields):
+    return await redis_client.hmget(key, fields)
+
+
+@_guarded
+async def delete_hash_fields_redis(key, fields):
+    await redis_client.hdel(key, *fields)
+
+
+@_guarded
+async def key_exists_redis(key):
+    return await redis_client.exists(key) > 0
+
+
+@_guarded
+async def push_redis(key, value):
+    """Add to the tail of a queue list, whose head move_blocking_redis takes from"""
+    await redis_client.lpush(key, value)
+
+
+@_guarded
+async def move_blocking_redis(source, destination, timeout):
+    """
+    Move the head (oldest item) of a queue list into another list, waiting up to timeout seconds
+    for one. Returns the item, or None on timeout
+    """
+    # Redis must answer within the socket timeout, so never wait server-side for that long
+    timeout = min(timeout, REDIS_SOCKET_TIMEOUT / 2)
+    return await redis_client.brpoplpush(source, destination, timeout)
+
+
+@_guarded
+async def get_list_redis(key):
+    return await redis_client.lrange(key, 0, -1)
+
+
+# Move one occurrence of a value between lists, only if the source still holds it; it lands at the
+# head of the destination, so a queue hands it out next
+MOVE_LIST_ITEM_SCRIPT = """
+if redis.call('lrem', KEYS[1], 1, ARGV[1]) > 0 then
+    return redis.call('rpush', KEYS[2], ARGV[1])
+end
+return 0
+"""
+
+
+@_guarded
+async def move_list_item_redis(source, destination, value):
+    """Move value from source to the head of destination. Returns False when source did not hold it"""
+    return await redis_client.eval(MOVE_LIST_ITEM_SCRIPT, 2, source, destination, value) > 0
+
+
+@_guarded
+async def remove_from_list_redis(key, value):
+    await redis_client.lrem(key, 1, value)
+
+
+@_guarded
+async def append_stream_redis(key, entries, min_id=None, expire=None):
+    """
+    XADD several entries in one round trip, trimming entries older than min_id (approximately).
+    Returns the ids Redis assigned
+    """
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for fields in entries:
+            pipe.xadd(key, fields, minid=min_id, approximate=True)
+        if expire:
+            pipe.expire(key, expire)
+        results = await pipe.execute()
+    return results[:len(entries)]
+
+
+@_guarded
+async def read_stream_redis(key, after, count):
+    """Up to count entries with ids after `after` (exclusive), oldest first"""
+    return await redis_client.xrange(key, f'({after}', '+', count=count)
+
+
+@_guarded
+async def stream_info_redis(key):
+    """Id of the oldest entry still in the stream and the last id it generated; None when it does not exist"""
+    try:
+        info = await redis_client.xinfo_stream(key)
+    except ResponseError as e:
+        if 'no such key' in str(e).lower():
+            return None
+        raise
+    first = info.get('first-entry')
+    return {'first_id': first[0] if first else None, 'last_id': info['last-generated-id']}
+
+
+@_guarded
+async def time_ms_redis():
+    """The Redis clock in milliseconds, the time stream ids are generated from"""
+    seconds, microseconds = await redis_client.time()
+    return seconds * 1000 + microseconds // 1000
+
+
+@_guarded
 async def get_keys_with_prefix(prefix):
     # Use SCAN to find keys starting with the given prefix
     cursor = 0
@@ -57,6 +341,66 @@ async def get_keys_with_prefix(prefix):
     return items
 
 
+# Delete the lock only if it is still held by the caller's token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+# Replay the changes journaled while a staging copy of a hash was built (an empty value deletes the
+# field), swap the copy in, and set the marker saying the hash is current
+REPLACE_HASH_SCRIPT = """
+local changes = redis.call('hgetall', KEYS[3])
+for i = 1, #changes, 2 do
+    if changes[i + 1] == '' then
+        redis.call('hdel', KEYS[1], changes[i])
+    else
+        redis.call('hset', KEYS[1], changes[i], changes[i + 1])
+    end
+end
+if redis.call('exists', KEYS[1]) == 1 then
+    redis.call('rename', KEYS[1], KEYS[2])
+    redis.call('expire', KEYS[2], ARGV[1])
+else
+    redis.call('del', KEYS[2])
+end
+redis.call('del', KEYS[3])
+redis.call('set', KEYS[4], '1', 'EX', ARGV[1])
+"""
+
+
+@_guarded
+async def replace_hash_redis(key, mapping, journal_key, marker_key, expire):
+    """
+    Replace a hash with mapping without readers ever seeing it empty or half written: the mapping
+    is written under a temporary key, then the changes recorded in journal_key are replayed on it
+    and it is renamed over key together with setting marker_key, atomically
+    """
+    staging_key = f'{key}:staging:{token_hex(8)}'
+    if mapping:
+        await redis_client.hset(staging_key, mapping=mapping)
+        await redis_client.expire(staging_key, expire)
+    await redis_client.eval(REPLACE_HASH_SCRIPT, 4, staging_key, key, journal_key, marker_key, expire)
+
+
+@_guarded
+async def acquire_lock(key, ttl):
+    """Try to take a lock that expires after ttl seconds. Returns the owner token, or None if held"""
+    token = token_hex(16)
+    if await redis_client.set(key, token, nx=True, ex=ttl):
+        return token
+    return None
+
+
+@_guarded
+async def release_lock(key, token):
+    await redis_client.eval(RELEASE_LOCK_SCRIPT, 1, key, token)
+
+
+@_guarded
 async def ping():
     """Check Redis connection by sending PING command"""
     return await redis_client.ping()
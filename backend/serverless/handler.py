@@ -1,7 +1,11 @@
 import asyncio
+import base64
 import json
 import os
-from typing import Dict, Any
+import re
+import secrets
+import time
+from typing import Dict, Any, Optional
 
 import httpx
 from aws_lambda_powertools import Logger
@@ -14,14 +18,29 @@ logger = Logger()
 ALB_ENDPOINT = os.environ.get('ALB_ENDPOINT', 'http://vector-shift-alb-861076819.ap-south-1.elb.amazonaws.com')
 DEFAULT_TIMEOUT = 30.0  # seconds
 
+# Tracing: the proxy span is exported here (OTLP/JSON) when set, and its traceparent goes to the backend
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT') or (
+    os.environ['OTEL_EXPORTER_OTLP_ENDPOINT'].rstrip('/') + '/v1/traces'
+    if os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT') else None
+)
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'hubspot-proxy')
+# The export happens before the response is returned, so it must not hold it up for long
+TRACE_EXPORT_TIMEOUT = 1.0
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
 # CORS headers
 CORS_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Credentials': 'true',
-    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-Amz-Date,X-Api-Key,X-Amz-Security-Token',
-    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,PUT,DELETE,PATCH'
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-Amz-Date,X-Api-Key,X-Amz-Security-Token,If-None-Match,traceparent',
+    'Access-Control-Allow-Methods': 'OPTIONS,POST,GET,PUT,DELETE,PATCH',
+    'Access-Control-Expose-Headers': 'ETag'
 }
 
+# Upstream response headers the client needs as-is (caching, compression, downloads)
+PASSTHROUGH_HEADERS = ['content-encoding', 'etag', 'vary', 'cache-control', 'content-disposition', 'retry-after']
+TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml')
+
 
 def create_error_response(status_code: int, message: str) -> Dict[str, Any]:
     """Create a standardized error response"""
@@ -32,19 +51,108 @@ def create_error_response(status_code: int, message: str) -> Dict[str, Any]:
     }
 
 
-def create_success_response(status_code: int, body: str, content_type: str = 'application/json') -> Dict[str, Any]:
+def create_success_response(status_code: int, body: str, content_type: str = 'application/json',
+                            headers: Dict[str, str] = None, is_base64_encoded: bool = False) -> Dict[str, Any]:
     """Create a standardized success response"""
     return {
         'statusCode': status_code,
         'body': body,
-        'headers': {**CORS_HEADERS, 'Content-Type': content_type}
+        'headers': {**CORS_HEADERS, **(headers or {}), 'Content-Type': content_type},
+        'isBase64Encoded': is_base64_encoded
+    }
+
+
+def create_proxy_response(response: httpx.Response, raw_body: bytes) -> Dict[str, Any]:
+    """
+    Relay the upstream response unchanged. Compressed and binary bodies go back base64 encoded,
+    which API Gateway decodes for any type listed in binaryMediaTypes
+    """
+    content_type = response.headers.get('content-type', 'application/json')
+    headers = {
+        name.title(): response.headers[name] for name in PASSTHROUGH_HEADERS if name in response.headers
+    }
+    is_text = content_type.startswith(TEXT_CONTENT_TYPES) and 'content-encoding' not in response.headers
+    if is_text:
+        return create_success_response(response.status_code, raw_body.decode(response.encoding or 'utf-8'),
+                                       content_type, headers)
+    return create_success_response(response.status_code, base64.b64encode(raw_body).decode(), content_type,
+                                   headers, is_base64_encoded=True)
+
+
+def trace_context(headers: Dict[str, str]) -> Dict[str, Any]:
+    """Continue the caller's W3C trace (a traceparent from the browser) or start a new one"""
+    incoming = next((value for name, value in headers.items() if name.lower() == 'traceparent'), None)
+    match = TRACEPARENT.match(incoming.strip().lower()) if incoming else None
+    if match and match.group(1) != '0' * 32 and match.group(2) != '0' * 16:
+        trace_id, parent_id, sampled = match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+    else:
+        trace_id, parent_id, sampled = secrets.token_hex(16), None, True
+    span_id = secrets.token_hex(8)
+    return {
+        'trace_id': trace_id,
+        'span_id': span_id,
+        'parent_id': parent_id,
+        'sampled': sampled,
+        'traceparent': f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}",
+        'start_ns': time.time_ns(),
     }
 
 
+def _attribute(key: str, value) -> Dict[str, Any]:
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+async def export_span(trace: Dict[str, Any], event: Dict[str, Any], status_code: int,
+                      context: Optional[LambdaContext] = None):
+    """Send the proxy's span to the collector; tracing never fails the request"""
+    if not OTLP_ENDPOINT or not trace['sampled']:
+        return
+    span = {
+        'traceId': trace['trace_id'],
+        'spanId': trace['span_id'],
+        'name': f"{event.get('httpMethod', 'GET')} proxy",
+        'kind': 2,  # server
+        'startTimeUnixNano': str(trace['start_ns']),
+        'endTimeUnixNano': str(time.time_ns()),
+        'attributes': [
+            _attribute('http.request.method', event.get('httpMethod', 'GET')),
+            _attribute('url.path', event.get('path', '')),
+            _attribute('http.response.status_code', status_code),
+            _attribute('faas.invocation_id', getattr(context, 'aws_request_id', '')),
+        ],
+    }
+    if trace['parent_id']:
+        span['parentSpanId'] = trace['parent_id']
+    if status_code >= 500:
+        span['status'] = {'code': 2}
+    body = {'resourceSpans': [{
+        'resource': {'attributes': [_attribute('service.name', SERVICE_NAME)]},
+        'scopeSpans': [{'scope': {'name': 'proxy'}, 'spans': [span]}],
+    }]}
+    try:
+        async with httpx.AsyncClient(timeout=TRACE_EXPORT_TIMEOUT) as client:
+            await client.post(OTLP_ENDPOINT, json=body)
+    except httpx.HTTPError as e:
+        logger.warning(f"Trace export failed: {str(e)}")
+
+
 @logger.inject_lambda_context
 async def make_request(event: Dict[str, Any], context: LambdaContext) -> Dict[str, Any]:
     """
-    Handle the API Gateway request and proxy it to the ALB
+    Handle the API Gateway request and proxy it to the ALB, as one span of the request's trace
+    """
+    trace = trace_context(event.get('headers', {}) or {})
+    logger.append_keys(trace_id=trace['trace_id'])
+    response = await forward_request(event, trace['traceparent'])
+    await export_span(trace, event, response['statusCode'], context)
+    return response
+
+
+async def forward_request(event: Dict[str, Any], traceparent: str) -> Dict[str, Any]:
+    """
+    Proxy the API Gateway request to the ALB, passing the trace on to the backend
     """
     try:
         # Extract request details
@@ -55,6 +163,10 @@ async def make_request(event: Dict[str, Any], context: LambdaContext) -> Dict[st
         body = event.get('body', '')
         is_base64_encoded = event.get('isBase64Encoded', False)
 
+        # Binary bodies (file uploads) arrive base64 encoded from API Gateway
+        if is_base64_encoded and body:
+            body = base64.b64decode(body)
+
         # Handle multipart form data
         content_type = headers.get('content-type', '').lower()
         is_multipart = 'multipart/form-data' in content_type
@@ -77,29 +189,31 @@ async def make_request(event: Dict[str, Any], context: LambdaContext) -> Dict[st
             # Prepare headers (exclude specific headers)
             request_headers = {
                 k: v for k, v in headers.items()
-                if k.lower() not in ['host', 'content-length', 'connection']
+                if k.lower() not in ['host', 'content-length', 'connection', 'traceparent']
             }
+            request_headers['traceparent'] = traceparent
+            # httpx would otherwise ask for gzip on behalf of clients that cannot decode it
+            if not any(k.lower() == 'accept-encoding' for k in request_headers):
+                request_headers['Accept-Encoding'] = 'identity'
 
-            # Make the request
-            response = await client.request(
+            # Make the request; the body is read raw so a compressed response stays compressed
+            async with client.stream(
                 method=http_method,
                 url=target_url,
                 headers=request_headers,
                 content=body,
-            )
+            ) as response:
+                raw_body = b''.join([chunk async for chunk in response.aiter_raw()])
 
             # Log response details
             logger.info({
                 'message': 'Response received',
                 'status_code': response.status_code,
-                'response_content_type': response.headers.get('content-type')
+                'response_content_type': response.headers.get('content-type'),
+                'content_encoding': response.headers.get('content-encoding')
             })
 
-            return create_success_response(
-                status_code=response.status_code,
-                body=response.text,
-                content_type=response.headers.get('content-type', 'application/json')
-            )
+            return create_proxy_response(response, raw_body)
 
     except httpx.TimeoutException as e:
         logger.error(f"Request timed out: {str(e)}")
@@ -0,0 +1,112 @@
+import json
+import secrets
+from typing import Dict, Optional, Union
+
+from fastapi import HTTPException, Request
+
+from redis_client import add_key_value_redis, get_value_redis, delete_key_redis, add_to_set_redis, \
+    get_set_members_redis
+from utils.cache import LRUCache
+from utils.logger import log
+
+SESSION_TTL = 60 * 60 * 24 * 30
+# Bounds how long a worker keeps serving credentials another worker replaced or deleted
+CREDENTIALS_CACHE_TTL = 30
+
+# Bounds how long other workers keep accepting a session handle after it was revoked
+SESSION_CACHE_TTL = 60
+
+# handle -> {'provider', 'org_id', 'user_id'}
+_sessions = LRUCache(maxsize=10000, ttl=SESSION_CACHE_TTL)
+# (provider, org_id, user_id) -> credentials dict
+_credentials = LRUCache(maxsize=10000, ttl=CREDENTIALS_CACHE_TTL)
+
+
+async def create_session(provider: str, org_id: str, user_id: str) -> str:
+    """
+    Issue an opaque session handle that resolves server-side to the stored provider credentials
+    """
+    handle = secrets.token_urlsafe(32)
+    session = {'provider': provider, 'org_id': org_id, 'user_id': user_id}
+    await add_key_value_redis(f'session:{handle}', json.dumps(session), expire=SESSION_TTL)
+    await add_to_set_redis(f'{provider}_sessions:{org_id}:{user_id}', handle, expire=SESSION_TTL)
+    _sessions.set(handle, session)
+    return handle
+
+
+async def get_session(handle: str) -> Optional[Dict]:
+    session = _sessions.get(handle)
+    if session is None:
+        stored = await get_value_redis(f'session:{handle}')
+        if not stored:
+            return None
+        session = json.loads(stored)
+        _sessions.set(handle, session)
+    return session
+
+
+def cache_credentials(provider: str, org_id: str, user_id: str, credentials: Dict):
+    """Keep this worker's cached credentials in step after they are stored or refreshed"""
+    _credentials.set((provider, org_id, user_id), credentials)
+
+
+async def get_session_credentials(handle: str, provider: str) -> Dict:
+    """
+    Resolve a session handle to its provider credentials
+    """
+    session = await get_session(handle)
+    if not session or session['provider'] != provider:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+
+    key = (provider, session['org_id'], session['user_id'])
+    credentials = _credentials.get(key)
+    if credentials is None:
+        stored = await get_value_redis(f'{provider}_credentials:{session["org_id"]}:{session["user_id"]}')
+        if not stored:
+            raise HTTPException(status_code=401, detail="No credentials found, please reconnect")
+        credentials = json.loads(stored)
+        _credentials.set(key, credentials)
+    return credentials
+
+
+async def delete_sessions(provider: str, org_id: str, user_id: str):
+    """Revoke every session handle issued to an org/user"""
+    index_key = f'{provider}_sessions:{org_id}:{user_id}'
+    for handle in await get_set_members_redis(index_key):
+        handle = handle.decode() if isinstance(handle, bytes) else handle
+        _sessions.pop(handle)
+        await delete_key_redis(f'session:{handle}')
+    await delete_key_redis(index_key)
+    _credentials.pop((provider, org_id, user_id))
+    log.info(f"Revoked {provider} sessions for user {user_id} in org {org_id}")
+
+
+def session_credentials(provider: str, allow_form: bool = True):
+    """
+    FastAPI dependency resolving the caller's credentials. A session handle sent as
+    `Authorization: Bearer <handle>` skips form parsing entirely; the legacy `credentials`
+    form field (a token blob or {"session": handle}) is still accepted unless allow_form
+    is off, which routes that stream the request body need
+    """
+
+    async def dependency(request: Request) -> Union[str, Dict]:
+        authorization = request.headers.get('authorization', '')
+        if authorization.startswith('Bearer '):
+            return await get_session_credentials(authorization[len('Bearer '):], provider)
+        if not allow_form:
+            raise HTTPException(status_code=401, detail="Missing session")
+
+        form = await request.form()
+        credentials = form.get('credentials')
+        if credentials is None:
+            raise HTTPException(status_code=401, detail="Missing session or credentials")
+        if '"session"' in credentials:
+            try:
+                handle = json.loads(credentials).get('session')
+            except (json.JSONDecodeError, AttributeError):
+                raise HTTPException(status_code=401, detail="Malformed session credentials")
+            if handle:
+                return await get_session_credentials(handle, provider)
+        return credentials
+
+    return dependency
@@ -0,0 +1,42 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from benchmarks.harness import BenchEnvironment
+from integrations import hubspot_changes
+from integrations.hubspot_changes import read_changes, record_changes
+
+
+def test_quiet_consumer_cursor_never_expires(monkeypatch):
+    monkeypatch.setattr(hubspot_changes, 'CHANGELOG_RETENTION', 1)
+
+    async def scenario():
+        async with BenchEnvironment():
+            stale = (await read_changes('org'))['cursor']
+            await record_changes('org', [{'id': '1', 'properties': {'firstname': 'A'}}])
+            page = await read_changes('org', stale)
+            assert [change['id'] for change in page['changes']] == ['1']
+            cursor = page['cursor']
+
+            # Polling a quiet log for longer than the retention keeps moving the cursor
+            for _ in range(6):
+                await asyncio.sleep(0.3)
+                page = await read_changes('org', cursor)
+                assert page['changes'] == []
+                assert page['cursor'] > cursor
+                cursor = page['cursor']
+
+            # The first write after the quiet spell trims the old entry, which this consumer already has
+            await record_changes('org', deletions=['2'])
+            page = await read_changes('org', cursor)
+            assert [(change['op'], change['id']) for change in page['changes']] == [('delete', '2')]
+
+            # A consumer that never saw the trimmed entry has to reload
+            with pytest.raises(HTTPException) as error:
+                await read_changes('org', stale)
+            assert error.value.status_code == 410
+
+            assert [change['id'] for change in (await read_changes('org', '0'))['changes']] == ['2']
+
+    asyncio.run(scenario())
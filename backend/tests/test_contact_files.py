@@ -0,0 +1,54 @@
+import asyncio
+
+from benchmarks.harness import BenchEnvironment
+from benchmarks.scenarios import open_session
+from integrations import hubspot_mirror
+
+
+def test_contact_files_skip_missing_notes(tmp_path, monkeypatch):
+    monkeypatch.setattr(hubspot_mirror, 'MIRROR_DIR', str(tmp_path))
+
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            bench.hubspot.seed_contacts(1)
+            contact_id = next(iter(bench.hubspot.contacts))
+            session = await open_session(bench.client, 'org', 'user')
+            headers = {'Authorization': f'Bearer {session.handle}'}
+            url = f'/integrations/hubspot/contacts/{contact_id}/files'
+
+            response = await bench.client.post(url, headers=headers, files={'file': ('a.pdf', b'%PDF', 'application/pdf')})
+            assert response.status_code == 200
+            file_id = response.json()['id']
+            # A second note on the same attachment, and one deleted since it was associated
+            bench.hubspot.notes['900'] = {'id': '900', 'properties': {'hs_attachment_ids': file_id}}
+            bench.hubspot.contact_notes[contact_id] += ['900', '901']
+
+            response = await bench.client.get(url, headers=headers)
+            assert response.status_code == 200
+            assert [file['id'] for file in response.json()] == [file_id]
+
+    asyncio.run(scenario())
+
+
+def test_truncated_upload_is_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(hubspot_mirror, 'MIRROR_DIR', str(tmp_path))
+
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            bench.hubspot.seed_contacts(1)
+            contact_id = next(iter(bench.hubspot.contacts))
+            session = await open_session(bench.client, 'org', 'user')
+            # The body stops inside the file part, before its closing boundary
+            body = (b'--bench\r\nContent-Disposition: form-data; name="file"; filename="a.pdf"\r\n'
+                    b'Content-Type: application/pdf\r\n\r\n%PDF-1.4 the first half')
+            response = await bench.client.post(
+                f'/integrations/hubspot/contacts/{contact_id}/files',
+                headers={'Authorization': f'Bearer {session.handle}',
+                         'Content-Type': 'multipart/form-data; boundary=bench'},
+                content=body,
+            )
+            assert response.status_code == 400
+            assert not bench.hubspot.files
+            assert not bench.hubspot.notes
+
+    asyncio.run(scenario())
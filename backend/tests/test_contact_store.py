@@ -0,0 +1,34 @@
+import asyncio
+
+from benchmarks.harness import BenchEnvironment
+from integrations import hubspot_contact_store as contact_store
+
+
+def test_recrawl_swaps_in_with_journaled_changes():
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            await contact_store.replace_contacts('1', [
+                {'id': '1', 'properties': {'email': 'a@old.example'}},
+                {'id': '2', 'properties': {'email': 'b@old.example'}},
+            ])
+
+            await contact_store.begin_crawl('1')
+            # Webhooks during the crawl: the previous snapshot keeps serving reads meanwhile
+            await contact_store.apply_contact_changes('1', {'1': {'email': 'a@new.example'}}, ['2'])
+            assert [contact['id'] for contact in await contact_store.get_stored_contacts('1')] == ['1']
+
+            # The crawl read both contacts before those changes
+            await contact_store.replace_contacts('1', [
+                {'id': '1', 'properties': {'email': 'a@old.example'}},
+                {'id': '2', 'properties': {'email': 'b@old.example'}},
+                {'id': '3', 'properties': {'email': 'c@old.example'}},
+            ])
+            await contact_store.end_crawl('1')
+
+            assert await contact_store.get_stored_contacts('1') == [
+                {'id': '1', 'properties': {'email': 'a@new.example'}},
+                {'id': '3', 'properties': {'email': 'c@old.example'}},
+            ]
+            assert sorted(await bench.redis.keys('*')) == [b'hubspot_contacts:1', b'hubspot_contacts_synced:1']
+
+    asyncio.run(scenario())
@@ -0,0 +1,28 @@
+import asyncio
+
+from benchmarks.harness import BenchEnvironment
+from benchmarks.scenarios import open_session
+from integrations import hubspot_mirror
+
+
+def test_background_sync_outlives_request_deadline(tmp_path, monkeypatch):
+    monkeypatch.setattr(hubspot_mirror, 'MIRROR_DIR', str(tmp_path))
+
+    async def scenario():
+        # 2000 contacts at 50ms per page of 100: the crawl takes about a second
+        async with BenchEnvironment(hubspot_latency=0.05) as bench:
+            bench.hubspot.seed_contacts(2000)
+            session = await open_session(bench.client, 'org', 'user')
+            headers = {'Authorization': f'Bearer {session.handle}', 'X-Request-Timeout': '0.3'}
+
+            response = await bench.client.get('/integrations/hubspot/contacts/search', headers=headers)
+            assert response.status_code == 503
+            for _ in range(100):
+                await asyncio.sleep(0.1)
+                response = await bench.client.get('/integrations/hubspot/contacts/search', headers=headers)
+                if response.status_code != 503:
+                    break
+            assert response.status_code == 200
+            assert response.json()['total'] == 2000
+
+    asyncio.run(scenario())
@@ -0,0 +1,33 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from benchmarks.harness import BENCH_ENV, BenchEnvironment
+from redis_client import add_key_value_redis
+
+
+def test_merging_a_detection_job_takes_only_confident_groups(monkeypatch):
+    for name, value in BENCH_ENV.items():
+        monkeypatch.setenv(name, value)
+    # Imported once the environment is set: the module builds its OpenAI client at import
+    from integrations.hubspot_dedupe import resolve_merge_groups
+
+    async def scenario():
+        async with BenchEnvironment():
+            await add_key_value_redis('job:detect', json.dumps(
+                {'id': 'detect', 'type': 'hubspot.dedupe', 'status': 'succeeded', 'org_id': 'org'}))
+            await add_key_value_redis('job_result:detect', json.dumps({'groups': [
+                {'primary': '1', 'duplicates': ['2'], 'confidence': 0.98, 'matched_on': ['email']},
+                {'primary': '3', 'duplicates': ['4'], 'confidence': 0.79, 'matched_on': ['organization']},
+            ]}))
+            credentials = {'org_id': 'org', 'user_id': 'user'}
+
+            assert await resolve_merge_groups(credentials, job_id='detect') == [{'primary': '1', 'duplicates': ['2']}]
+            assert len(await resolve_merge_groups(credentials, job_id='detect', min_confidence=0.7)) == 2
+            with pytest.raises(HTTPException) as error:
+                await resolve_merge_groups(credentials, job_id='detect', min_confidence=2)
+            assert error.value.status_code == 400
+
+    asyncio.run(scenario())
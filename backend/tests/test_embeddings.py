@@ -0,0 +1,37 @@
+import asyncio
+
+import jobs
+from benchmarks.harness import BENCH_ENV, BenchEnvironment
+from benchmarks.scenarios import open_session
+from integrations import hubspot_mirror
+
+
+def test_similar_builds_this_hosts_index_without_the_job_queue(tmp_path, monkeypatch):
+    for name, value in BENCH_ENV.items():
+        monkeypatch.setenv(name, value)
+    # Imported once the environment is set: the module builds its OpenAI client at import
+    from integrations import hubspot_embeddings
+
+    monkeypatch.setattr(hubspot_mirror, 'MIRROR_DIR', str(tmp_path / 'mirror'))
+    monkeypatch.setattr(hubspot_embeddings, 'EMBEDDINGS_DIR', str(tmp_path / 'embeddings'))
+
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            # A job queued now would only run on some other container
+            await jobs.stop_workers()
+            bench.hubspot.seed_contacts(50)
+            contact_id = next(iter(bench.hubspot.contacts))
+            session = await open_session(bench.client, 'org', 'user')
+            url = f'/integrations/hubspot/contacts/{contact_id}/similar'
+
+            response = await bench.client.get(url, headers={'Authorization': f'Bearer {session.handle}'})
+            assert response.status_code == 503
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                response = await bench.client.get(url, headers={'Authorization': f'Bearer {session.handle}'})
+                if response.status_code != 503:
+                    break
+            assert response.status_code == 200
+            assert len(response.json()['results']) == 10
+
+    asyncio.run(scenario())
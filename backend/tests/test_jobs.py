@@ -0,0 +1,75 @@
+import asyncio
+
+import jobs
+import redis_client
+from benchmarks.harness import BenchEnvironment
+
+attempts = []
+
+
+@jobs.job('test.interruptible')
+async def interruptible_job(ctx: jobs.JobContext, value: str):
+    attempts.append(value)
+    if len(attempts) == 1:
+        # First worker is stopped while this runs
+        await asyncio.sleep(60)
+    return {'value': value}
+
+
+async def wait_for_status(job_id: str, statuses, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        record = await jobs.get_job(job_id)
+        if record['status'] in statuses or asyncio.get_running_loop().time() > deadline:
+            return record
+        await asyncio.sleep(0.02)
+
+
+def test_interrupted_job_is_rerun_to_completion():
+    attempts.clear()
+
+    async def scenario():
+        async with BenchEnvironment():
+            record = await jobs.enqueue_job('test.interruptible', {'value': 'x'})
+            await wait_for_status(record['id'], (jobs.RUNNING,))
+            while not attempts:
+                await asyncio.sleep(0.01)
+
+            # Worker shutdown (e.g. a deploy) rather than a user cancel
+            await jobs.stop_workers()
+            assert (await jobs.get_job(record['id']))['status'] == jobs.QUEUED
+
+            jobs.start_workers(1)
+            finished = await wait_for_status(record['id'], jobs.FINISHED_STATUSES)
+            assert finished['status'] == jobs.SUCCEEDED
+            assert await jobs.get_job_result(record['id']) == {'value': 'x'}
+            assert attempts == ['x', 'x']
+
+    asyncio.run(scenario())
+
+
+@jobs.job('test.echo')
+async def echo_job(ctx: jobs.JobContext, value: str):
+    return {'value': value}
+
+
+def test_job_of_a_crashed_worker_is_rerun(monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_INTERVAL', 0.05)
+
+    async def scenario():
+        async with BenchEnvironment():
+            await jobs.stop_workers()
+            # A worker in another process took the job and was killed before finishing it: its
+            # processing list still holds the job and its heartbeat has lapsed
+            record = await jobs.enqueue_job('test.echo', {'value': 'y'})
+            assert await redis_client.move_blocking_redis(jobs.QUEUE_KEY, 'jobs:processing:dead', 1)
+            await redis_client.add_to_set_redis(jobs.WORKERS_KEY, 'dead')
+            await jobs._update_job(record['id'], status=jobs.RUNNING, started_at=0)
+
+            jobs.start_workers(1)
+            finished = await wait_for_status(record['id'], jobs.FINISHED_STATUSES)
+            assert finished['status'] == jobs.SUCCEEDED
+            assert await jobs.get_job_result(record['id']) == {'value': 'y'}
+            assert b'dead' not in await redis_client.get_set_members_redis(jobs.WORKERS_KEY)
+
+    asyncio.run(scenario())
@@ -0,0 +1,31 @@
+import asyncio
+
+from benchmarks.harness import BENCH_ENV, BenchEnvironment
+from benchmarks.scenarios import open_session
+from integrations import hubspot_mirror
+from sessions import get_session_credentials
+
+
+def test_incremental_sync_pages_past_a_shared_timestamp(tmp_path, monkeypatch):
+    for name, value in BENCH_ENV.items():
+        monkeypatch.setenv(name, value)
+    # Imported once the environment is set: the module builds its OpenAI client at import
+    from integrations import hubspot
+
+    monkeypatch.setattr(hubspot_mirror, 'MIRROR_DIR', str(tmp_path))
+    # Every seeded contact shares one lastmodifieddate, like a bulk import larger than the search cap
+    monkeypatch.setattr(hubspot, 'SEARCH_RESULT_LIMIT', 300)
+
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            bench.hubspot.seed_contacts(1000)
+            session = await open_session(bench.client, 'org', 'user')
+            creds = await hubspot.resolve_hubspot_credentials(await get_session_credentials(session.handle, 'hubspot'))
+            portal_id = str(bench.hubspot.portal_id)
+            await hubspot_mirror.apply_changes(portal_id, [], watermark='1')
+
+            await asyncio.wait_for(hubspot._sync_mirror(creds, portal_id, False), timeout=30)
+            total, _ = await hubspot_mirror.query_contacts(portal_id, limit=1)
+            assert total == 1000
+
+    asyncio.run(scenario())
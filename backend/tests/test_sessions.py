@@ -0,0 +1,14 @@
+import asyncio
+
+from benchmarks.harness import BenchEnvironment
+from benchmarks.scenarios import form
+
+
+def test_malformed_session_credentials_are_rejected():
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            for credentials in ('{"session": ', '["session"]'):
+                response = await bench.client.post('/integrations/hubspot/load', files=form(credentials=credentials))
+                assert response.status_code == 401
+
+    asyncio.run(scenario())
@@ -0,0 +1,37 @@
+import asyncio
+
+from benchmarks.harness import BenchEnvironment
+from benchmarks.scenarios import open_session
+from integrations import hubspot_mirror
+
+
+def test_concurrent_orgs_never_share_a_completion(tmp_path, monkeypatch):
+    monkeypatch.setattr(hubspot_mirror, 'MIRROR_DIR', str(tmp_path))
+
+    async def scenario():
+        async with BenchEnvironment() as bench:
+            bench.hubspot.seed_contacts(8)
+            contact_ids = list(bench.hubspot.contacts)
+            sessions = [await open_session(bench.client, org_id, 'user') for org_id in ('org-a', 'org-b')]
+            # Each org summarizes its own half of the contacts, all at once
+            requests = [
+                (contact_id, sessions[index % 2]) for index, contact_id in enumerate(contact_ids)
+            ]
+            responses = await asyncio.gather(*(
+                bench.client.post(f'/integrations/hubspot/contacts/{contact_id}/summarize', **session.request())
+                for contact_id, session in requests
+            ))
+            assert [response.status_code for response in responses] == [200] * len(requests)
+
+            names = [
+                {contact['properties']['firstname'] for index, contact in enumerate(bench.hubspot.contacts.values())
+                 if index % 2 == org}
+                for org in (0, 1)
+            ]
+            for prompt in bench.openai.prompts:
+                orgs = [org for org in (0, 1) if any(f'{name} ' in prompt for name in names[org])]
+                assert len(orgs) == 1, prompt
+            # Still batched within each org
+            assert len(bench.openai.prompts) < len(requests)
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import time
+from typing import Optional
+
+from utils.logger import log
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast once a dependency has failed `failure_threshold` times in a row. After
+    `reset_timeout` seconds one trial call is let through (half-open): success closes the breaker,
+    failure opens it for another `reset_timeout`
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 10.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # When the half-open trial started; a trial that never reports back is retried after reset_timeout
+        self._trial_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self) -> bool:
+        """Whether a call may go through now"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == OPEN:
+            return False
+        now = time.monotonic()
+        if self._trial_at is None or now - self._trial_at >= self.reset_timeout:
+            self._trial_at = now
+            return True
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            log.info(f"Circuit {self.name} closed")
+        self.failures = 0
+        self.opened_at = None
+        self._trial_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_at is not None or (self.opened_at is None and self.failures >= self.failure_threshold):
+            if self.opened_at is None:
+                log.warn(f"Circuit {self.name} opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+            self._trial_at = None
+
+    def to_dict(self) -> dict:
+        return {'state': self.state, 'consecutive_failures': self.failures}
@@ -0,0 +1,127 @@
+"""
+Per-request deadlines, propagated from the incoming request down to every upstream call.
+
+DeadlineMiddleware starts the clock for each request (REQUEST_DEADLINE seconds, or less if the
+client sends X-Request-Timeout). Upstream calls made through async_client() are cut off when it
+runs out and their httpx timeouts are capped to what is left, so a stalled upstream answers the
+caller with 504 instead of holding the request past the point anyone is still waiting for it.
+Job workers run without a deadline.
+"""
+import asyncio
+import os
+import re
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+from fastapi import HTTPException
+
+# Matches the default idle timeout of the load balancer in front of the API
+REQUEST_DEADLINE = float(os.environ.get('REQUEST_DEADLINE', 60))
+DEADLINE_HEADER = b'x-request-timeout'
+
+# Monotonic time by which the current request must be answered; None outside requests
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+T = TypeVar('T')
+
+
+class DeadlineExceeded(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=504, detail="Request deadline exceeded")
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current deadline, or None when there is none"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def set_deadline(seconds: Optional[float]):
+    """Tighten the current deadline to `seconds` from now; None clears it (streaming routes)"""
+    deadline = None if seconds is None else time.monotonic() + seconds
+    current = _deadline.get()
+    if deadline is not None and current is not None:
+        deadline = min(deadline, current)
+    _deadline.set(deadline)
+
+
+async def within_deadline(awaitable: Awaitable[T]) -> T:
+    """Await with the time left on the current deadline, raising DeadlineExceeded when it runs out"""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded()
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded()
+
+
+async def _without_deadline(awaitable: Awaitable[T]) -> T:
+    # Runs in the task's own copy of the context, so the caller keeps its deadline
+    _deadline.set(None)
+    return await awaitable
+
+
+def detached_task(awaitable: Awaitable[T]) -> 'asyncio.Task[T]':
+    """
+    Task for work that outlives the request starting it or is shared with other callers (syncs,
+    single flights, token refreshes): it runs without the request's deadline, which would
+    otherwise be copied into it and cut it off after the request has returned
+    """
+    return asyncio.create_task(_without_deadline(awaitable))
+
+
+class DeadlineMiddleware:
+    """ASGI middleware starting each request's deadline. Paths matching `exempt` run without one"""
+
+    def __init__(self, app, exempt: Optional[re.Pattern] = None):
+        self.app = app
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or (self.exempt is not None and self.exempt.search(scope['path'])):
+            return await self.app(scope, receive, send)
+
+        seconds = REQUEST_DEADLINE
+        for name, value in scope['headers']:
+            if name == DEADLINE_HEADER:
+                try:
+                    seconds = min(seconds, max(float(value), 0.0))
+                except ValueError:
+                    pass
+                break
+        token = _deadline.set(time.monotonic() + seconds)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+
+class DeadlineTransport(httpx.AsyncBaseTransport):
+    """Caps each upstream request's timeouts, and its total time, to the current deadline"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        left = remaining()
+        if left is None:
+            return await self._transport.handle_async_request(request)
+        if left <= 0:
+            raise DeadlineExceeded()
+        timeouts = request.extensions.get('timeout')
+        if timeouts:
+            request.extensions['timeout'] = {
+                name: left if value is None else min(value, left) for name, value in timeouts.items()
+            }
+        # Covers waiting for a concurrency slot too; the body is read under the capped read timeout
+        return await within_deadline(self._transport.handle_async_request(request))
+
+    async def aclose(self):
+        await self._transport.aclose()
@@ -0,0 +1,115 @@
+"""
+Hedged requests for idempotent upstream reads.
+
+If a read has not answered by the recent p95 latency of its kind, a second identical request is
+sent and whichever answers first wins; the other is cancelled. Only the slowest ~5% of calls are
+candidates, and a token budget caps hedges at HEDGE_BUDGET of calls, so upstream volume rises by
+a few percent at most while the stalls that make up the tail are cut short.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from utils.deadline import remaining
+
+HEDGING_ENABLED = os.environ.get('HEDGE_READS', 'true').lower() in ('1', 'true', 'yes')
+# Extra requests allowed, as a share of hedgeable calls
+HEDGE_BUDGET = float(os.environ.get('HEDGE_BUDGET', 0.05))
+# Unused budget carries over up to this many hedges, for short bursts of stalls
+HEDGE_BURST = 10.0
+HEDGE_QUANTILE = 0.95
+# No hedging until the latency distribution is known
+MIN_SAMPLES = 50
+WINDOW = 1000
+# The quantile is recomputed after this many new samples
+REFRESH_EVERY = 25
+
+T = TypeVar('T')
+
+# name -> policy, for the health check
+_policies: Dict[str, 'HedgePolicy'] = {}
+
+
+class HedgePolicy:
+    """Hedge delay and budget for one kind of read, learned from its own latencies"""
+
+    def __init__(self, name: str, budget: float = HEDGE_BUDGET, quantile: float = HEDGE_QUANTILE):
+        self.name = name
+        self.budget = budget
+        self.quantile = quantile
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._tokens = 0.0
+        self._samples: Deque[float] = deque(maxlen=WINDOW)
+        self._delay: Optional[float] = None
+        self._new_samples = 0
+        _policies[name] = self
+
+    def delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None while there are too few samples"""
+        if len(self._samples) < MIN_SAMPLES:
+            return None
+        if self._delay is None or self._new_samples >= REFRESH_EVERY:
+            ordered = sorted(self._samples)
+            self._delay = ordered[int(self.quantile * (len(ordered) - 1))]
+            self._new_samples = 0
+        return self._delay
+
+    def _record(self, latency: float):
+        self._samples.append(latency)
+        self._new_samples += 1
+
+    def _take_token(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """Await `call()`, hedging with a second `call()` if the first is slow"""
+        self.calls += 1
+        self._tokens = min(self._tokens + self.budget, HEDGE_BURST)
+        delay = self.delay() if HEDGING_ENABLED else None
+        started = time.monotonic()
+        attempts = [asyncio.ensure_future(call())]
+        try:
+            if delay is None:
+                return await attempts[0]
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            left = remaining()
+            # A hedge that cannot answer before the deadline only adds load
+            if not done and (left is None or left > delay) and self._take_token():
+                self.hedges += 1
+                attempts.append(asyncio.ensure_future(call()))
+
+            pending = set(attempts)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                succeeded = [task for task in done if task.exception() is None]
+                if succeeded or not pending:
+                    # A failed attempt only wins if the other one has failed too
+                    winner = (succeeded or list(done))[0]
+                    if winner is not attempts[0]:
+                        self.hedge_wins += 1
+                    return winner.result()
+        finally:
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+            # The primary's latency, cut short when a hedge beat it: a lower bound that keeps the p95 honest
+            self._record(time.monotonic() - started)
+
+    def to_dict(self) -> Dict:
+        return {
+            'calls': self.calls,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'delay_ms': round(self._delay * 1000, 1) if self._delay is not None else None,
+        }
+
+
+def hedging_stats() -> Dict[str, Dict]:
+    return {name: policy.to_dict() for name, policy in _policies.items()}
@@ -0,0 +1,69 @@
+"""
+Per-process lifecycle for serving with several workers (gunicorn or uvicorn --workers).
+
+Module-level state is one of:
+- configuration and pure caches, which a forked worker may inherit as they are;
+- live resources (connection pools, API clients, asyncio tasks), which belong to the process
+  and event loop that created them and must never be used from a forked child.
+
+Modules holding live resources register an `after_fork` hook that replaces or drops them, so a
+worker forked from a preloaded master starts clean. Async setup and teardown that needs the
+worker's event loop goes in `on_worker_start` / `on_worker_stop`, run from the app lifespan.
+"""
+import os
+from typing import Awaitable, Callable, List
+
+from utils.logger import log
+
+_after_fork: List[Callable[[], None]] = []
+_on_start: List[Callable[[], Awaitable]] = []
+_on_stop: List[Callable[[], Awaitable]] = []
+
+
+def after_fork(hook: Callable[[], None]) -> Callable[[], None]:
+    """Run `hook` in every child process right after a fork"""
+    _after_fork.append(hook)
+    return hook
+
+
+def on_worker_start(hook: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    """Await `hook` when a worker's event loop starts serving"""
+    _on_start.append(hook)
+    return hook
+
+
+def on_worker_stop(hook: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+    """Await `hook` when a worker shuts down; hooks run in reverse registration order"""
+    _on_stop.append(hook)
+    return hook
+
+
+def _run_after_fork():
+    for hook in _after_fork:
+        try:
+            hook()
+        except Exception as e:
+            log.error(f"After-fork hook {hook.__qualname__} failed: {str(e)}")
+
+
+os.register_at_fork(after_in_child=_run_after_fork)
+
+
+async def start_worker():
+    for hook in _on_start:
+        await hook()
+    log.info(f"Worker {os.getpid()} started")
+
+
+async def stop_worker():
+    # Keep shutting down the rest even if one hook fails, so pools are still closed
+    for hook in reversed(_on_stop):
+        try:
+            await hook()
+        except Exception as e:
+            log.error(f"Worker stop hook {hook.__qualname__} failed: {str(e)}")
+
+
+def worker_count() -> int:
+    """Web workers per container, from WEB_CONCURRENCY (defaults to one per core)"""
+    return max(int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1), 1)
@@ -0,0 +1,215 @@
+"""
+Adaptive per-upstream concurrency limits with load shedding.
+
+Each upstream (HubSpot, Notion, Airtable, OpenAI) gets an AIMD limit on calls in flight from this
+worker: it grows by about one slot per round of successful calls and shrinks multiplicatively when
+the upstream signals overload (429/503/504, timeouts, or latency well above its usual). Callers
+over the limit wait in a short bounded queue; once that is full, or the wait runs out, they are
+shed with 503 and Retry-After instead of piling up until everything times out.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Optional, Tuple, Type
+
+import httpx
+from fastapi import HTTPException
+
+from utils.lifecycle import after_fork
+from utils.logger import log
+
+INITIAL_LIMIT = int(os.environ.get('UPSTREAM_CONCURRENCY_INITIAL', 20))
+MIN_LIMIT = int(os.environ.get('UPSTREAM_CONCURRENCY_MIN', 2))
+MAX_LIMIT = int(os.environ.get('UPSTREAM_CONCURRENCY_MAX', 200))
+# Callers allowed to wait for a slot, and for how long, before they are shed
+MAX_QUEUE = int(os.environ.get('UPSTREAM_QUEUE_LIMIT', 100))
+MAX_WAIT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 2.0))
+RETRY_AFTER = int(os.environ.get('UPSTREAM_RETRY_AFTER', 2))
+# Multiplicative decrease on overload
+BACKOFF = 0.75
+# A call this many times slower than the best recent one counts as a congestion signal
+LATENCY_TOLERANCE = 2.5
+# ...unless it is still this fast (seconds); sub-50ms jitter is noise, not congestion
+LATENCY_FLOOR = 0.05
+# The latency baseline drifts up this much per call, so a permanently slower upstream becomes the norm
+BASELINE_DRIFT = 1.002
+
+OVERLOAD_STATUSES = (429, 502, 503, 504)
+
+# Off for job workers: background work waits for capacity instead of being shed
+shed_when_busy: ContextVar[bool] = ContextVar('shed_when_busy', default=True)
+
+
+class Overloaded(HTTPException):
+    def __init__(self, upstream: str):
+        super().__init__(
+            status_code=503,
+            detail=f"{upstream} is busy, please retry shortly",
+            headers={'Retry-After': str(RETRY_AFTER)},
+        )
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for one upstream, with a bounded wait queue"""
+
+    def __init__(self, name: str, initial: int = INITIAL_LIMIT, min_limit: int = MIN_LIMIT,
+                 max_limit: int = MAX_LIMIT, max_queue: int = MAX_QUEUE, max_wait: float = MAX_WAIT):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.shed = 0
+        self.baseline: Optional[float] = None
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+
+    async def acquire(self):
+        """Take a slot, waiting briefly if none is free. Raises Overloaded when shed"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        background = not shed_when_busy.get()
+        if not background and len(self._waiters) >= self.max_queue:
+            self._shed()
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(future, None if background else self.max_wait)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Handed a slot just as we gave up on it; pass it on
+                self._release()
+            else:
+                future.cancel()
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self._shed()
+            raise
+
+    def release(self, latency: float, overloaded: Optional[bool]):
+        """Free a slot and adapt the limit; overloaded None means the call says nothing about load"""
+        if overloaded is not None:
+            self._adapt(latency, overloaded)
+        self._release()
+
+    @asynccontextmanager
+    async def slot(self, overload_errors: Tuple[Type[BaseException], ...] = ()):
+        """Hold a slot around a call; exceptions in overload_errors count as overload signals"""
+        await self.acquire()
+        started = time.monotonic()
+        overloaded = None
+        try:
+            yield
+            overloaded = False
+        except overload_errors:
+            overloaded = True
+            raise
+        finally:
+            self.release(time.monotonic() - started, overloaded)
+
+    def _shed(self):
+        self.shed += 1
+        raise Overloaded(self.name)
+
+    def _release(self):
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _adapt(self, latency: float, overloaded: bool):
+        self.baseline = latency if self.baseline is None else min(latency, self.baseline * BASELINE_DRIFT)
+        congested = latency > max(self.baseline * LATENCY_TOLERANCE, LATENCY_FLOOR)
+        if overloaded or congested:
+            now = time.monotonic()
+            # At most one decrease per round trip, so one burst of failures does not collapse the limit
+            if now - self._last_decrease >= latency:
+                self._last_decrease = now
+                previous = int(self.limit)
+                self.limit = max(self.min_limit, self.limit * BACKOFF)
+                if int(self.limit) < previous:
+                    log.warn(f"{self.name} concurrency limit lowered to {int(self.limit)}")
+        elif self.in_flight >= self.limit / 2:
+            # Grow only while the limit is actually in use, not while traffic is light
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def to_dict(self) -> Dict:
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'shed': self.shed,
+        }
+
+
+# upstream name -> limiter, and API host -> upstream name
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_hosts: Dict[str, str] = {}
+
+
+@after_fork
+def _reset_after_fork():
+    # Slots and waiters belong to the parent's event loop; limits start over in each worker
+    for name in list(_limiters):
+        _limiters[name] = AdaptiveLimiter(name)
+
+
+def get_limiter(upstream: str) -> AdaptiveLimiter:
+    limiter = _limiters.get(upstream)
+    if limiter is None:
+        limiter = _limiters[upstream] = AdaptiveLimiter(upstream)
+    return limiter
+
+
+def register_upstream(upstream: str, *hosts: Optional[str]):
+    """Limit calls made through async_client() to these hosts under the upstream's limiter"""
+    for host in hosts:
+        if host:
+            _hosts[host] = upstream
+    get_limiter(upstream)
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    return {name: limiter.to_dict() for name, limiter in _limiters.items()}
+
+
+class LimitedTransport(httpx.AsyncBaseTransport):
+    """Runs requests to registered upstream hosts through their adaptive limiter"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        upstream = _hosts.get(request.url.host)
+        if upstream is None:
+            return await self._transport.handle_async_request(request)
+
+        limiter = get_limiter(upstream)
+        await limiter.acquire()
+        started = time.monotonic()
+        overloaded = None
+        try:
+            response = await self._transport.handle_async_request(request)
+            overloaded = response.status_code in OVERLOAD_STATUSES
+            return response
+        except (httpx.TimeoutException, httpx.NetworkError):
+            overloaded = True
+            raise
+        finally:
+            # Measured to the response headers; bodies are read after the slot is freed
+            limiter.release(time.monotonic() - started, overloaded)
+
+    async def aclose(self):
+        await self._transport.aclose()
@@ -0,0 +1,111 @@
+from collections import deque
+from typing import AsyncIterator, Optional
+
+from fastapi import Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:  # python-multipart < 0.0.13
+    import multipart
+    from multipart.multipart import parse_options_header
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class MultipartFileStream:
+    """
+    Parse a multipart/form-data request body incrementally and expose one file field as an
+    async stream of chunks, so uploads can be forwarded without buffering the file
+    """
+
+    def __init__(self, request: Request, field_name: str = 'file', max_size: Optional[int] = None):
+        content_type, params = parse_options_header(request.headers.get('content-type', ''))
+        if content_type != b'multipart/form-data' or b'boundary' not in params:
+            raise ValueError("Expected a multipart/form-data upload")
+
+        self.field_name = field_name
+        self.max_size = max_size
+        self.filename: Optional[str] = None
+        self.content_type: Optional[str] = None
+        self.size = 0
+
+        self._source = request.stream().__aiter__()
+        self._pending = deque()
+        self._in_file = False
+        self._file_done = False
+        self._headers = {}
+        self._header_field = b''
+        self._header_value = b''
+        self._parser = multipart.MultipartParser(params[b'boundary'], {
+            'on_part_begin': self._on_part_begin,
+            'on_header_field': self._on_header_field,
+            'on_header_value': self._on_header_value,
+            'on_header_end': self._on_header_end,
+            'on_headers_finished': self._on_headers_finished,
+            'on_part_data': self._on_part_data,
+            'on_part_end': self._on_part_end,
+        })
+
+    def _on_part_begin(self):
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self):
+        _, disposition = parse_options_header(self._headers.get(b'content-disposition', b''))
+        if self.filename is None and disposition.get(b'name', b'').decode() == self.field_name \
+                and b'filename' in disposition:
+            self._in_file = True
+            self.filename = disposition[b'filename'].decode('utf-8', errors='replace')
+            self.content_type = self._headers.get(b'content-type', b'application/octet-stream').decode()
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._in_file:
+            self._pending.append(data[start:end])
+
+    def _on_part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self._file_done = True
+
+    async def _feed(self) -> bool:
+        try:
+            chunk = await self._source.__anext__()
+        except StopAsyncIteration:
+            return False
+        if chunk:
+            self._parser.write(chunk)
+        return True
+
+    async def open(self):
+        """Read until the file part's headers are parsed, so its name can be checked before streaming"""
+        while self.filename is None:
+            if not await self._feed():
+                raise ValueError(f"No '{self.field_name}' file in upload")
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield the file content as it arrives, enforcing max_size"""
+        while True:
+            while self._pending:
+                data = self._pending.popleft()
+                self.size += len(data)
+                if self.max_size is not None and self.size > self.max_size:
+                    raise UploadTooLarge(f"File exceeds {self.max_size} bytes")
+                yield data
+            if self._file_done:
+                break
+            if not await self._feed():
+                # The body ended inside the file part: never pass a truncated file on as complete
+                raise ValueError("Upload ended before the end of the file")
@@ -0,0 +1,118 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+SORTABLE_FIELDS = (
+    'id', 'name', 'type', 'parent_path_or_name', 'company', 'email', 'creation_time', 'last_modified_time'
+)
+
+
+def _normalize(value: Any) -> str:
+    """Comparable text for a field value: numeric ids in numeric order, text case-insensitively"""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    value = str(value)
+    return value.zfill(20) if value.isdigit() else value.casefold()
+
+
+def _sort_key(item: Any, sort: str) -> List:
+    # Missing values go last; id breaks ties so every item has a distinct position
+    value = getattr(item, sort, None)
+    return [value is None, _normalize(value), _normalize(getattr(item, 'id', None))]
+
+
+def _encode_cursor(state: Dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def _valid_cursor(state: Any) -> bool:
+    # Cursors are opaque to clients but not tamper-proof; accept only what we would have issued
+    if not isinstance(state, dict):
+        return False
+    if not isinstance(state.get('offset', 0), int) or not isinstance(state.get('size', 0), int):
+        return False
+    after = state.get('after')
+    return after is None or (
+        isinstance(after, list) and len(after) == 3 and isinstance(after[0], bool)
+        and all(isinstance(part, str) for part in after[1:])
+    )
+
+
+def _decode_cursor(cursor: str) -> Dict:
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        state = None
+    if not _valid_cursor(state):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return state
+
+
+def _resolve_order(cursor_state: Optional[Dict], sort: Optional[str],
+                   order: Optional[str]) -> Tuple[Optional[str], str]:
+    if cursor_state is not None:
+        # A cursor continues the listing it came from
+        if (sort is not None and sort != cursor_state.get('sort')) or \
+                (order is not None and order != cursor_state.get('order')):
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+        sort, order = cursor_state.get('sort'), cursor_state.get('order', 'asc')
+    if sort is not None and sort not in SORTABLE_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort: {sort}")
+    order = order or 'asc'
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail=f"Unsupported order: {order}")
+    return sort, order
+
+
+def paginate_items(items: List[Any], cursor: Optional[str] = None, page_size: Optional[int] = None,
+                   sort: Optional[str] = None, order: Optional[str] = None) -> Union[List[Any], Dict]:
+    """
+    One window of a load result, as {'items', 'total', 'next_cursor'}. Without a sort the source
+    order is kept; with one, the cursor records the last item's sort key so the next page starts
+    after it even if items were added or removed in between. Returns the items unchanged when
+    no paging parameter is given, for clients that expect the whole list
+    """
+    if cursor is None and page_size is None and sort is None and order is None:
+        return items
+
+    cursor_state = _decode_cursor(cursor) if cursor else None
+    sort, order = _resolve_order(cursor_state, sort, order)
+    if page_size is None and cursor_state:
+        page_size = cursor_state.get('size')
+    page_size = min(max(page_size or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    descending = order == 'desc'
+
+    if sort is None:
+        ordered = list(reversed(items)) if descending else items
+        start = max(cursor_state.get('offset', 0), 0) if cursor_state else 0
+        window = ordered[start:start + page_size]
+        next_state = {'sort': None, 'order': order, 'size': page_size, 'offset': start + page_size}
+    else:
+        keyed = sorted(((_sort_key(item, sort), item) for item in items), key=lambda entry: entry[0],
+                       reverse=descending)
+        start = 0
+        if cursor_state and cursor_state.get('after') is not None:
+            after = cursor_state['after']
+            start = next(
+                (index for index, (key, _) in enumerate(keyed) if (key < after if descending else key > after)),
+                len(keyed)
+            )
+        window = [item for _, item in keyed[start:start + page_size]]
+        next_state = {
+            'sort': sort, 'order': order, 'size': page_size,
+            'after': keyed[start + len(window) - 1][0] if window else None,
+        }
+
+    has_more = start + page_size < len(items)
+    return {
+        'items': window,
+        'total': len(items),
+        'next_cursor': _encode_cursor(next_state) if has_more else None,
+    }
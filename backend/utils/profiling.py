@@ -0,0 +1,290 @@
+"""
+On-demand profiling of a live worker.
+
+A capture runs for a fixed number of seconds and collects, as folded stacks ("frame;frame;frame
+count" lines that flamegraph.pl, speedscope and inferno read directly):
+
+- cpu: a sampling profile of every thread, taken from a background thread with sys._current_frames();
+- tasks: what each asyncio task is awaiting, sampled on the event loop (where request time goes
+  while nothing is on the CPU: HubSpot, Redis, OpenAI round trips);
+- memory: the tracemalloc diff between the start and the end of the capture, weighted in bytes.
+
+Nothing runs between captures, so leaving it enabled costs nothing while idle. Captures are
+started by GET /admin/profile (needs ADMIN_TOKEN) or by sending PROFILE_SIGNAL to a worker pid,
+which writes the profiles to PROFILE_DIR.
+"""
+import asyncio
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from utils.lifecycle import on_worker_start, on_worker_stop
+from utils.logger import log
+
+# Unset disables the endpoint altogether
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+# Capture started by the signal, written to PROFILE_DIR; empty PROFILE_SIGNAL disables the handler
+PROFILE_SIGNAL = os.environ.get('PROFILE_SIGNAL', 'SIGUSR2')
+PROFILE_SIGNAL_SECONDS = float(os.environ.get('PROFILE_SIGNAL_SECONDS', 10))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp')
+# ~200 samples/s; an odd interval avoids sampling in lockstep with periodic work
+CPU_SAMPLE_INTERVAL = 0.0047
+TASK_SAMPLE_INTERVAL = 0.05
+# Deeper tracebacks cost more per allocation while a memory capture runs
+TRACEMALLOC_FRAMES = int(os.environ.get('PROFILE_TRACEMALLOC_FRAMES', 16))
+# Share of each profile spent in these integrations, through our module or the client library it uses.
+# Stacks are cut at task boundaries (wait_for, hedges, single-flight), so library frames matter here
+FOCUS = {
+    'hubspot': ('integrations/hubspot',),
+    # Upstream HTTP (HubSpot, Notion, Airtable) below the integrations
+    'http': ('http_client.py', 'httpx/', 'httpcore/'),
+    'redis': ('redis_client.py', 'redis/'),
+    'openai': ('openai_client.py', 'openai/'),
+}
+
+KINDS = ('cpu', 'tasks', 'memory')
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+_STDLIB_DIR = os.path.dirname(os.__file__) + os.sep
+_SITE_PACKAGES = os.sep + 'site-packages' + os.sep
+
+# One capture per worker at a time: overlapping ones would profile each other
+_capture_lock = asyncio.Lock()
+
+
+def _short_path(filename: str) -> str:
+    """Path relative to the backend, the installed packages or the standard library"""
+    if filename.startswith(_BACKEND_DIR):
+        return filename[len(_BACKEND_DIR):]
+    if _SITE_PACKAGES in filename:
+        return filename.rsplit(_SITE_PACKAGES, 1)[1]
+    if filename.startswith(_STDLIB_DIR):
+        return filename[len(_STDLIB_DIR):]
+    return filename
+
+
+def _frame_label(code) -> str:
+    # Keyed on the function's first line, so samples anywhere in a function merge into one frame
+    return f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _frame_stack(frame) -> List[str]:
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_stack(coro) -> List[str]:
+    """Frames of a suspended coroutine and everything it is awaiting, outermost first"""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'ag_frame', None) or getattr(coro, 'gi_frame', None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame.f_code))
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'ag_await', None) or getattr(coro, 'gi_yieldfrom', None)
+    if coro is not None:
+        # Bottoms out in a future (sleep, socket read, lock...)
+        stack.append(type(coro).__name__)
+    return stack
+
+
+def folded(stacks: Counter) -> str:
+    """Counter of stack tuples as folded-stack text, heaviest first"""
+    return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common() if count > 0)
+
+
+class _CpuSampler(threading.Thread):
+    """Samples the stacks of every other thread until stopped"""
+
+    def __init__(self):
+        super().__init__(name='profiler', daemon=True)
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop_event.wait(CPU_SAMPLE_INTERVAL):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                self.stacks[(names.get(ident, str(ident)), *_frame_stack(frame))] += 1
+            self.samples += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+async def _sample_tasks(seconds: float) -> Counter:
+    stacks: Counter = Counter()
+    current = asyncio.current_task()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for task in asyncio.all_tasks():
+            if task is not current and not task.done():
+                stacks[tuple(_await_stack(task.get_coro()))] += 1
+        await asyncio.sleep(TASK_SAMPLE_INTERVAL)
+    return stacks
+
+
+def _memory_stacks(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> Counter:
+    """Bytes allocated and still live since `before`, per allocating traceback"""
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'traceback')
+    stacks: Counter = Counter()
+    for stat in stats:
+        if stat.size_diff > 0:
+            # tracemalloc keeps no function names; file and line locate the allocation
+            stacks[tuple(f'{_short_path(frame.filename)}:{frame.lineno}' for frame in stat.traceback)] += stat.size_diff
+    return stacks
+
+
+def _focus_summary(stacks: Counter) -> Dict[str, int]:
+    """Inclusive weight of the stacks passing through each FOCUS integration"""
+    summary = {}
+    for name, prefixes in FOCUS.items():
+        markers = tuple(f'({prefix}' for prefix in prefixes)
+        summary[name] = sum(
+            count for stack, count in stacks.items() if any(marker in frame for frame in stack for marker in markers)
+        )
+    return summary
+
+
+async def capture(seconds: float, kinds: Iterable[str] = KINDS) -> Dict:
+    """Profile this worker for `seconds`; returns folded stacks per kind plus a summary"""
+    kinds = set(kinds)
+    if _capture_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already being captured")
+    async with _capture_lock:
+        started_tracing = False
+        before = None
+        if 'memory' in kinds:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                started_tracing = True
+            before = await asyncio.to_thread(tracemalloc.take_snapshot)
+        sampler = _CpuSampler() if 'cpu' in kinds else None
+        if sampler:
+            sampler.start()
+        try:
+            if 'tasks' in kinds:
+                tasks = await _sample_tasks(seconds)
+            else:
+                await asyncio.sleep(seconds)
+        finally:
+            cpu = sampler.stop() if sampler else None
+            if before is not None:
+                after = await asyncio.to_thread(tracemalloc.take_snapshot)
+                if started_tracing:
+                    tracemalloc.stop()
+
+    profiles = {'cpu': cpu} if cpu is not None else {}
+    if 'tasks' in kinds:
+        profiles['tasks'] = tasks
+    if before is not None:
+        profiles['memory'] = _memory_stacks(before, after)
+    return {
+        'pid': os.getpid(),
+        'seconds': seconds,
+        'cpu_samples': sampler.samples if sampler else 0,
+        'focus': {kind: _focus_summary(stacks) for kind, stacks in profiles.items() if kind != 'memory'},
+        'profiles': {kind: folded(stacks) for kind, stacks in profiles.items()},
+    }
+
+
+def require_admin(request: Request):
+    """Dependency for admin routes; they do not exist unless ADMIN_TOKEN is set"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get('X-Admin-Token', '')
+    if not secrets.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+def _parse_kinds(kinds: Optional[str]) -> List[str]:
+    if not kinds:
+        return list(KINDS)
+    names = [kind.strip() for kind in kinds.split(',') if kind.strip()]
+    unknown = [kind for kind in names if kind not in KINDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown profile kinds: {', '.join(unknown)}")
+    return names
+
+
+async def profile_worker(seconds: float, kinds: Optional[str] = None, format: str = 'json'):
+    """
+    Profile the worker serving this request. format=folded returns a single kind as plain folded
+    stacks, ready for flamegraph.pl or speedscope
+    """
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS:g}")
+    names = _parse_kinds(kinds)
+    if format not in ('json', 'folded'):
+        raise HTTPException(status_code=400, detail="format must be json or folded")
+    if format == 'folded' and len(names) != 1:
+        raise HTTPException(status_code=400, detail="format=folded needs exactly one of kinds=cpu|tasks|memory")
+    result = await capture(seconds, names)
+    if format == 'folded':
+        return PlainTextResponse(result['profiles'][names[0]])
+    return result
+
+
+async def _capture_to_files():
+    try:
+        result = await capture(PROFILE_SIGNAL_SECONDS)
+    except HTTPException:
+        log.warn(f"Profile signal ignored by worker {os.getpid()}: a capture is already running")
+        return
+    prefix = os.path.join(PROFILE_DIR, f"profile-{os.getpid()}-{int(time.time())}")
+    for kind, text in result['profiles'].items():
+        with open(f'{prefix}.{kind}.folded', 'w') as f:
+            f.write(text)
+    log.info(f"Profile of worker {os.getpid()} written to {prefix}.*.folded")
+
+
+# Held so the capture task started by the signal is not garbage collected mid-run
+_signal_tasks = set()
+
+
+def _on_signal():
+    task = asyncio.get_running_loop().create_task(_capture_to_files())
+    _signal_tasks.add(task)
+    task.add_done_callback(_signal_tasks.discard)
+
+
+@on_worker_start
+async def _install_signal_handler():
+    # Registered once the worker's loop runs, after the server has installed its own handlers
+    if PROFILE_SIGNAL and hasattr(signal, PROFILE_SIGNAL):
+        try:
+            asyncio.get_running_loop().add_signal_handler(getattr(signal, PROFILE_SIGNAL), _on_signal)
+        except (NotImplementedError, RuntimeError, ValueError) as e:
+            log.warn(f"Profile signal handler not installed: {str(e)}")
+
+
+@on_worker_stop
+async def _remove_signal_handler():
+    if PROFILE_SIGNAL and hasattr(signal, PROFILE_SIGNAL):
+        try:
+            asyncio.get_running_loop().remove_signal_handler(getattr(signal, PROFILE_SIGNAL))
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
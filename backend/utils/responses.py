@@ -0,0 +1,92 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from utils.cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # Responses are gzipped only without the brotli package
+    brotli = None
+
+# Smaller bodies fit in a packet or two, where compressing saves less than it costs
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+# Quality 11 is far too slow for dynamic responses; 5 keeps most of the gain
+BROTLI_QUALITY = 5
+
+# Body of the OAuth callback pages that just close the popup; built once, sent as is
+CLOSE_WINDOW_PAGE = b'<html><script>window.close();</script></html>'
+
+# (etag, encoding) -> compressed body, so unchanged lists are not recompressed on every refresh
+_compressed = LRUCache(maxsize=64)
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def _negotiate_encoding(request: Request) -> Optional[str]:
+    accepted = _accepted_encodings(request.headers.get('accept-encoding', ''))
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return 'gzip'
+    return None
+
+
+def _compress(body: bytes, encoding: str, etag: str) -> bytes:
+    compressed = _compressed.get((etag, encoding))
+    if compressed is None:
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        _compressed.set((etag, encoding), compressed)
+    return compressed
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Weak comparison: a gzip and a brotli copy of the same list are the same list
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return any(tag.removeprefix('W/') == etag.removeprefix('W/') for tag in tags)
+
+
+def json_list_response(request: Request, content: Any) -> Response:
+    """
+    JSON response with a content-hash ETag, answering 304 when the client already has this
+    exact list (If-None-Match) and compressing larger bodies with brotli or gzip
+    """
+    body = json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(',', ':')
+    ).encode('utf-8')
+    etag = f'W/"{hashlib.sha256(body).hexdigest()[:32]}"'
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'private, no-cache'}
+
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+
+    encoding = _negotiate_encoding(request) if len(body) >= COMPRESSION_MIN_SIZE else None
+    if encoding:
+        body = _compress(body, encoding, etag)
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type='application/json', headers=headers)
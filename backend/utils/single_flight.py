@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from redis_client import acquire_lock, release_lock, add_key_value_redis, get_value_redis
+from utils.deadline import detached_task, within_deadline
+from utils.lifecycle import after_fork
+from utils.logger import log
+
+# Also collapse identical reads across worker processes through Redis
+SINGLE_FLIGHT_REDIS = os.environ.get('SINGLE_FLIGHT_REDIS', '').lower() in ('1', 'true', 'yes')
+# Upper bound on how long the leading worker may take before followers stop waiting on it
+LEADER_TTL = 30
+# Followers only need the result long enough to read it
+RESULT_TTL = 5
+POLL_INTERVAL = 0.02
+
+# key -> in-flight call in this process
+_calls: Dict[str, asyncio.Task] = {}
+
+
+@after_fork
+def _reset_after_fork():
+    _calls.clear()
+
+
+def fingerprint(secret: str) -> str:
+    """Stable short digest for keying flights on an access token without storing the token"""
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+async def single_flight(key: str, fn: Callable[[], Awaitable[Any]], distributed: Optional[bool] = None) -> Any:
+    """
+    Run fn once for all concurrent callers with the same key and share its result (or error).
+    Callers must treat the shared result as read-only. With distributed, the result must be
+    JSON serializable, since workers hand it to each other through Redis
+    """
+    if distributed is None:
+        distributed = SINGLE_FLIGHT_REDIS
+
+    task = _calls.get(key)
+    if task is None:
+        task = detached_task(_distributed_call(key, fn) if distributed else fn())
+        _calls[key] = task
+        task.add_done_callback(lambda _: _calls.pop(key, None))
+    # A caller going away (or out of time) must not cancel the call the others are waiting on
+    return await within_deadline(asyncio.shield(task))
+
+
+async def _distributed_call(key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+    lock_key = f'single_flight:{key}'
+    token = await acquire_lock(lock_key, LEADER_TTL)
+    if token:
+        try:
+            result = await fn()
+            await add_key_value_redis(f'single_flight_result:{key}:{token}', json.dumps(result), expire=RESULT_TTL)
+            return result
+        finally:
+            await release_lock(lock_key, token)
+
+    # Another worker leads this flight; its result is published under its lock token
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LEADER_TTL
+    leader = None
+    while loop.time() < deadline:
+        current = await get_value_redis(lock_key)
+        if current is not None:
+            leader = current.decode() if isinstance(current, bytes) else current
+        if leader is not None:
+            result = await get_value_redis(f'single_flight_result:{key}:{leader}')
+            if result is not None:
+                return json.loads(result)
+        if current is None:
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+
+    # Leader finished without a result for us (it failed, or we missed the window): go ourselves
+    log.info(f"Single-flight leader for {key} gave no result, calling upstream")
+    return await fn()
@@ -0,0 +1,348 @@
+"""
+Distributed tracing with W3C trace context and OTLP export.
+
+TraceMiddleware continues the trace started by the Lambda proxy (the `traceparent` header) or
+starts one, and opens a server span per request. Spans around upstream calls (HTTP through
+async_client(), Redis helpers, OpenAI) are children of it, and `traceparent` is forwarded on
+upstream HTTP requests, so one user action reads as proxy -> ALB -> backend -> Redis / HubSpot /
+OpenAI in the collector.
+
+Finished spans are buffered per worker and flushed every TRACE_EXPORT_INTERVAL seconds as OTLP/JSON
+to OTEL_EXPORTER_OTLP_ENDPOINT (POST {endpoint}/v1/traces) and/or appended to TRACE_FILE, one
+OTLP request per line, for tests and local runs. With neither set, tracing is off and spans cost
+a context-variable lookup.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from secrets import token_hex
+from typing import Dict, List, Optional
+
+import httpx
+
+from utils.lifecycle import after_fork, on_worker_start, on_worker_stop
+from utils.logger import log
+
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'hubspot-backend')
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT') or (
+    os.environ['OTEL_EXPORTER_OTLP_ENDPOINT'].rstrip('/') + '/v1/traces'
+    if os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT') else None
+)
+# Comma separated key=value pairs, e.g. an API key for a hosted collector
+OTLP_HEADERS = dict(
+    pair.split('=', 1) for pair in os.environ.get('OTEL_EXPORTER_OTLP_HEADERS', '').split(',') if '=' in pair
+)
+TRACE_FILE = os.environ.get('TRACE_FILE')
+# Share of traces started here that are recorded; traces continued from the proxy follow its decision
+SAMPLE_RATIO = float(os.environ.get('TRACE_SAMPLE_RATIO', 1.0))
+EXPORT_INTERVAL = float(os.environ.get('TRACE_EXPORT_INTERVAL', 5.0))
+EXPORT_TIMEOUT = 5.0
+# Spans buffered between exports; beyond this the oldest are dropped rather than growing unbounded
+MAX_BUFFERED_SPANS = 2048
+
+TRACING_ENABLED = bool(OTLP_ENDPOINT or TRACE_FILE)
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+# OTLP span kinds, and the status code of failed spans
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+STATUS_ERROR = 2
+
+
+class Span:
+    """One timed operation in a trace"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'sampled', 'attributes',
+                 'start_ns', 'end_ns', 'status', 'status_message')
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 attributes: Optional[Dict] = None):
+        self.trace_id = trace_id
+        self.span_id = token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes = attributes or {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = None
+        self.status_message = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = str(error) or type(error).__name__
+        self.attributes['exception.type'] = type(error).__name__
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            _record(self)
+
+    def to_otlp(self) -> Dict:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.status is not None:
+            span['status'] = {'code': self.status, 'message': self.status_message or ''}
+        return span
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        # OTLP/JSON carries 64-bit integers as strings
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def parse_traceparent(value: Optional[str]):
+    """(trace id, parent span id, sampled) from a W3C traceparent header, or None if invalid"""
+    match = TRACEPARENT.match(value.strip().lower()) if value else None
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def start_span(name: str, kind: int = INTERNAL, traceparent: Optional[str] = None, **attributes) -> Span:
+    """
+    A span that is a child of the current one, of the given traceparent, or the root of a new
+    trace. The caller ends it; `span()` is the usual way to use one
+    """
+    parent = parse_traceparent(traceparent) if traceparent else None
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        current = _current.get()
+        if current is not None:
+            trace_id, parent_id, sampled = current.trace_id, current.span_id, current.sampled
+        else:
+            trace_id, parent_id, sampled = token_hex(16), None, random.random() < SAMPLE_RATIO
+    return Span(name, kind, trace_id, parent_id, sampled, attributes)
+
+
+@contextmanager
+def span(name: str, kind: int = INTERNAL, traceparent: Optional[str] = None, root: bool = False, **attributes):
+    """
+    Time the block as a child span of the current one (or of `traceparent`). Outside any trace it
+    starts a new one only when `root` is set, so background polling does not emit a trace per call.
+    Yields None when nothing is traced
+    """
+    if not TRACING_ENABLED or (_current.get() is None and not traceparent and not root):
+        yield None
+        return
+    current = start_span(name, kind, traceparent, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+            current.fail(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+def current_traceparent() -> Optional[str]:
+    """The current span as a traceparent value, to continue the trace somewhere else (e.g. a job)"""
+    current = _current.get()
+    return current.traceparent if current is not None else None
+
+
+def inject(headers) -> None:
+    """Add the current span's traceparent to outgoing request headers"""
+    current = _current.get()
+    if current is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent
+
+
+class TraceMiddleware:
+    """ASGI middleware opening a server span per request, continuing the caller's trace"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING_ENABLED or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        traceparent = None
+        for name, value in scope['headers']:
+            if name == b'traceparent':
+                traceparent = value.decode('latin-1')
+                break
+        method = scope['method']
+        server = start_span(method, SERVER, traceparent, **{
+            'http.request.method': method,
+            'url.path': scope['path'],
+        })
+        token = _current.set(server)
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                server.set(**{'http.response.status_code': status})
+                if status >= 500:
+                    server.status = STATUS_ERROR
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            server.fail(e)
+            raise
+        finally:
+            # Named after the route template once routing has matched one, so spans group by endpoint
+            route = scope.get('route')
+            if route is not None and getattr(route, 'path', None):
+                server.name = f'{method} {route.path}'
+                server.set(**{'http.route': route.path})
+            _current.reset(token)
+            server.end()
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """Client span around each upstream HTTP request, with traceparent forwarded to the upstream"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if not TRACING_ENABLED or _current.get() is None:
+            return await self._transport.handle_async_request(request)
+        with span(f'{request.method} {request.url.host}', CLIENT, **{
+            'http.request.method': request.method,
+            'server.address': request.url.host,
+            'url.path': request.url.path,
+        }) as current:
+            inject(request.headers)
+            response = await self._transport.handle_async_request(request)
+            current.set(**{'http.response.status_code': response.status_code})
+            if response.status_code >= 400:
+                current.status = STATUS_ERROR
+            return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# Finished spans waiting for the next export, and spans dropped because the buffer was full
+_buffer: List[Span] = []
+_dropped = 0
+_export_task: Optional[asyncio.Task] = None
+
+
+def _record(finished: Span):
+    global _dropped
+    _buffer.append(finished)
+    if len(_buffer) > MAX_BUFFERED_SPANS:
+        del _buffer[0]
+        _dropped += 1
+
+
+def _otlp_request(spans: List[Span]) -> Dict:
+    return {'resourceSpans': [{
+        'resource': {'attributes': [
+            _otlp_attribute('service.name', SERVICE_NAME),
+            _otlp_attribute('process.pid', os.getpid()),
+        ]},
+        'scopeSpans': [{'scope': {'name': 'backend'}, 'spans': [finished.to_otlp() for finished in spans]}],
+    }]}
+
+
+def _append_to_file(line: str):
+    with open(TRACE_FILE, 'a') as f:
+        f.write(line + '\n')
+
+
+async def flush():
+    """Export the buffered spans now"""
+    global _dropped
+    if not _buffer:
+        return
+    spans = _buffer[:]
+    del _buffer[:]
+    body = json.dumps(_otlp_request(spans), separators=(',', ':'))
+    if _dropped:
+        log.warn(f"Dropped {_dropped} trace spans: export could not keep up")
+        _dropped = 0
+    if TRACE_FILE:
+        await asyncio.to_thread(_append_to_file, body)
+    if OTLP_ENDPOINT:
+        try:
+            # A plain client: exporting must not itself be traced, limited or bounded by a request deadline
+            async with httpx.AsyncClient(timeout=EXPORT_TIMEOUT) as client:
+                response = await client.post(OTLP_ENDPOINT, content=body, headers={
+                    'Content-Type': 'application/json', **OTLP_HEADERS,
+                })
+            if response.status_code >= 400:
+                log.warn(f"Trace export rejected with {response.status_code}: {response.text[:200]}")
+        except httpx.HTTPError as e:
+            log.warn(f"Trace export failed: {str(e)}")
+
+
+async def _export_loop():
+    while True:
+        await asyncio.sleep(EXPORT_INTERVAL)
+        try:
+            await flush()
+        except Exception as e:
+            log.error(f"Trace export failed: {str(e)}")
+
+
+@on_worker_start
+async def _start_exporter():
+    global _export_task
+    if TRACING_ENABLED:
+        _export_task = asyncio.create_task(_export_loop())
+
+
+@on_worker_stop
+async def _stop_exporter():
+    global _export_task
+    if _export_task is not None:
+        _export_task.cancel()
+        _export_task = None
+    await flush()
+
+
+@after_fork
+def _reset_after_fork():
+    # Spans recorded in the master (while preloading) are not this worker's to export
+    global _export_task, _dropped
+    del _buffer[:]
+    _dropped = 0
+    _export_task = None
@@ -0,0 +1,27 @@
+"""
+Run background job workers without the HTTP server, e.g. to scale job throughput separately:
+
+    JOB_WORKERS=0 uvicorn main:app     # API only enqueues
+    python worker.py                   # JOB_WORKERS workers (default 2) process the queue
+"""
+import asyncio
+import os
+
+import main  # noqa: F401 - registers the job handlers
+from jobs import start_workers, stop_workers
+from utils.logger import log
+
+
+async def run():
+    start_workers(int(os.environ.get('JOB_WORKERS', 2)) or 1)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stop_workers()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        log.info("Job workers stopped")
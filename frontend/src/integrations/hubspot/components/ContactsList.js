@@ -14,9 +14,12 @@ import { deleteContact } from '../utils/api';
 
 const ContactsList = ({ 
     contacts, 
+    total,
     isLoading, 
+    hasMore,
     credentials,
-    onRefresh 
+    onRefresh,
+    onLoadMore
 }) => {
     const [selectedContact, setSelectedContact] = useState(null);
     const [showDialog, setShowDialog] = useState(false);
@@ -44,7 +47,8 @@ const ContactsList = ({
         }
     };
 
-    if (isLoading) {
+    // Later windows load below the cards already shown instead of replacing them
+    if (isLoading && !contacts.length) {
         return (
             <Box display="flex" justifyContent="center" sx={{ my: 4 }}>
                 <CircularProgress sx={{ color: '#ff7a59' }} />
@@ -56,7 +60,7 @@ const ContactsList = ({
         <>
             <Box display="flex" justifyContent="space-between" sx={{ mb: 3 }}>
                 <Typography variant="h5">
-                    Contacts ({contacts.length})
+                    Contacts ({total ?? contacts.length})
                 </Typography>
                 <Button
                     variant="contained"
@@ -91,6 +95,14 @@ const ContactsList = ({
                 </Grid>
             )}
 
+            {hasMore && (
+                <Box display="flex" justifyContent="center" sx={{ mt: 3 }}>
+                    <Button variant="outlined" onClick={onLoadMore} disabled={isLoading}>
+                        {isLoading ? 'Loading...' : `Load more (${contacts.length} of ${total})`}
+                    </Button>
+                </Box>
+            )}
+
             <ContactDialog
                 open={showDialog}
                 onClose={() => setShowDialog(false)}
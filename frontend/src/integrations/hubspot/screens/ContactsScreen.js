@@ -18,6 +18,8 @@ const ContactsScreen = ({
     setIsConnected 
 }) => {
     const [contacts, setContacts] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [total, setTotal] = useState(0);
     const [isLoading, setIsLoading] = useState(false);
     const [searchQuery, setSearchQuery] = useState('');
     const [filters, setFilters] = useState({});
@@ -29,7 +31,9 @@ const ContactsScreen = ({
             credentials: integrationParams.credentials,
             setContacts,
             setIsLoading,
-            setError
+            setError,
+            setNextCursor,
+            setTotal
         });
     }, [integrationParams.credentials]);
 
@@ -76,7 +80,9 @@ const ContactsScreen = ({
                             credentials: integrationParams.credentials,
                             setContacts,
                             setIsLoading,
-                            setError
+                            setError,
+                            setNextCursor,
+                            setTotal
                         })}
                         disabled={isLoading}
                         sx={{ ml: 1 }}
@@ -102,13 +108,26 @@ const ContactsScreen = ({
             <Container maxWidth="lg" sx={{ py: 4 }}>
                 <ContactsList 
                     contacts={contacts}
+                    total={total}
                     isLoading={isLoading}
+                    hasMore={Boolean(nextCursor)}
+                    onLoadMore={() => fetchContacts({
+                        credentials: integrationParams.credentials,
+                        cursor: nextCursor,
+                        setContacts,
+                        setIsLoading,
+                        setError,
+                        setNextCursor,
+                        setTotal
+                    })}
                     credentials={integrationParams.credentials}
                     onRefresh={() => fetchContacts({
                         credentials: integrationParams.credentials,
                         setContacts,
                         setIsLoading,
-                        setError
+                        setError,
+                        setNextCursor,
+                        setTotal
                     })}
                 />
                 <ContactDialog 
@@ -121,7 +140,9 @@ const ContactsScreen = ({
                             credentials: integrationParams.credentials,
                             setContacts,
                             setIsLoading,
-                            setError
+                            setError,
+                            setNextCursor,
+                            setTotal
                         });
                     }}
                 />
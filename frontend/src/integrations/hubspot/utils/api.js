@@ -16,6 +16,11 @@ const getApiBaseUrl = async () => {
 
 const API_BASE_URL = await getApiBaseUrl();
 
+// Credentials hold an opaque session handle; tokens never leave the backend
+const sessionHeaders = (credentials) => ({
+    Authorization: `Bearer ${credentials?.session}`
+});
+
 // Error handler utility
 const handleApiError = (error) => {
     // Handle axios error response
@@ -114,22 +119,54 @@ export const handleWindowClosed = async ({
 };
 
 // Contact Management APIs
+// Fields the contact list renders; detail views can ask for more, including custom properties
+export const LIST_PROPERTIES = ['firstname', 'lastname', 'email', 'phone', 'company'];
+
+// Contacts are loaded one window at a time; the backend hands back an opaque cursor for the next one
+export const CONTACTS_PAGE_SIZE = 200;
+
+// Last response per contacts request, revalidated with its ETag so unchanged lists come back as an empty 304
+const contactWindows = new Map();
+
 export const fetchContacts = async ({
                                         credentials,
                                         setContacts,
                                         setIsLoading,
-                                        setError
+                                        setError,
+                                        setNextCursor = () => {},
+                                        setTotal = () => {},
+                                        cursor = null,
+                                        properties = LIST_PROPERTIES
                                     }) => {
     try {
         setIsLoading(true);
-        const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
 
+        const params = cursor
+            ? {cursor, properties: properties.join(',')}
+            : {page_size: CONTACTS_PAGE_SIZE, sort: 'name', properties: properties.join(',')};
+        const cacheKey = JSON.stringify({session: credentials?.session, params});
+        const cached = contactWindows.get(cacheKey);
         const response = await axios.post(
             `${API_BASE_URL}/load`,
-            formData
+            null,
+            {
+                headers: {
+                    ...sessionHeaders(credentials),
+                    ...(cached ? {'If-None-Match': cached.etag} : {})
+                },
+                params,
+                validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+            }
         );
-        setContacts(response.data);
+        if (response.status !== 304 && response.headers.etag) {
+            contactWindows.set(cacheKey, {etag: response.headers.etag, data: response.data});
+        }
+        const data = response.status === 304 ? cached.data : response.data;
+        const {items, total, next_cursor: nextCursor} = data;
+        // A cursor continues the current listing; without one the listing starts over
+        setContacts((previous) => (cursor ? [...previous, ...items] : items));
+        setNextCursor(nextCursor);
+        setTotal(total);
     } catch (error) {
         const err = handleApiError(error);
         setError(err.message);
@@ -138,6 +175,23 @@ export const fetchContacts = async ({
     }
 };
 
+export const fetchContactProperties = async ({
+                                                 credentials,
+                                                 setError
+                                             }) => {
+    try {
+        const response = await axios.get(
+            `${API_BASE_URL}/properties`,
+            {headers: sessionHeaders(credentials)}
+        );
+        return response.data || [];
+    } catch (error) {
+        const err = handleApiError(error);
+        setError(err.message);
+        return [];
+    }
+};
+
 export const createContact = async ({
                                         credentials,
                                         contactData,
@@ -145,12 +199,12 @@ export const createContact = async ({
                                     }) => {
     try {
         const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
         formData.append('contact_data', JSON.stringify(contactData));
 
         const response = await axios.post(
             `${API_BASE_URL}/contacts`,
-            formData
+            formData,
+            {headers: sessionHeaders(credentials)}
         );
 
         return response.data;
@@ -169,12 +223,12 @@ export const updateContact = async ({
                                     }) => {
     try {
         const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
         formData.append('contact_data', JSON.stringify(contactData));
 
         const response = await axios.patch(
             `${API_BASE_URL}/contacts/${contactId}`,
-            formData
+            formData,
+            {headers: sessionHeaders(credentials)}
         );
 
         return response.data;
@@ -191,12 +245,9 @@ export const deleteContact = async ({
                                         setError
                                     }) => {
     try {
-        const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
-
         await axios.delete(
             `${API_BASE_URL}/contacts/${contactId}`,
-            {data: formData}
+            {headers: sessionHeaders(credentials)}
         );
 
         return true;
@@ -217,13 +268,13 @@ export const uploadContactFile = async ({
                                         }) => {
     try {
         const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
         formData.append('file', file);
 
         const response = await axios.post(
             `${API_BASE_URL}/contacts/${contactId}/files`,
             formData,
             {
+                headers: sessionHeaders(credentials),
                 onUploadProgress: (progressEvent) => {
                     if (onProgress) {
                         const percentCompleted = Math.round(
@@ -251,12 +302,7 @@ export const getContactFiles = async ({
     try {
         const response = await axios.get(
             `${API_BASE_URL}/contacts/${contactId}/files`, {
-                params: {
-                    credentials: JSON.stringify(credentials)
-                },
-                headers: {
-                    'Content-Type': 'application/json'
-                }
+                headers: sessionHeaders(credentials)
             }
         );
 
@@ -307,13 +353,13 @@ export const searchContacts = async ({
                                      }) => {
     try {
         const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
         formData.append('query', query);
         formData.append('filters', JSON.stringify(filters));
 
         const response = await axios.post(
             `${API_BASE_URL}/search`,
-            formData
+            formData,
+            {headers: sessionHeaders(credentials)}
         );
 
         return response.data;
@@ -330,12 +376,10 @@ export const checkCredentials = async ({
                                            setError
                                        }) => {
     try {
-        const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
-
         const response = await axios.post(
             `${API_BASE_URL}/check-credentials`,
-            formData
+            null,
+            {headers: sessionHeaders(credentials)}
         );
 
         return response.data;
@@ -352,13 +396,10 @@ export const getGptResponse = async ({
 }) => {
     try {
 
-        const formData = new FormData();
-        formData.append('credentials', JSON.stringify(credentials));
-        formData.append('contact_id', JSON.stringify(contactId));
-
         const response = await axios.post(
             `${API_BASE_URL}/contacts/${contactId}/summarize`,
-            formData
+            null,
+            {headers: sessionHeaders(credentials)}
         );
 
         return response.data;